@@ -1,15 +1,26 @@
 import aiohttp
+import asyncio
 import base64
+import hashlib
 import html
 import json
-from typing import Optional, List, Dict, Any, AsyncIterator
+import logging
+import contextlib
+import time
+from collections import OrderedDict, deque
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable, Tuple
 from bot.storage import storage
-from bot.config import CHAT_HISTORY_LIMIT
+from bot.http_clients import http_clients
+from bot.context import ContextReport, assemble_history, estimate_tokens
+from bot.sse import iter_sse
+from bot.config import AI_CACHE_SIZE, AI_HEDGE_AFTER_MS, AI_SUMMARY_KEEP_TURNS, CHAT_HISTORY_LIMIT
+
+logger = logging.getLogger(__name__)
 
 # Providers that support our streaming implementation
 STREAMING_PROVIDERS = {
     "openai", "anthropic", "gemini", "groq", "together",
-    "openrouter", "mistral", "xai", "deepseek",
+    "openrouter", "mistral", "xai", "deepseek", "cohere",
 }
 
 PROVIDERS = [
@@ -43,9 +54,17 @@ PROVIDER_MODELS = {
     "cohere": ["command-r-plus", "command-r", "command-light"]
 }
 
+# OpenAI-compatible APIs that accept stream_options.include_usage (usage in the
+# last chunk — how prompt-cache hits are seen on streamed replies); others 400 on it
+STREAM_USAGE_PROVIDERS = {"openai", "deepseek"}
+
 # Providers that support vision (image input)
 VISION_PROVIDERS = {"openai", "anthropic", "gemini", "openrouter"}
 
+# Failover (/failover): at most this many providers per request, the user's own
+# provider included. Backups run with their DEFAULT_MODELS entry.
+FAILOVER_MAX_PROVIDERS = 3
+
 PROVIDER_CONFIGS = {
     "openai":     ("https://api.openai.com/v1/chat/completions", "bearer"),
     "groq":       ("https://api.groq.com/openai/v1/chat/completions", "bearer"),
@@ -56,7 +75,6 @@ PROVIDER_CONFIGS = {
     "xai":        ("https://api.x.ai/v1/chat/completions", "bearer"),
 }
 
-REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=60)
 
 
 def _no_key_msg(lang: str, provider: str) -> str:
@@ -71,6 +89,15 @@ def _no_key_msg(lang: str, provider: str) -> str:
     return msgs.get(lang, msgs["en"])
 
 
+def _no_vision_msg(lang: str, provider: str) -> str:
+    _detail = {
+        "ru": "этот провайдер не поддерживает анализ изображений. Используйте openai, anthropic, gemini или openrouter.",
+        "en": "this provider does not support image analysis. Use openai, anthropic, gemini, or openrouter.",
+        "it": "questo provider non supporta l'analisi delle immagini. Usa openai, anthropic, gemini o openrouter.",
+    }
+    return _err_msg(lang, provider, _detail.get(lang, _detail["en"]))
+
+
 def _err_msg(lang: str, provider: str, detail: str) -> str:
     # Provider error strings can contain <, >, & — escape so HTML parsers
     # downstream (we send these with parse_mode="HTML") don't blow up.
@@ -83,7 +110,616 @@ def _err_msg(lang: str, provider: str, detail: str) -> str:
     return msgs.get(lang, msgs["en"])
 
 
+# Opt-in response cache: call site → seconds an answer stays valid. Only
+# stateless calls whose output is a function of their input belong here.
+CACHE_TTLS = {
+    "translate": 24 * 3600,
+    "summary": 15 * 60,     # the prompt carries the buffer, so new messages miss anyway
+    "reminder": 60,         # the prompt carries the current minute
+    "document": 3600,
+}
+
+
+class ResponseCache:
+    """Size-bounded LRU of AI answers with per-entry expiry."""
+
+    def __init__(self, max_entries: int = AI_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.by_site: Dict[str, List[int]] = {}  # site -> [hits, misses]
+
+    @staticmethod
+    def key(site: str, user_id: int, provider: str, model: str,
+            system_prompt: Optional[str], prompt: str) -> Tuple:
+        # Prompts can be 12k chars (documents) — keep a digest, not the text.
+        digest = hashlib.sha256(f"{system_prompt or ''}\0{prompt}".encode()).digest()
+        return (site, user_id, provider, model, digest)
+
+    def get(self, key: Tuple) -> Optional[str]:
+        counts = self.by_site.setdefault(key[0], [0, 0])
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            counts[0] += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        counts[1] += 1
+        return None
+
+    def put(self, key: Tuple, value: str, ttl: float):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "by_site": {site: {"hits": h, "misses": m} for site, (h, m) in sorted(self.by_site.items())},
+        }
+
+
+# Rolling summary: fold once this many turns beyond AI_SUMMARY_KEEP_TURNS have
+# piled up (one summarizer call per few replies, not per reply).
+SUMMARY_FOLD_TURNS = 4
+# Both are bounded by the stored history (CHAT_HISTORY_LIMIT turns): a fold has
+# to start while there's still room, or old turns get trimmed unsummarized.
+SUMMARY_KEEP_TURNS = max(min(AI_SUMMARY_KEEP_TURNS, CHAT_HISTORY_LIMIT - 2), 0)
+SUMMARY_FOLD_AT = min((SUMMARY_KEEP_TURNS + SUMMARY_FOLD_TURNS) * 2, CHAT_HISTORY_LIMIT * 2 - 2)
+SUMMARY_MAX_CHARS = 1500
+# After a failed fold (bad key, rate limit) don't try again for this user for a while
+SUMMARY_RETRY_S = 10 * 60
+# Cheap model per provider for the summarizer; others use the user's model.
+SUMMARY_MODELS = {
+    "gemini": "gemini-2.0-flash-lite",
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-5-haiku-20241022",
+    "groq": "llama-3.1-8b-instant",
+    "together": "meta-llama/Llama-3.1-8B-Instruct-Turbo",
+    "mistral": "mistral-small-latest",
+    "xai": "grok-3-mini",
+    "cohere": "command-r",
+}
+
+
+def _key_owner(api_key: str) -> str:
+    """Stable id for whoever pays for calls made with `api_key` (never the key itself)."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+# ---- Provider health: circuit breaker + AIMD concurrency limit ----
+# One tracker per provider (5xx, timeouts, dead connections hit everyone) and
+# one per API key (429 is that key's rate limit).
+BREAKER_FAILURES = 5        # consecutive overloads that open the circuit
+BREAKER_COOLDOWN_S = 10     # first open period; doubles per failed probe
+BREAKER_COOLDOWN_MAX_S = 120
+AIMD_START = 8              # concurrent calls allowed before any feedback
+PROVIDER_MAX_CONCURRENCY = 64
+KEY_MAX_CONCURRENCY = 16
+SLOT_WAIT_S = 15            # queueing for a slot longer than this fails fast
+_KEY_BREAKERS_MAX = 5000
+
+
+class ProviderOverloaded(Exception):
+    """429 / 5xx from a provider — feeds the breaker."""
+
+    def __init__(self, status: int, retry_after: Optional[float], message: str):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ProviderUnavailable(Exception):
+    """Failing fast: circuit open, or no concurrency slot in time."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"unavailable for {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def _retry_after(headers) -> Optional[float]:
+    try:
+        return max(float(headers.get("Retry-After", "")), 0.0)
+    except ValueError:
+        return None
+
+
+async def _raise_if_overloaded(resp: aiohttp.ClientResponse):
+    if resp.status == 429 or resp.status >= 500:
+        body = await resp.text()
+        try:
+            err = json.loads(body).get("error", body)
+            body = err.get("message", str(err)) if isinstance(err, dict) else str(err)
+        except (json.JSONDecodeError, AttributeError):
+            pass
+        raise ProviderOverloaded(resp.status, _retry_after(resp.headers), f"HTTP {resp.status}: {body[:300]}")
+
+
+def _unavailable_msg(lang: str, provider: str, seconds: float) -> str:
+    s = max(int(seconds + 0.999), 1)
+    msgs = {
+        "ru": f"❌ ⏳ <b>{provider}</b> сейчас перегружен или недоступен. Попробуйте через {s} с.",
+        "en": f"❌ ⏳ <b>{provider}</b> is overloaded or down right now. Try again in {s}s.",
+        "it": f"❌ ⏳ <b>{provider}</b> è sovraccarico o non disponibile. Riprova tra {s} s.",
+    }
+    return msgs.get(lang, msgs["en"])
+
+
+class _Breaker:
+    """Circuit breaker + AIMD concurrency limit for one provider or API key."""
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = float(min(AIMD_START, max_limit))
+        self.in_flight = 0
+        self.state = "closed"       # closed → open → half_open → closed/open
+        self.failures = 0           # consecutive overloads
+        self.open_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN_S
+        self.probing = False
+        self.last_cut = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._waiters: deque = deque()
+
+    def blocked_for(self, now: float) -> float:
+        if self.state == "open":
+            if now < self.open_until:
+                return self.open_until - now
+            self.state = "half_open"
+        if self.state == "half_open" and self.probing:
+            return 1.0  # one probe at a time
+        return 0.0
+
+    async def acquire(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await asyncio.wait_for(fut, SLOT_WAIT_S)  # _wake() hands the slot over
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise ProviderUnavailable(SLOT_WAIT_S) from None
+            except BaseException:
+                if fut.done() and not fut.cancelled():
+                    self.release()
+                raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_flight += 1
+                fut.set_result(None)
+
+    def _close(self):
+        self.failures = 0
+        self.probing = False
+        if self.state != "closed":
+            self.state = "closed"
+            self.cooldown = BREAKER_COOLDOWN_S
+
+    def success(self):
+        self._close()
+        self.limit = min(self.limit + 1 / self.limit, self.max_limit)  # +1 per `limit` successes
+        self._wake()
+
+    def answered(self):
+        """A non-overload error: the upstream is alive, the call just failed."""
+        self._close()
+
+    def overload(self, now: float, retry_after: Optional[float] = None):
+        self.failures += 1
+        self.probing = False
+        if now - self.last_cut >= 1.0:  # halve at most once per second of bad answers
+            self.limit = max(self.limit / 2, 1.0)
+            self.last_cut = now
+        if retry_after:
+            self._trip(now, retry_after)
+        elif self.state == "half_open" or self.failures >= BREAKER_FAILURES:
+            self._trip(now, self.cooldown)
+            self.cooldown = min(self.cooldown * 2, BREAKER_COOLDOWN_MAX_S)
+
+    def _trip(self, now: float, seconds: float):
+        if self.state != "open":
+            self.trips += 1
+        self.state = "open"
+        self.open_until = max(self.open_until, now + min(seconds, BREAKER_COOLDOWN_MAX_S))
+
+    def idle(self) -> bool:
+        return self.state == "closed" and not self.in_flight and not self._waiters
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "open_for_s": round(max(self.open_until - now, 0.0), 1) if self.state == "open" else 0,
+            "limit": round(self.limit, 1),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+class ProviderHealth:
+    def __init__(self):
+        self._providers: Dict[str, _Breaker] = {}
+        self._keys: "OrderedDict[Tuple[str, str], _Breaker]" = OrderedDict()
+
+    def _key_breaker(self, provider: str, api_key: str) -> _Breaker:
+        key = (provider, _key_owner(api_key))
+        breaker = self._keys.get(key)
+        if breaker is None:
+            breaker = self._keys[key] = _Breaker(KEY_MAX_CONCURRENCY)
+            if len(self._keys) > _KEY_BREAKERS_MAX:
+                for old in [k for k, b in self._keys.items() if b.idle()][:len(self._keys) // 10]:
+                    del self._keys[old]
+        self._keys.move_to_end(key)
+        return breaker
+
+    @contextlib.asynccontextmanager
+    async def guard(self, provider: str, api_key: str):
+        """Admit one call (or raise ProviderUnavailable) and learn from how it ended."""
+        prov = self._providers.get(provider)
+        if prov is None:
+            prov = self._providers[provider] = _Breaker(PROVIDER_MAX_CONCURRENCY)
+        key = self._key_breaker(provider, api_key)
+        now = time.monotonic()
+        for breaker in (prov, key):
+            wait = breaker.blocked_for(now)
+            if wait:
+                breaker.rejected += 1
+                raise ProviderUnavailable(wait)
+        probes = [b for b in (prov, key) if b.state == "half_open"]
+        for b in probes:
+            b.probing = True
+        try:
+            await prov.acquire()
+            try:
+                await key.acquire()
+            except BaseException:
+                prov.release()
+                raise
+        except BaseException:
+            for b in probes:
+                b.probing = False
+            raise
+        try:
+            yield
+        except ProviderOverloaded as e:
+            now = time.monotonic()
+            if e.status == 429:
+                key.overload(now, e.retry_after)
+                prov.answered()
+            else:
+                prov.overload(now, e.retry_after)
+                key.answered()
+            raise
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+            prov.overload(time.monotonic())
+            key.answered()
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            # A hedge loser, an abandoned call or a stream closed early — says
+            # nothing about the upstream
+            for b in probes:
+                b.probing = False
+            raise
+        except BaseException:
+            prov.answered()
+            key.answered()
+            raise
+        else:
+            prov.success()
+            key.success()
+        finally:
+            key.release()
+            prov.release()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        keys = list(self._keys.values())
+        return {
+            "providers": {name: b.stats(now) for name, b in sorted(self._providers.items())},
+            "keys_tracked": len(keys),
+            "keys_open": sum(1 for b in keys if b.state != "closed"),
+        }
+
+
+# ---- Request bodies, shared by the plain and streaming calls ----
+
+def _openai_messages(prompt, system_prompt, history, image_b64=None, image_mime="image/jpeg") -> List[Dict[str, Any]]:
+    messages: List[Dict[str, Any]] = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    for m in history:
+        messages.append({"role": m["role"], "content": m["content"]})
+    if image_b64:
+        messages.append({"role": "user", "content": [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {"url": f"data:{image_mime};base64,{image_b64}"}},
+        ]})
+    else:
+        messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+_EPHEMERAL = {"type": "ephemeral"}
+
+
+def _anthropic_body(model, prompt, system_prompt, history, image_b64=None, image_mime="image/jpeg") -> Dict[str, Any]:
+    # Two prompt-cache breakpoints: after the system prompt (base + persona +
+    # memory, the same every turn) and after the history, so the next turn
+    # reads this whole conversation prefix from cache. Anthropic ignores
+    # breakpoints on prefixes too short to cache.
+    messages = list(history)
+    if messages:
+        last = messages[-1]
+        messages[-1] = {"role": last["role"],
+                        "content": [{"type": "text", "text": last["content"], "cache_control": _EPHEMERAL}]}
+    if image_b64:
+        messages.append({"role": "user", "content": [
+            {"type": "image", "source": {"type": "base64", "media_type": image_mime, "data": image_b64}},
+            {"type": "text", "text": prompt},
+        ]})
+    else:
+        messages.append({"role": "user", "content": prompt})
+    payload: Dict[str, Any] = {"model": model, "max_tokens": 2048, "messages": messages}
+    if system_prompt:
+        payload["system"] = [{"type": "text", "text": system_prompt, "cache_control": _EPHEMERAL}]
+    return payload
+
+
+def _gemini_body(prompt, system_prompt, history, image_b64=None, image_mime="image/jpeg") -> Dict[str, Any]:
+    contents = []
+    for m in history:
+        role = "model" if m["role"] == "assistant" else "user"
+        contents.append({"role": role, "parts": [{"text": m["content"]}]})
+    user_parts: List[Dict[str, Any]] = [{"text": prompt}]
+    if image_b64:
+        user_parts.append({"inline_data": {"mime_type": image_mime, "data": image_b64}})
+    contents.append({"role": "user", "parts": user_parts})
+    payload: Dict[str, Any] = {"contents": contents}
+    if system_prompt:
+        payload["systemInstruction"] = {"parts": [{"text": system_prompt}]}
+    return payload
+
+
+# ---- Streaming: SSE events (bot/sse.py) → text deltas ----
+# Extractors get one decoded event payload; they return its text (or None)
+# and raise _StreamDone on the provider's end-of-stream marker.
+
+class _StreamDone(Exception):
+    pass
+
+
+def _openai_delta(obj: dict) -> Optional[str]:
+    choices = obj.get("choices") or ({},)
+    return (choices[0].get("delta") or {}).get("content")
+
+
+def _anthropic_delta(obj: dict) -> Optional[str]:
+    kind = obj.get("type")
+    if kind == "content_block_delta":
+        return (obj.get("delta") or {}).get("text")
+    if kind == "message_stop":
+        raise _StreamDone
+    if kind == "error":  # mid-stream error event, e.g. overloaded_error
+        err = obj.get("error") or {}
+        if err.get("type") == "overloaded_error":
+            raise ProviderOverloaded(529, None, err.get("message", "overloaded"))
+        raise Exception(err.get("message", str(err)))
+    return None
+
+
+def _cohere_delta(obj: dict) -> Optional[str]:
+    kind = obj.get("type")
+    if kind == "content-delta":
+        return (((obj.get("delta") or {}).get("message") or {}).get("content") or {}).get("text")
+    if kind == "message-end":
+        raise _StreamDone
+    return None
+
+
+def _gemini_delta(obj: dict) -> Optional[str]:
+    cand = (obj.get("candidates") or ({},))[0]
+    parts = (cand.get("content") or {}).get("parts") or ()
+    return "".join(p.get("text") or "" for p in parts)
+
+
+def _prompt_usage(obj: dict) -> Optional[Tuple[int, int]]:
+    """(prompt tokens, of which read from the provider's prompt cache) from a
+    response body or stream event, whichever provider's shape it has."""
+    meta = obj.get("usageMetadata")  # Gemini
+    if meta:
+        return meta.get("promptTokenCount") or 0, meta.get("cachedContentTokenCount") or 0
+    usage = obj.get("usage") or (obj.get("message") or {}).get("usage")  # (Anthropic message_start)
+    if not usage:
+        return None
+    if "input_tokens" in usage:  # Anthropic: input_tokens is only the uncached part
+        read = usage.get("cache_read_input_tokens") or 0
+        return usage["input_tokens"] + read + (usage.get("cache_creation_input_tokens") or 0), read
+    if "prompt_tokens" in usage:  # OpenAI-compatible; DeepSeek names its own field
+        cached = ((usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+                  or usage.get("prompt_cache_hit_tokens") or 0)
+        return usage["prompt_tokens"] or 0, cached
+    return None
+
+
+async def _sse_deltas(resp: aiohttp.ClientResponse, extract: Callable[[dict], Optional[str]],
+                      on_usage: Optional[Callable[[Tuple[int, int]], None]] = None) -> AsyncIterator[str]:
+    """Text deltas of an SSE response. `on_usage` gets the stream's last
+    reported prompt usage once it ends (Gemini repeats it on every chunk)."""
+    usage = None
+    try:
+        async for event in iter_sse(resp.content):
+            if event.data == b"[DONE]":
+                return
+            try:
+                obj = json.loads(event.data.decode())
+                if on_usage is not None:
+                    usage = _prompt_usage(obj) or usage
+                text = extract(obj)
+            except _StreamDone:
+                return
+            except (json.JSONDecodeError, UnicodeDecodeError, IndexError, AttributeError, TypeError):
+                continue
+            if text:
+                yield text
+    finally:
+        if usage is not None:
+            on_usage(usage)
+
+
+# ---- Gemini explicit context caching ----
+# Anthropic and the OpenAI-compatible APIs cache a repeated prompt prefix by
+# themselves (given breakpoints / a stable order); Gemini's implicit caching
+# only covers some models, so a long system prompt that keeps coming back is
+# uploaded once as a cachedContents object and referenced by name.
+GEMINI_CACHE_TTL_S = 900
+# Smallest prompt a cache may hold, by model family (smaller ones are refused)
+GEMINI_CACHE_MIN_TOKENS = {"pro": 4096}
+GEMINI_CACHE_MIN_TOKENS_DEFAULT = 1024   # flash, flash-lite
+GEMINI_CACHE_AFTER_USES = 2      # a prompt seen once may never repeat — don't pay for storage
+GEMINI_API = "https://generativelanguage.googleapis.com/v1beta"
+
+
+class GeminiContextCaches:
+    def __init__(self, max_entries: int = 500):
+        self.max_entries = max_entries
+        # key -> [cache name or None, expires_at (or retry-after for failures), uses]
+        self._entries: "OrderedDict[Tuple, List[Any]]" = OrderedDict()
+        self._creating: Dict[Tuple, asyncio.Task] = {}
+        self._refreshing: Dict[Tuple, asyncio.Task] = {}
+        self.created = 0
+        self.refreshed = 0
+        self.failed = 0
+
+    @staticmethod
+    def _key(api_key: str, model: str, system_prompt: str) -> Tuple:
+        return _key_owner(api_key), model, hashlib.sha256(system_prompt.encode("utf-8")).digest()
+
+    @staticmethod
+    def min_tokens(model: str) -> int:
+        for family, tokens in GEMINI_CACHE_MIN_TOKENS.items():
+            if family in model:
+                return tokens
+        return GEMINI_CACHE_MIN_TOKENS_DEFAULT
+
+    async def handle(self, api_key: str, model: str, system_prompt: Optional[str]) -> Optional[str]:
+        """Name of a live cache holding `system_prompt` for `model`; None → send
+        it inline. Once the prompt has repeated, a cache is created in the
+        background — the reply that triggers it doesn't wait."""
+        floor = self.min_tokens(model)
+        if not system_prompt or len(system_prompt) < floor or estimate_tokens(system_prompt) < floor:
+            return None
+        key = self._key(api_key, model, system_prompt)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [None, 0.0, 0]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)  # the cache itself just expires upstream
+        self._entries.move_to_end(key)
+        entry[2] += 1
+        now = time.time()
+        if entry[0] and now < entry[1] - 30:
+            if entry[1] - now < GEMINI_CACHE_TTL_S / 2 and key not in self._refreshing:
+                self._refreshing[key] = asyncio.ensure_future(self._refresh(key, entry, api_key))
+            return entry[0]
+        if entry[0] is None and now < entry[1]:  # creation failed recently
+            return None
+        if entry[2] < GEMINI_CACHE_AFTER_USES:
+            return None
+        if key not in self._creating:
+            task = self._creating[key] = asyncio.ensure_future(self._create(key, entry, api_key, model, system_prompt))
+            task.add_done_callback(lambda t, key=key: self._creating.pop(key, None))
+        return None
+
+    async def _create(self, key, entry, api_key, model, system_prompt) -> Optional[str]:
+        body = {"model": f"models/{model}", "systemInstruction": {"parts": [{"text": system_prompt}]},
+                "ttl": f"{GEMINI_CACHE_TTL_S}s"}
+        try:
+            async with http_clients.session("ai:gemini").post(f"{GEMINI_API}/cachedContents?key={api_key}", json=body) as resp:
+                data = await resp.json(content_type=None)
+                if resp.status != 200 or not data.get("name"):
+                    raise Exception(f"HTTP {resp.status}: {str(data.get('error', data))[:200]}")
+        except Exception as e:
+            self.failed += 1
+            entry[0], entry[1] = None, time.time() + GEMINI_CACHE_TTL_S  # don't retry for a while
+            logger.warning(f"Gemini context cache for {model} not created: {e}")
+            return None
+        self.created += 1
+        entry[0], entry[1] = data["name"], time.time() + GEMINI_CACHE_TTL_S
+        return entry[0]
+
+    async def _refresh(self, key, entry, api_key):
+        name = entry[0]
+        try:
+            async with http_clients.session("ai:gemini").patch(
+                    f"{GEMINI_API}/{name}?key={api_key}&updateMask=ttl", json={"ttl": f"{GEMINI_CACHE_TTL_S}s"}) as resp:
+                if resp.status == 200 and entry[0] == name:
+                    entry[1] = time.time() + GEMINI_CACHE_TTL_S
+                    self.refreshed += 1
+        except Exception as e:
+            logger.warning(f"Gemini context cache refresh failed: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    def forget(self, api_key: str, model: str, system_prompt: str):
+        """The cache was rejected (expired early, deleted): go without it."""
+        entry = self._entries.get(self._key(api_key, model, system_prompt))
+        if entry is not None:
+            entry[0], entry[1] = None, 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {"live": sum(1 for name, exp, _ in self._entries.values() if name and exp > now),
+                "created": self.created, "refreshed": self.refreshed, "failed": self.failed}
+
+
 class AIHandler:
+    def __init__(self):
+        # Single-flight: stateless calls in progress, keyed by everything that
+        # determines the answer — identical concurrent calls await one task.
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        self.flights = 0      # upstream calls started through single-flight
+        self.coalesced = 0    # duplicate calls that rode along instead
+        self.cache = ResponseCache()
+        # Estimated prompt sizes of history-carrying calls (bot/context.py)
+        self.prompts = 0
+        self.prompt_tokens = 0
+        self.history_dropped = 0
+        self._summarizing: Dict[int, asyncio.Task] = {}
+        self._summary_failed: Dict[int, float] = {}   # user → monotonic time of the last failed fold
+        self.health = ProviderHealth()
+        self.summaries = 0
+        self.hedged = 0       # backup providers started (primary slow or failed)
+        self.gemini_caches = GeminiContextCaches()
+        # Provider-side prompt caching, per provider: responses, prompt tokens, of which cached
+        self.prompt_cache: Dict[str, List[int]] = {}
+        self.hedge_wins = 0   # ... and answered first
+
+    def _session(self, provider: str) -> aiohttp.ClientSession:
+        """Pooled session for `provider` (one "ai:<provider>" pool each in bot/http_clients.py)."""
+        return http_clients.session(f"ai:{provider}")
+
     def _get_model(self, user_id: int, provider: str) -> str:
         user = storage.get_user(user_id)
         user_model = user.get("ai_model")
@@ -95,11 +731,24 @@ class AIHandler:
         user = storage.get_user(user_id)
         return user.get("chat_history", [])
 
+    def _context(self, user_id: int, model: str, system_prompt: Optional[str], prompt: str) -> List[Dict[str, str]]:
+        """The part of the stored history that fits `model`'s prompt budget."""
+        history, report = assemble_history(self._get_history(user_id), model, system_prompt, prompt)
+        self._note_context(report)
+        logger.debug(f"Context for {model}: ~{report.prompt_tokens}/{report.budget} tokens, "
+                     f"{report.sent} history msgs ({report.condensed} condensed, {report.dropped} dropped)")
+        return history
+
+    def _note_context(self, report: ContextReport):
+        self.prompts += 1
+        self.prompt_tokens += report.prompt_tokens
+        self.history_dropped += report.dropped
+
     def _push_history(self, user_id: int, role: str, content: str):
         user = storage.get_user(user_id)
         hist = user.setdefault("chat_history", [])
         # Truncate each stored message at 1500 chars — keeps storage bounded
-        # (~60KB max per user) while still useful as context.
+        # (~90KB max per user) while still useful as context.
         hist.append({"role": role, "content": (content or "")[:1500]})
         max_msgs = CHAT_HISTORY_LIMIT * 2
         if len(hist) > max_msgs:
@@ -108,6 +757,84 @@ class AIHandler:
     def clear_history(self, user_id: int):
         user = storage.get_user(user_id)
         user["chat_history"] = []
+        user.pop("history_summary", None)
+        task = self._summarizing.pop(user_id, None)
+        if task is not None:
+            task.cancel()  # its summary would describe the cleared turns
+
+    # ---- Rolling summary ----
+
+    def _with_summary(self, user_id: int, system_prompt: Optional[str]) -> Optional[str]:
+        """`system_prompt` plus the running summary of turns no longer kept verbatim."""
+        summary = storage.get_user(user_id).get("history_summary")
+        if not summary:
+            return system_prompt
+        block = f"Summary of the earlier conversation (those turns are not shown):\n{summary}"
+        return f"{system_prompt}\n\n{block}" if system_prompt else block
+
+    def _maybe_summarize(self, user_id: int):
+        """Start a background fold if enough old turns piled up. Never awaited
+        by the reply path."""
+        if SUMMARY_KEEP_TURNS <= 0 or user_id in self._summarizing:
+            return
+        failed_at = self._summary_failed.get(user_id)
+        if failed_at is not None and time.monotonic() - failed_at < SUMMARY_RETRY_S:
+            return
+        if len(self._get_history(user_id)) < SUMMARY_FOLD_AT:
+            return
+        task = asyncio.create_task(self._fold_history(user_id))
+        self._summarizing[user_id] = task
+
+        def _done(t: asyncio.Task):
+            if self._summarizing.get(user_id) is t:  # clear_history may have replaced it
+                del self._summarizing[user_id]
+        task.add_done_callback(_done)
+
+    async def _fold_history(self, user_id: int):
+        user = storage.get_user(user_id)
+        lang = user.get("language", "en")
+        provider = user.get("ai_provider", "gemini")
+        api_key = user.get("api_keys", {}).get(provider)
+        fold = list(user.get("chat_history") or [])[:-SUMMARY_KEEP_TURNS * 2]
+        if not api_key or not fold:
+            return
+        previous = user.get("history_summary") or "(none yet)"
+        transcript = "\n".join(f"{'User' if m['role'] == 'user' else 'AI'}: {m['content']}" for m in fold)
+        prompt = (
+            f"Current summary:\n{previous}\n\nTurns to fold in:\n{transcript}\n\n"
+            f"Rewrite the summary so it also covers these turns, in under 150 words. Keep facts "
+            f"about the user, their goals, decisions, names, numbers and open questions; drop "
+            f"small talk. Use the conversation's language. Output only the summary."
+        )
+        system = "You maintain a compact running summary of a chat."
+        user_model = self._get_model(user_id, provider)
+        model = SUMMARY_MODELS.get(provider) or user_model
+        text = await self._complete(lang, provider, api_key, model, prompt, system, [])
+        if text.startswith("❌") and model != user_model:
+            # The key may not cover the cheap model — the user's own one surely works
+            text = await self._complete(lang, provider, api_key, user_model, prompt, system, [])
+        if not text or text.startswith("❌"):
+            logger.warning(f"History summary for {user_id} failed: {text[:200]}")
+            now = time.monotonic()
+            if len(self._summary_failed) > 5000:
+                self._summary_failed = {u: t for u, t in self._summary_failed.items() if now - t < SUMMARY_RETRY_S}
+            self._summary_failed[user_id] = now
+            return
+        self._summary_failed.pop(user_id, None)
+
+        user = storage.get_user(user_id)
+        hist = user.get("chat_history") or []
+        # Turns may have been trimmed off the front meanwhile: drop whatever
+        # part of the fold is still there (the summary covers all of it)
+        overlap = next(k for k in range(min(len(fold), len(hist)), -1, -1) if hist[:k] == fold[len(fold) - k:])
+        user["chat_history"] = hist[overlap:]
+        user["history_summary"] = text.strip()[:SUMMARY_MAX_CHARS]
+        # Proactive memory counts turns via len(chat_history); keep its checkpoint aligned
+        checkpoint = int(user.get("memory_last_suggested_at_pairs", 0))
+        if checkpoint:
+            user["memory_last_suggested_at_pairs"] = max(checkpoint - overlap // 2, 0)
+        self.summaries += 1
+        await storage.save()
 
     async def generate_response(
         self,
@@ -117,7 +844,10 @@ class AIHandler:
         use_history: bool = True,
         image_b64: Optional[str] = None,
         image_mime: str = "image/jpeg",
+        cache: Optional[str] = None,
     ) -> str:
+        """`cache` names the call site (a CACHE_TTLS key) to serve repeats of a
+        stateless call from the per-user response cache."""
         user = storage.get_user(user_id)
         lang = user.get("language", "en")
         provider = user.get("ai_provider", "gemini")
@@ -127,97 +857,220 @@ class AIHandler:
             return _no_key_msg(lang, provider)
 
         if image_b64 and provider not in VISION_PROVIDERS:
-            _detail = {
-                "ru": "этот провайдер не поддерживает анализ изображений. Используйте openai, anthropic, gemini или openrouter.",
-                "en": "this provider does not support image analysis. Use openai, anthropic, gemini, or openrouter.",
-                "it": "questo provider non supporta l'analisi delle immagini. Usa openai, anthropic, gemini o openrouter.",
-            }
-            return _err_msg(lang, provider, _detail.get(lang, _detail["en"]))
+            return _no_vision_msg(lang, provider)
 
         model = self._get_model(user_id, provider)
-        history = self._get_history(user_id) if use_history and not image_b64 else []
+        chain = self._failover_chain(user, provider, api_key, model, vision=bool(image_b64))
 
+        if not use_history and not image_b64:
+            cache_key = None
+            if cache and self.cache.max_entries > 0:
+                cache_key = ResponseCache.key(cache, user_id, provider, model, system_prompt, prompt)
+                hit = self.cache.get(cache_key)
+                if hit is not None:
+                    return hit
+            key = (provider, model, system_prompt or "", prompt, _key_owner(api_key), tuple(p for p, _, _ in chain[1:]))
+            response = await self._single_flight(key, self._hedge([
+                lambda p=p, k=k, m=m: self._complete(lang, p, k, m, prompt, system_prompt, [])
+                for p, k, m in chain
+            ]))
+            if cache_key is not None and response and not response.startswith("❌"):
+                self.cache.put(cache_key, response, CACHE_TTLS[cache])
+            return response
+
+        with_history = use_history and not image_b64
+        if with_history:
+            system_prompt = self._with_summary(user_id, system_prompt)
+
+        def attempt(p, k, m):
+            history = self._context(user_id, m, system_prompt, prompt) if with_history else []
+            return self._complete(lang, p, k, m, prompt, system_prompt, history, image_b64, image_mime)
+
+        response = await self._hedge([lambda p=p, k=k, m=m: attempt(p, k, m) for p, k, m in chain])
+        if use_history and response and not response.startswith("❌"):
+            self._push_history(user_id, "user", prompt)
+            self._push_history(user_id, "assistant", response)
+            self._maybe_summarize(user_id)
+        return response
+
+    def _failover_chain(self, user: dict, provider: str, api_key: str, model: str,
+                        vision: bool = False) -> List[Tuple[str, str, str]]:
+        """(provider, key, model) to try in order: the user's own provider, then
+        their opt-in `ai_failover` backups that have a key (and vision, if needed)."""
+        chain = [(provider, api_key, model)]
+        keys = user.get("api_keys", {})
+        for backup in user.get("ai_failover") or ():
+            if len(chain) >= FAILOVER_MAX_PROVIDERS:
+                break
+            key = keys.get(backup)
+            if not key or any(backup == p for p, _, _ in chain) or (vision and backup not in VISION_PROVIDERS):
+                continue
+            chain.append((backup, key, DEFAULT_MODELS.get(backup, "default")))
+        return chain
+
+    async def _hedge(self, attempts: List[Callable[[], Awaitable[str]]]) -> str:
+        """Run attempts[0]; start the next attempt as soon as the running ones
+        have all failed, or every AI_HEDGE_AFTER_MS without an answer. The first
+        non-❌ answer wins and the rest are cancelled; if every attempt fails,
+        the primary's error is returned."""
+        if len(attempts) == 1:
+            return await attempts[0]()
+        hedge_after = AI_HEDGE_AFTER_MS / 1000 if AI_HEDGE_AFTER_MS > 0 else None
+        running: Dict[asyncio.Future, int] = {}
+        errors: List[Tuple[int, str]] = []
+        started = 0
         try:
-            if provider == "gemini":
-                response = await self._call_gemini(api_key, model, prompt, system_prompt, history, image_b64, image_mime)
-            elif provider == "anthropic":
-                response = await self._call_anthropic(api_key, model, prompt, system_prompt, history, image_b64, image_mime)
-            elif provider == "cohere":
-                response = await self._call_cohere(api_key, model, prompt, system_prompt, history)
-            elif provider in PROVIDER_CONFIGS:
-                url, _ = PROVIDER_CONFIGS[provider]
-                response = await self._call_openai_compat(url, api_key, model, prompt, system_prompt, history, image_b64, image_mime)
-            else:
-                return _err_msg(lang, provider, "not configured")
+            while True:
+                # Every pass is either the start, a timeout or a failure: bring in the next provider
+                if started < len(attempts):
+                    running[asyncio.ensure_future(attempts[started]())] = started
+                    self.hedged += started > 0
+                    started += 1
+                if not running:
+                    break
+                done, _ = await asyncio.wait(running, timeout=hedge_after if started < len(attempts) else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = running.pop(task)
+                    response = task.result()
+                    if response and not response.startswith("❌"):
+                        self.hedge_wins += index > 0
+                        return response
+                    errors.append((index, response))
+        finally:
+            for task in running:
+                task.cancel()
+        return min(errors)[1]
 
-            if use_history and response and not response.startswith("❌"):
-                self._push_history(user_id, "user", prompt)
-                self._push_history(user_id, "assistant", response)
-            return response
+    async def _single_flight(self, key: Tuple, call) -> str:
+        """Run `call` unless an identical one is already in flight; then
+        share its result. The upstream call runs as its own task, so a caller
+        giving up (cancelled handler) doesn't cancel it for the others."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call)
+            self._inflight[key] = task
+            self.flights += 1
+
+            def _done(t, key=key):
+                if self._inflight.get(key) is t:
+                    del self._inflight[key]
+            task.add_done_callback(_done)
+        else:
+            call.close()  # never awaited
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _complete(self, lang, provider, api_key, model, prompt, system_prompt, history,
+                        image_b64=None, image_mime="image/jpeg") -> str:
+        """One upstream completion; provider errors come back as ❌ text."""
+        if provider not in ("gemini", "anthropic", "cohere") and provider not in PROVIDER_CONFIGS:
+            return _err_msg(lang, provider, "not configured")
+        try:
+            async with self.health.guard(provider, api_key):
+                if provider == "gemini":
+                    return await self._call_gemini(api_key, model, prompt, system_prompt, history, image_b64, image_mime)
+                elif provider == "anthropic":
+                    return await self._call_anthropic(api_key, model, prompt, system_prompt, history, image_b64, image_mime)
+                elif provider == "cohere":
+                    return await self._call_cohere(api_key, model, prompt, system_prompt, history)
+                return await self._call_openai_compat(provider, api_key, model, prompt, system_prompt, history, image_b64, image_mime)
+        except ProviderUnavailable as e:
+            return _unavailable_msg(lang, provider, e.retry_in)
+        except asyncio.TimeoutError:
+            return _err_msg(lang, provider, "timeout")
         except aiohttp.ClientError as e:
             return _err_msg(lang, provider, f"network: {e}")
         except Exception as e:
             return _err_msg(lang, provider, str(e))
 
+    def _note_usage(self, provider: str, usage: Optional[Tuple[int, int]]):
+        if usage is None:
+            return
+        prompt_tokens, cached = usage
+        row = self.prompt_cache.setdefault(provider, [0, 0, 0])
+        row[0] += 1
+        row[1] += prompt_tokens
+        row[2] += cached
+        if cached:
+            logger.debug(f"{provider}: {cached}/{prompt_tokens} prompt tokens from provider cache")
+
+    def _usage_hook(self, provider: str) -> Callable[[Tuple[int, int]], None]:
+        return lambda usage: self._note_usage(provider, usage)
+
+    def stats(self) -> Dict[str, Any]:
+        cached = sum(row[2] for row in self.prompt_cache.values())
+        total = sum(row[1] for row in self.prompt_cache.values())
+        return {
+            "prompt_cache": {
+                "cached_ratio": round(cached / total, 3) if total else 0.0,
+                "by_provider": {p: {"responses": r[0], "prompt_tokens": r[1], "cached_tokens": r[2]}
+                                for p, r in sorted(self.prompt_cache.items())},
+                "gemini_contexts": self.gemini_caches.stats(),
+            },
+            "flights": self.flights,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "cache": self.cache.stats(),
+            "avg_prompt_tokens": self.prompt_tokens // self.prompts if self.prompts else 0,
+            "history_dropped": self.history_dropped,
+            "summaries": self.summaries,
+            "health": self.health.stats(),
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+        }
+
+    async def _gemini_post(self, url, api_key, model, prompt, system_prompt, history, image_b64, image_mime):
+        """POST a Gemini generate request, with the system prompt from a context
+        cache when there is one (bot/ai.py GeminiContextCaches)."""
+        session = self._session("gemini")
+        cached = await self.gemini_caches.handle(api_key, model, system_prompt)
+        if cached:
+            payload = _gemini_body(prompt, None, history, image_b64, image_mime)
+            payload["cachedContent"] = cached
+            resp = await session.post(url, json=payload)
+            if resp.status not in (400, 403, 404):
+                return resp
+            resp.release()
+            self.gemini_caches.forget(api_key, model, system_prompt)
+        return await session.post(url, json=_gemini_body(prompt, system_prompt, history, image_b64, image_mime))
+
     async def _call_gemini(self, api_key, model, prompt, system_prompt, history, image_b64=None, image_mime="image/jpeg"):
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
-        contents = []
-        for m in history:
-            role = "model" if m["role"] == "assistant" else "user"
-            contents.append({"role": role, "parts": [{"text": m["content"]}]})
-        user_parts: List[Dict[str, Any]] = [{"text": prompt}]
-        if image_b64:
-            user_parts.append({"inline_data": {"mime_type": image_mime, "data": image_b64}})
-        contents.append({"role": "user", "parts": user_parts})
-        payload: Dict[str, Any] = {"contents": contents}
-        if system_prompt:
-            payload["systemInstruction"] = {"parts": [{"text": system_prompt}]}
-        async with aiohttp.ClientSession(timeout=REQUEST_TIMEOUT) as session:
-            async with session.post(url, json=payload) as resp:
-                data = await resp.json()
-                if "error" in data:
-                    raise Exception(data["error"].get("message", str(data["error"])))
-                return data["candidates"][0]["content"]["parts"][0]["text"]
+        url = f"{GEMINI_API}/models/{model}:generateContent?key={api_key}"
+        async with await self._gemini_post(url, api_key, model, prompt, system_prompt, history, image_b64, image_mime) as resp:
+            await _raise_if_overloaded(resp)
+            data = await resp.json()
+            if "error" in data:
+                raise Exception(data["error"].get("message", str(data["error"])))
+            self._note_usage("gemini", _prompt_usage(data))
+            return data["candidates"][0]["content"]["parts"][0]["text"]
 
     async def _call_anthropic(self, api_key, model, prompt, system_prompt, history, image_b64=None, image_mime="image/jpeg"):
         url = "https://api.anthropic.com/v1/messages"
         headers = {"x-api-key": api_key, "anthropic-version": "2023-06-01", "Content-Type": "application/json"}
-        messages = list(history)
-        if image_b64:
-            messages.append({"role": "user", "content": [
-                {"type": "image", "source": {"type": "base64", "media_type": image_mime, "data": image_b64}},
-                {"type": "text", "text": prompt},
-            ]})
-        else:
-            messages.append({"role": "user", "content": prompt})
-        payload: Dict[str, Any] = {"model": model, "max_tokens": 2048, "messages": messages}
-        if system_prompt:
-            payload["system"] = system_prompt
-        async with aiohttp.ClientSession(timeout=REQUEST_TIMEOUT) as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                data = await resp.json()
-                if "error" in data:
-                    raise Exception(data["error"].get("message", str(data["error"])))
-                return data["content"][0]["text"]
+        payload = _anthropic_body(model, prompt, system_prompt, history, image_b64, image_mime)
+        session = self._session("anthropic")
+        async with session.post(url, headers=headers, json=payload) as resp:
+            await _raise_if_overloaded(resp)
+            data = await resp.json()
+            if "error" in data:
+                raise Exception(data["error"].get("message", str(data["error"])))
+            self._note_usage("anthropic", _prompt_usage(data))
+            return data["content"][0]["text"]
 
     async def _call_cohere(self, api_key, model, prompt, system_prompt, history):
         url = "https://api.cohere.ai/v2/chat"
         headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        for m in history:
-            messages.append({"role": m["role"], "content": m["content"]})
-        messages.append({"role": "user", "content": prompt})
-        payload = {"model": model, "messages": messages}
-        async with aiohttp.ClientSession(timeout=REQUEST_TIMEOUT) as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                data = await resp.json()
-                if "error" in data:
-                    raise Exception(str(data["error"]))
-                if "message" in data and "content" in data["message"]:
-                    return data["message"]["content"][0]["text"]
-                return str(data)
+        payload = {"model": model, "messages": _openai_messages(prompt, system_prompt, history)}
+        session = self._session("cohere")
+        async with session.post(url, headers=headers, json=payload) as resp:
+            await _raise_if_overloaded(resp)
+            data = await resp.json()
+            if "error" in data:
+                raise Exception(str(data["error"]))
+            if "message" in data and "content" in data["message"]:
+                return data["message"]["content"][0]["text"]
+            return str(data)
 
     # ============== STREAMING ==============
 
@@ -227,9 +1080,13 @@ class AIHandler:
         prompt: str,
         system_prompt: Optional[str] = None,
         use_history: bool = True,
+        image_b64: Optional[str] = None,
+        image_mime: str = "image/jpeg",
+        cache: Optional[str] = None,
     ) -> AsyncIterator[str]:
         """Yield text chunks as they arrive from the provider. Caller is
-        responsible for accumulating and persisting the final text to history."""
+        responsible for accumulating and persisting the final text to history.
+        Takes the same image/`cache` options as generate_response()."""
         user = storage.get_user(user_id)
         lang = user.get("language", "en")
         provider = user.get("ai_provider", "gemini")
@@ -238,161 +1095,207 @@ class AIHandler:
         if not api_key:
             yield _no_key_msg(lang, provider)
             return
+        if image_b64 and provider not in VISION_PROVIDERS:
+            yield _no_vision_msg(lang, provider)
+            return
         if provider not in STREAMING_PROVIDERS:
-            text = await self.generate_response(user_id, prompt, system_prompt, use_history)
-            yield text
+            yield await self.generate_response(user_id, prompt, system_prompt, use_history,
+                                               image_b64, image_mime, cache)
             return
 
         model = self._get_model(user_id, provider)
-        history = self._get_history(user_id) if use_history else []
+        chain = self._failover_chain(user, provider, api_key, model, vision=bool(image_b64))
+        with_history = use_history and not image_b64
+        cache_key = None
+        if cache and not with_history and not image_b64 and self.cache.max_entries > 0:
+            cache_key = ResponseCache.key(cache, user_id, provider, model, system_prompt, prompt)
+            hit = self.cache.get(cache_key)
+            if hit is not None:
+                yield hit
+                return
+        if with_history:
+            system_prompt = self._with_summary(user_id, system_prompt)
+
+        def opener(p, k, m):
+            history = self._context(user_id, m, system_prompt, prompt) if with_history else []
+            return self._stream_one(lang, p, k, m, prompt, system_prompt, history, image_b64, image_mime)
 
+        stream, first = await self._hedge_stream([lambda p=p, k=k, m=m: opener(p, k, m) for p, k, m in chain])
+        if stream is None:
+            yield first or _err_msg(lang, provider, "empty response")
+            return
+        parts = [first] if cache_key is not None else None
         try:
-            if provider == "gemini":
-                async for chunk in self._stream_gemini(api_key, model, prompt, system_prompt, history):
-                    yield chunk
-            elif provider == "anthropic":
-                async for chunk in self._stream_anthropic(api_key, model, prompt, system_prompt, history):
-                    yield chunk
-            elif provider in PROVIDER_CONFIGS:
-                url, _ = PROVIDER_CONFIGS[provider]
-                async for chunk in self._stream_openai_compat(url, api_key, model, prompt, system_prompt, history):
-                    yield chunk
+            yield first
+            async for chunk in stream:
+                if parts is not None:
+                    parts.append(chunk)
+                yield chunk
+        finally:
+            await stream.aclose()
+        # Only a stream that ran to the end (and didn't end in an error chunk) is cached
+        if parts is not None and not parts[-1].startswith("❌"):
+            self.cache.put(cache_key, "".join(parts), CACHE_TTLS[cache])
+
+    async def _stream_one(self, lang, provider, api_key, model, prompt, system_prompt, history,
+                          image_b64=None, image_mime="image/jpeg") -> AsyncIterator[str]:
+        """One provider's stream; errors come back as a single ❌ chunk."""
+        if provider not in STREAMING_PROVIDERS:
+            yield await self._complete(lang, provider, api_key, model, prompt, system_prompt, history,
+                                       image_b64, image_mime)
+            return
+        try:
+            async with self.health.guard(provider, api_key):
+                if provider == "gemini":
+                    stream = self._stream_gemini(api_key, model, prompt, system_prompt, history, image_b64, image_mime)
+                elif provider == "anthropic":
+                    stream = self._stream_anthropic(api_key, model, prompt, system_prompt, history, image_b64, image_mime)
+                elif provider == "cohere":
+                    stream = self._stream_cohere(api_key, model, prompt, system_prompt, history)
+                else:
+                    stream = self._stream_openai_compat(provider, api_key, model, prompt, system_prompt, history,
+                                                        image_b64, image_mime)
+                try:
+                    async for chunk in stream:
+                        yield chunk
+                finally:
+                    await stream.aclose()  # a reader that stops early releases the connection now
+        except ProviderUnavailable as e:
+            yield _unavailable_msg(lang, provider, e.retry_in)
+        except asyncio.TimeoutError:
+            yield _err_msg(lang, provider, "timeout")
         except Exception as e:
             yield _err_msg(lang, provider, str(e))
 
+    async def _hedge_stream(self, openers: List[Callable[[], AsyncIterator[str]]]) -> Tuple[Optional[AsyncIterator[str]], str]:
+        """Streaming twin of _hedge(), raced on the first chunk: returns the
+        winning stream (already past its first chunk) and that chunk. The
+        losers are cancelled and closed. (None, primary's error) if all fail."""
+        hedge_after = AI_HEDGE_AFTER_MS / 1000 if AI_HEDGE_AFTER_MS > 0 else None
+        running: Dict[asyncio.Future, Tuple[int, AsyncIterator[str]]] = {}
+        errors: List[Tuple[int, str]] = []
+        started = 0
+        try:
+            while True:
+                if started < len(openers):
+                    stream = openers[started]()
+                    running[asyncio.ensure_future(stream.__anext__())] = (started, stream)
+                    self.hedged += started > 0
+                    started += 1
+                if not running:
+                    break
+                done, _ = await asyncio.wait(running, timeout=hedge_after if started < len(openers) else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index, stream = running.pop(task)
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        first = ""
+                    if first and not first.startswith("❌"):
+                        self.hedge_wins += index > 0
+                        return stream, first
+                    errors.append((index, first))
+                    await stream.aclose()
+        finally:
+            for task in running:
+                task.cancel()
+            # A stream can only be closed once its pending __anext__ has unwound
+            await asyncio.gather(*running, return_exceptions=True)
+            for _, stream in running.values():
+                await stream.aclose()
+        return None, min(errors)[1]
+
     def push_history(self, user_id: int, prompt: str, response: str):
         """Append a finished user+assistant turn to history (used after streaming)."""
         if not response or response.startswith("❌"):
             return
         self._push_history(user_id, "user", prompt)
         self._push_history(user_id, "assistant", response)
+        self._maybe_summarize(user_id)
 
-    async def _stream_openai_compat(self, url, api_key, model, prompt, system_prompt, history):
+    async def _stream_openai_compat(self, provider, api_key, model, prompt, system_prompt, history,
+                                    image_b64=None, image_mime="image/jpeg"):
+        url, _ = PROVIDER_CONFIGS[provider]
         headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        for m in history:
-            messages.append({"role": m["role"], "content": m["content"]})
-        messages.append({"role": "user", "content": prompt})
+        messages = _openai_messages(prompt, system_prompt, history, image_b64, image_mime)
         payload = {"model": model, "messages": messages, "max_tokens": 2048, "stream": True}
-        async with aiohttp.ClientSession(timeout=REQUEST_TIMEOUT) as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                if resp.status != 200:
-                    body = await resp.text()
-                    try:
-                        err = json.loads(body)
-                        msg = err.get("error", {}).get("message", body) if isinstance(err, dict) else body
-                    except json.JSONDecodeError:
-                        msg = body
-                    raise Exception(str(msg)[:300])
-                async for raw in resp.content:
-                    line = raw.decode("utf-8", errors="ignore").strip()
-                    if not line or not line.startswith("data:"):
-                        continue
-                    data = line[5:].strip()
-                    if data == "[DONE]":
-                        break
-                    try:
-                        obj = json.loads(data)
-                        delta = obj.get("choices", [{}])[0].get("delta", {}).get("content")
-                        if delta:
-                            yield delta
-                    except (json.JSONDecodeError, IndexError, AttributeError):
-                        continue
-
-    async def _stream_anthropic(self, api_key, model, prompt, system_prompt, history):
+        if provider in STREAM_USAGE_PROVIDERS:
+            payload["stream_options"] = {"include_usage": True}
+        session = self._session(provider)
+        async with session.post(url, headers=headers, json=payload) as resp:
+            await _raise_if_overloaded(resp)
+            if resp.status != 200:
+                body = await resp.text()
+                try:
+                    err = json.loads(body)
+                    msg = err.get("error", {}).get("message", body) if isinstance(err, dict) else body
+                except json.JSONDecodeError:
+                    msg = body
+                raise Exception(str(msg)[:300])
+            async for delta in _sse_deltas(resp, _openai_delta, self._usage_hook(provider)):
+                yield delta
+
+    async def _stream_anthropic(self, api_key, model, prompt, system_prompt, history,
+                                image_b64=None, image_mime="image/jpeg"):
         url = "https://api.anthropic.com/v1/messages"
         headers = {
             "x-api-key": api_key,
             "anthropic-version": "2023-06-01",
             "Content-Type": "application/json",
         }
-        messages = list(history) + [{"role": "user", "content": prompt}]
-        payload = {"model": model, "max_tokens": 2048, "messages": messages, "stream": True}
-        if system_prompt:
-            payload["system"] = system_prompt
-        async with aiohttp.ClientSession(timeout=REQUEST_TIMEOUT) as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                if resp.status != 200:
-                    body = await resp.text()
-                    raise Exception(body[:300])
-                async for raw in resp.content:
-                    line = raw.decode("utf-8", errors="ignore").strip()
-                    if not line.startswith("data:"):
-                        continue
-                    data = line[5:].strip()
-                    if not data:
-                        continue
-                    try:
-                        obj = json.loads(data)
-                        if obj.get("type") == "content_block_delta":
-                            delta = obj.get("delta", {}).get("text")
-                            if delta:
-                                yield delta
-                        elif obj.get("type") == "message_stop":
-                            break
-                    except json.JSONDecodeError:
-                        continue
-
-    async def _stream_gemini(self, api_key, model, prompt, system_prompt, history):
+        payload = _anthropic_body(model, prompt, system_prompt, history, image_b64, image_mime)
+        payload["stream"] = True
+        session = self._session("anthropic")
+        async with session.post(url, headers=headers, json=payload) as resp:
+            await _raise_if_overloaded(resp)
+            if resp.status != 200:
+                body = await resp.text()
+                raise Exception(body[:300])
+            async for delta in _sse_deltas(resp, _anthropic_delta, self._usage_hook("anthropic")):
+                yield delta
+
+    async def _stream_gemini(self, api_key, model, prompt, system_prompt, history,
+                             image_b64=None, image_mime="image/jpeg"):
         # Gemini stream endpoint uses ?alt=sse for line-based SSE
-        url = (f"https://generativelanguage.googleapis.com/v1beta/models/"
-               f"{model}:streamGenerateContent?alt=sse&key={api_key}")
-        contents = []
-        for m in history:
-            role = "model" if m["role"] == "assistant" else "user"
-            contents.append({"role": role, "parts": [{"text": m["content"]}]})
-        contents.append({"role": "user", "parts": [{"text": prompt}]})
-        payload: Dict[str, Any] = {"contents": contents}
-        if system_prompt:
-            payload["systemInstruction"] = {"parts": [{"text": system_prompt}]}
-        async with aiohttp.ClientSession(timeout=REQUEST_TIMEOUT) as session:
-            async with session.post(url, json=payload) as resp:
-                if resp.status != 200:
-                    body = await resp.text()
-                    raise Exception(body[:300])
-                async for raw in resp.content:
-                    line = raw.decode("utf-8", errors="ignore").strip()
-                    if not line.startswith("data:"):
-                        continue
-                    data = line[5:].strip()
-                    if not data:
-                        continue
-                    try:
-                        obj = json.loads(data)
-                        cand = obj.get("candidates", [{}])[0]
-                        parts = cand.get("content", {}).get("parts", [])
-                        for p in parts:
-                            text = p.get("text")
-                            if text:
-                                yield text
-                    except (json.JSONDecodeError, IndexError, AttributeError):
-                        continue
+        url = f"{GEMINI_API}/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+        async with await self._gemini_post(url, api_key, model, prompt, system_prompt, history, image_b64, image_mime) as resp:
+            await _raise_if_overloaded(resp)
+            if resp.status != 200:
+                body = await resp.text()
+                raise Exception(body[:300])
+            async for delta in _sse_deltas(resp, _gemini_delta, self._usage_hook("gemini")):
+                yield delta
+
+    async def _stream_cohere(self, api_key, model, prompt, system_prompt, history):
+        # v2 chat streams SSE events: content-delta ... message-end
+        url = "https://api.cohere.ai/v2/chat"
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        payload = {"model": model, "messages": _openai_messages(prompt, system_prompt, history), "stream": True}
+        session = self._session("cohere")
+        async with session.post(url, headers=headers, json=payload) as resp:
+            await _raise_if_overloaded(resp)
+            if resp.status != 200:
+                body = await resp.text()
+                raise Exception(body[:300])
+            async for delta in _sse_deltas(resp, _cohere_delta, self._usage_hook("cohere")):
+                yield delta
 
     # ============== END STREAMING ==============
 
-    async def _call_openai_compat(self, url, api_key, model, prompt, system_prompt, history, image_b64=None, image_mime="image/jpeg"):
+    async def _call_openai_compat(self, provider, api_key, model, prompt, system_prompt, history, image_b64=None, image_mime="image/jpeg"):
+        url, _ = PROVIDER_CONFIGS[provider]
         headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        for m in history:
-            messages.append({"role": m["role"], "content": m["content"]})
-        if image_b64:
-            messages.append({"role": "user", "content": [
-                {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": f"data:{image_mime};base64,{image_b64}"}},
-            ]})
-        else:
-            messages.append({"role": "user", "content": prompt})
-        async with aiohttp.ClientSession(timeout=REQUEST_TIMEOUT) as session:
-            async with session.post(url, headers=headers, json={"model": model, "messages": messages, "max_tokens": 2048}) as resp:
-                data = await resp.json()
-                if "error" in data:
-                    err = data["error"]
-                    raise Exception(err.get("message", str(err)) if isinstance(err, dict) else str(err))
-                return data["choices"][0]["message"]["content"]
+        messages = _openai_messages(prompt, system_prompt, history, image_b64, image_mime)
+        session = self._session(provider)
+        async with session.post(url, headers=headers, json={"model": model, "messages": messages, "max_tokens": 2048}) as resp:
+            await _raise_if_overloaded(resp)
+            data = await resp.json()
+            if "error" in data:
+                err = data["error"]
+                raise Exception(err.get("message", str(err)) if isinstance(err, dict) else str(err))
+            self._note_usage(provider, _prompt_usage(data))
+            return data["choices"][0]["message"]["content"]
 
 
 ai_handler = AIHandler()
@@ -0,0 +1,350 @@
+"""Broadcast jobs: creator announcements to every user, concurrent and resumable.
+
+A job is a small dict in storage.data["broadcasts"] (id -> job), journaled and
+saved like any other top-level state:
+
+    {"id": "1760700000", "text": ..., "parse_mode": "HTML",
+     "state": "running" | "paused" | "cancelled" | "done",
+     "created": ts, "finished": ts | None,
+     "last_id": 123456,          # recipients go in user-id order; up to here dispatched
+     "in_flight": [123401, ...], # ...of which these had no outcome yet (<= concurrency)
+     "counts": {"sent", "blocked", "failed", "unknown", "total"},
+     "progress": [chat_id, message_id]}   # the creator's live progress message
+
+The per-recipient list and status live only in memory (`_Run`): a 10k-user
+list in top-level state would be re-serialized on every save. Recipients are
+the non-blocked users in ascending id order, so after a restart the rest of
+the list is just the users above `last_id` (users who joined meanwhile
+included). `last_id`, `in_flight` and `counts` are written together, every
+CHECKPOINT_S, and only then is a save requested.
+
+Sends go through the outbox (bot/outbox.py, BROADCAST class) with at most
+BROADCAST_CONCURRENCY of a job's sends queued at a time. After a restart
+every "running" job continues after `last_id`. A clean shutdown lets
+in-flight sends land first, so nothing is lost or repeated. After a hard
+crash, sends that were in flight at the last saved checkpoint count as
+"unknown" and are not repeated — an announcement twice is worse than one
+missing — but those dispatched after it are, since the saved state doesn't
+know about them (CHECKPOINT_S plus the storage journal/flush interval).
+
+Users who blocked the bot get `blocked_bot` on their record (here on a
+Forbidden, and from my_chat_member updates) and are left out of future jobs.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from telegram.error import BadRequest, Forbidden
+
+from bot.edits import stream_edits
+from bot.outbox import BROADCAST, Outbox, outbox
+from bot.storage import storage
+
+logger = logging.getLogger(__name__)
+
+# A job's sends queued in the outbox at once
+BROADCAST_CONCURRENCY = 50
+# How often the creator's progress message is refreshed
+PROGRESS_S = 1.0
+# How often a running job writes its position back and requests a save
+CHECKPOINT_S = 3.0
+# Finished jobs kept for /broadcast status
+KEEP_FINISHED = 5
+# Waited for in-flight sends on shutdown before the job is left to resume
+SHUTDOWN_WAIT_S = 5.0
+
+PENDING, IN_FLIGHT, SENT, BLOCKED, FAILED = b".", b"~", b"s", b"b", b"f"
+_OUTCOMES = (("sent", SENT), ("blocked", BLOCKED), ("failed", FAILED))
+# BadRequest texts that mean the chat is gone for good
+_GONE = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+
+def mark_blocked(user_id: int, blocked: bool = True):
+    """Record that a user blocked (or unblocked) the bot."""
+    user = storage.data.get("users", {}).get(str(user_id))
+    if user is None or bool(user.get("blocked_bot")) == blocked:
+        return
+    if blocked:
+        user["blocked_bot"] = True
+    else:
+        user.pop("blocked_bot", None)
+    storage.mark_user_dirty(user_id)
+
+
+def _recipients(after: Optional[int] = None) -> List[int]:
+    """Users a job still has to reach: not blocked, above `after`, by id."""
+    ids = (int(uid) for uid, user in storage.data.get("users", {}).items() if not user.get("blocked_bot"))
+    return sorted(i for i in ids if after is None or i > after)
+
+
+class _MessageRef:
+    """edit_text() for a message known only by its ids (after a restart)."""
+
+    def __init__(self, bot, chat_id: int, message_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    async def edit_text(self, text: str, **kwargs):
+        return await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id, **kwargs)
+
+
+class _Run:
+    """A job being worked on by this process: the rest of its recipients and
+    their status (one byte each, see PENDING..FAILED)."""
+
+    def __init__(self, job: Dict[str, Any]):
+        self.job = job
+        self.base = dict(job["counts"])      # outcomes of earlier runs
+        self.recipients = _recipients(job.get("last_id"))
+        self.status = bytearray(PENDING * len(self.recipients))
+        self.cursor = 0                      # recipients before it have been dispatched
+        self.started = time.monotonic()
+        self.done = 0                        # outcomes in this run (for the rate)
+        self.stop: Optional[str] = None      # "paused" / "cancelled" / "shutdown"
+        self.task: Optional[asyncio.Task] = None
+        self.sends: Set[asyncio.Task] = set()
+        self.live = None
+
+    def counts(self) -> Dict[str, int]:
+        counts = {name: self.base[name] + self.status.count(char) for name, char in _OUTCOMES}
+        counts["unknown"] = self.base["unknown"]
+        counts["total"] = sum(self.base[k] for k in ("sent", "blocked", "failed", "unknown")) + len(self.recipients)
+        return counts
+
+
+class BroadcastEngine:
+    def __init__(self, box: Outbox = outbox, concurrency: int = BROADCAST_CONCURRENCY):
+        self.outbox = box
+        self.concurrency = concurrency
+        self._runs: Dict[str, _Run] = {}
+
+    @property
+    def jobs(self) -> Dict[str, Dict[str, Any]]:
+        return storage.data.setdefault("broadcasts", {})
+
+    # ---- control ----
+
+    def start(self, bot, text: str, *, progress_chat_id: int, progress_message_id: int,
+              parse_mode: Optional[str] = "HTML") -> Dict[str, Any]:
+        job_id = str(int(time.time()))
+        while job_id in self.jobs:
+            job_id = str(int(job_id) + 1)
+        job = {
+            "id": job_id, "text": text, "parse_mode": parse_mode, "state": "running",
+            "created": time.time(), "finished": None, "last_id": None, "in_flight": [],
+            "counts": {"sent": 0, "blocked": 0, "failed": 0, "unknown": 0, "total": 0},
+            "progress": [progress_chat_id, progress_message_id],
+        }
+        self.jobs[job_id] = job
+        self._prune()
+        self._launch(bot, job)
+        return job
+
+    def resume_all(self, bot) -> int:
+        """Pick up the jobs a previous process left running (call after storage.load())."""
+        resumed = 0
+        for job in list(self.jobs.values()):
+            if job.get("state") == "running" and job["id"] not in self._runs:
+                self._launch(bot, job)
+                resumed += 1
+        if resumed:
+            logger.info(f"Resumed {resumed} broadcast job(s)")
+        return resumed
+
+    def resume(self, bot, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None or job.get("state") != "paused" or job_id in self._runs:
+            return False
+        job["state"] = "running"
+        self._launch(bot, job)
+        return True
+
+    def stop(self, job_id: str, state: str) -> bool:
+        """Pause or cancel a job; sends already queued still finish."""
+        run = self._runs.get(job_id)
+        job = self.jobs.get(job_id)
+        if run is not None:
+            run.stop = state
+            return True
+        if job is not None and job.get("state") == "paused" and state == "cancelled":
+            job["state"] = "cancelled"
+            job["finished"] = time.time()
+            self._prune()
+            return True
+        return False
+
+    async def shutdown(self):
+        """Stop dispatching, let in-flight sends land briefly, checkpoint. The
+        jobs stay "running" and continue on the next start."""
+        runs = list(self._runs.values())
+        for run in runs:
+            run.stop = "shutdown"
+        tasks = [run.task for run in runs if run.task is not None]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=SHUTDOWN_WAIT_S)
+            # Still waiting on sends: stop them now, so nothing touches storage after close()
+            for run in runs:
+                if run.task in pending:
+                    for send in list(run.sends):
+                        send.cancel()
+                    run.task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        for run in runs:
+            self._checkpoint(run)
+
+    def latest_id(self) -> Optional[str]:
+        return max(self.jobs, key=lambda j: self.jobs[j]["created"], default=None)
+
+    # ---- progress ----
+
+    def progress(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        run = self._runs.get(job["id"])
+        counts = run.counts() if run is not None else job["counts"]
+        done = counts["sent"] + counts["blocked"] + counts["failed"] + counts["unknown"]
+        rate = eta = None
+        if run is not None:
+            elapsed = time.monotonic() - run.started
+            if run.done and elapsed > 0:
+                rate = run.done / elapsed
+                eta = (counts["total"] - done) / rate
+        return dict(counts, done=done, rate=rate, eta_s=eta, state=job["state"])
+
+    def render(self, job: Dict[str, Any]) -> str:
+        p = self.progress(job)
+        pct = p["done"] * 100 // p["total"] if p["total"] else 100
+        head = {"running": "📤 Рассылка", "paused": "⏸ Рассылка на паузе", "cancelled": "⛔ Рассылка отменена",
+                "done": "✅ Рассылка завершена"}.get(p["state"], "📤 Рассылка")
+        text = (f"{head} <code>{job['id']}</code>: <b>{p['done']}</b>/{p['total']} ({pct}%)\n"
+                f"✅ {p['sent']}  🚫 заблокировали {p['blocked']}  ❌ {p['failed']}")
+        if p["unknown"]:
+            text += f"  ❔ {p['unknown']}"
+        if p["rate"]:
+            text += f"\n⚡ {p['rate']:.1f} сообщ./с, осталось ~{_duration(p['eta_s'])}"
+        if p["state"] == "done" and job.get("finished"):
+            text += f"\n⏱ {_duration(job['finished'] - job['created'])}"
+        return text
+
+    # ---- worker ----
+
+    def _launch(self, bot, job: Dict[str, Any]):
+        # No outcome was saved for these: count them, don't send again
+        job["counts"]["unknown"] += len(job.get("in_flight") or ())
+        job["in_flight"] = []
+        run = self._runs[job["id"]] = _Run(job)
+        chat_id, message_id = job.get("progress") or (None, None)
+        if chat_id is not None:
+            run.live = stream_edits.open(chat_id, _MessageRef(bot, chat_id, message_id), parse_mode="HTML")
+        run.task = asyncio.create_task(self._run(bot, run))
+
+    async def _run(self, bot, run: _Run):
+        job = run.job
+        slots = asyncio.Semaphore(self.concurrency)
+        sends = run.sends
+        ticker = asyncio.create_task(self._ticker(run))
+        try:
+            for i, user_id in enumerate(run.recipients):
+                await slots.acquire()
+                if run.stop:
+                    slots.release()
+                    break
+                run.status[i:i + 1] = IN_FLIGHT
+                run.cursor = i + 1
+                send = asyncio.create_task(self._send(bot, run, i, user_id, slots))
+                sends.add(send)
+                send.add_done_callback(sends.discard)
+            if sends:
+                await asyncio.gather(*sends, return_exceptions=True)
+        except asyncio.CancelledError:
+            run.stop = run.stop or "shutdown"  # loop going down: resume next start
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast {job['id']} stopped: {e}")
+            run.stop = run.stop or "paused"  # /broadcast resume picks it up again
+        finally:
+            ticker.cancel()
+            self._checkpoint(run)
+            self._runs.pop(job["id"], None)
+            if run.stop != "shutdown":
+                job["state"] = run.stop or "done"
+            if job["state"] in ("done", "cancelled"):
+                job["finished"] = time.time()
+                self._prune()
+            if run.live is not None:
+                if run.stop == "shutdown":
+                    run.live.close()
+                else:
+                    try:
+                        await run.live.finish(self.render(job), parse_mode="HTML")
+                    except Exception:
+                        pass
+            await storage.save()
+
+    async def _send(self, bot, run: _Run, i: int, user_id: int, slots: asyncio.Semaphore):
+        job = run.job
+        outcome = IN_FLIGHT  # stays so if cancelled: it may or may not have gone
+        try:
+            await self.outbox.send_message(bot, user_id, job["text"], priority=BROADCAST,
+                                           parse_mode=job["parse_mode"])
+            outcome = SENT
+        except Forbidden:
+            outcome = BLOCKED
+            mark_blocked(user_id)
+        except BadRequest as e:
+            if any(s in str(e).lower() for s in _GONE):
+                outcome = BLOCKED
+                mark_blocked(user_id)
+            else:
+                outcome = FAILED
+        except Exception as e:
+            outcome = FAILED
+            logger.debug(f"Broadcast {job['id']} to {user_id} failed: {e}")
+        finally:
+            run.status[i:i + 1] = outcome
+            run.done += 1
+            slots.release()
+
+    async def _ticker(self, run: _Run):
+        last_checkpoint = time.monotonic()
+        while True:
+            await asyncio.sleep(PROGRESS_S)
+            if run.live is not None:
+                run.live.update(self.render(run.job))
+            if time.monotonic() - last_checkpoint >= CHECKPOINT_S:
+                last_checkpoint = time.monotonic()
+                self._checkpoint(run)
+                await storage.save()
+
+    def _checkpoint(self, run: _Run):
+        """Write the run's position into the job — all of it at once, so a save
+        never sees a `last_id` ahead of the outcomes it covers."""
+        job = run.job
+        if run.cursor:
+            job["last_id"] = run.recipients[run.cursor - 1]
+        job["in_flight"] = [run.recipients[i] for i, c in enumerate(run.status[:run.cursor]) if c == IN_FLIGHT[0]]
+        job["counts"] = run.counts()
+
+    def _prune(self):
+        finished = sorted((j for j in self.jobs.values() if j.get("state") in ("done", "cancelled")),
+                          key=lambda j: j["created"])
+        for job in finished[:-KEEP_FINISHED]:
+            self.jobs.pop(job["id"], None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Jobs that aren't finished, with their progress."""
+        return {job_id: self.progress(job) for job_id, job in self.jobs.items()
+                if job["state"] in ("running", "paused")}
+
+
+def _duration(seconds: Optional[float]) -> str:
+    seconds = int(seconds or 0)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} мин {seconds % 60} с"
+    return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+
+
+broadcasts = BroadcastEngine()
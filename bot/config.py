@@ -24,13 +24,83 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN", "")
 GITHUB_REPO = os.getenv("GITHUB_REPO", "")  # e.g. username/repo
 GITHUB_FILE_PATH = os.getenv("GITHUB_FILE_PATH", "bot_data.json")
+# Override to point storage at a stand-in server (see tools/fake_github.py)
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+# Branch the sharded layout commits to; empty = the repo's default branch
+GITHUB_BRANCH = os.getenv("GITHUB_BRANCH", "")
 CREATOR_ID = _int_env("CREATOR_ID", 0)
 
+# Write-behind persistence: storage.save() only marks state dirty and a
+# background flusher uploads at most once per window. Set STORAGE_WRITE_BEHIND=0
+# to make every save() a blocking upload again.
+STORAGE_WRITE_BEHIND = os.getenv("STORAGE_WRITE_BEHIND", "1").strip() != "0"
+# Local write-ahead journal: every STORAGE_JOURNAL_FSYNC_MS the records touched
+# since the last batch are appended + fsynced under STORAGE_JOURNAL_DIR and
+# replayed on the next start. With it on, remote saves can be rare, so the
+# default flush window grows to a minute. Empty dir = disabled.
+STORAGE_JOURNAL_DIR = os.getenv("STORAGE_JOURNAL_DIR", "")
+STORAGE_JOURNAL_FSYNC_MS = _int_env("STORAGE_JOURNAL_FSYNC_MS", 1000)
+STORAGE_FLUSH_WINDOW_MS = _int_env("STORAGE_FLUSH_WINDOW_MS", 60000 if STORAGE_JOURNAL_DIR else 2000)
+# "github" (default) or "sqlite" — a local WAL-mode database at STORAGE_SQLITE_PATH
+# with one row per user/group. Import existing data with tools/migrate_storage.py.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "github").strip().lower()
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "data/bot.sqlite3")
+# GitHub layout: "file" = single GITHUB_FILE_PATH via the Contents API (1 MB read cap).
+# "sharded" = users/groups hashed into STORAGE_SHARDS files per collection under
+# STORAGE_DATA_DIR, committed via the Git Data API; only changed shards upload.
+# Switching file → sharded imports GITHUB_FILE_PATH on first start.
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "file").strip().lower()
+STORAGE_SHARDS = _int_env("STORAGE_SHARDS", 16)
+# Keep users/groups as compact __slots__ records (bot/records.py) instead of
+# plain dicts — roughly halves resident memory per user. 0 = plain dicts.
+STORAGE_COMPACT_RECORDS = os.getenv("STORAGE_COMPACT_RECORDS", "1").strip() != "0"
+STORAGE_DATA_DIR = os.getenv("STORAGE_DATA_DIR", "") or os.path.splitext(GITHUB_FILE_PATH)[0]
+# How the GitHub backends encode what they store: "v1" = versioned, zlib-compressed
+# entry stream (bot/storage.py, SNAPSHOT FORMAT); "json" = the legacy plain JSON
+# document that releases before v1 can read. Both formats are always readable.
+STORAGE_SNAPSHOT_FORMAT = os.getenv("STORAGE_SNAPSHOT_FORMAT", "v1").strip().lower()
+# Cold-user pager (needs compact records): the chat_history/memory/notes/quizzes
+# of users idle for STORAGE_PAGE_IDLE_S, or beyond the STORAGE_RESIDENT_USERS
+# most recently active, move to a zlib-compressed file under STORAGE_PAGER_DIR
+# and come back on the next get_user(). Empty dir = disabled.
+STORAGE_PAGER_DIR = os.getenv("STORAGE_PAGER_DIR", "")
+STORAGE_RESIDENT_USERS = _int_env("STORAGE_RESIDENT_USERS", 5000)
+STORAGE_PAGE_IDLE_S = _int_env("STORAGE_PAGE_IDLE_S", 1800)
+
+# Event-loop stall monitor (bot/loopmon.py): a probe wakes every
+# LOOP_MONITOR_INTERVAL_MS and measures how late it ran; stalls longer than
+# LOOP_STALL_WARN_MS are logged. Numbers show up in /healthz and creator /stats.
+LOOP_MONITOR_INTERVAL_MS = _int_env("LOOP_MONITOR_INTERVAL_MS", 50)
+LOOP_STALL_WARN_MS = _int_env("LOOP_STALL_WARN_MS", 250)
+# Outbound HTTP pools (bot/http_clients.py): how long an idle kept-alive
+# connection stays open, and how long resolved DNS answers are reused.
+HTTP_KEEPALIVE_S = _int_env("HTTP_KEEPALIVE_S", 75)
+HTTP_DNS_TTL_S = _int_env("HTTP_DNS_TTL_S", 300)
+# AI response cache (bot/ai.py): how many answers to deterministic utility calls
+# (/translate, /summary, reminder parsing, quiz, document analysis) to keep.
+# Per-call-site TTLs live in ai.CACHE_TTLS. 0 = disabled.
+AI_CACHE_SIZE = _int_env("AI_CACHE_SIZE", 2000)
+# Telegram flood limits (bot/flood.py): messages + edits per second for the
+# whole bot, and how much of that live-streamed answers may use for their
+# edits (bot/edits.py) — with many streams live each one is edited less often.
+TG_GLOBAL_RATE = _int_env("TG_GLOBAL_RATE", 30)
+TG_STREAM_EDITS_PER_S = _int_env("TG_STREAM_EDITS_PER_S", 20)
+
 BOT_VERSION = "3.5.0"
 BOT_BUILD_DATE = "2026-06-16"
 
-# Chat memory: how many last user/assistant turns to keep
+# Chat memory: how many last user/assistant turns to keep stored. How many of
+# them are sent depends on the model's prompt budget (bot/context.py).
 CHAT_HISTORY_LIMIT = 10
+# Rolling summary: keep this many latest turns verbatim and fold older ones into
+# a short running summary (refreshed in the background after replies), sent as
+# a system block. Keeps prompt size flat on long chats. 0 = off.
+AI_SUMMARY_KEEP_TURNS = _int_env("AI_SUMMARY_KEEP_TURNS", 6)
+# Failover (/failover, opt-in per user): if the user's provider hasn't answered
+# (or sent the first streamed chunk) within this many ms, the next provider they
+# have a key for is started too, and the first answer wins. A failed provider
+# hands over immediately. 0 = hand over on failure only.
+AI_HEDGE_AFTER_MS = _int_env("AI_HEDGE_AFTER_MS", 2500)
 # Group message buffer (for /summary)
 GROUP_HISTORY_LIMIT = 60
 
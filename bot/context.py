@@ -0,0 +1,134 @@
+"""Chat-history assembly under a per-model token budget.
+
+Storage keeps the last CHAT_HISTORY_LIMIT turns; how many of them go to the
+provider depends on the model. A small fast model (llama-3.1-8b-instant) gets
+a short prompt, a long-context one (gemini, claude, gpt-4o) gets more of the
+conversation. History is packed newest first; the first turn that no longer
+fits whole is condensed to the room left, anything older is dropped.
+
+Token counts are estimated locally (no tokenizer download): BPE vocabularies
+encode a common English word as ~1 token and split long or non-Latin words
+into pieces of a few characters, which is what estimate_tokens() mimics.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Whole-prompt budgets (system prompt + history + user message), in estimated
+# tokens. First matching substring of the model id wins, so put specific
+# patterns ("8b-instant", "mini") before broad ones ("70b", "gpt-4").
+PROMPT_BUDGETS: Tuple[Tuple[str, int], ...] = (
+    ("8b-instant", 1500),
+    ("8b", 2000),
+    ("gemma2-9b", 2000),
+    ("command-light", 1500),
+    ("flash-lite", 4000),
+    ("gemini", 16000),     # before "mini", which it contains
+    ("haiku", 5000),
+    ("mini", 5000),
+    ("gpt-3.5", 3000),
+    ("nemo", 3000),
+    ("small", 3000),
+    ("mixtral", 4000),
+    ("70b", 5000),
+    ("claude", 10000),
+    ("gpt-4", 10000),
+    ("o4", 10000),
+    ("grok", 10000),
+    ("deepseek", 8000),
+    ("command-r", 8000),
+    ("mistral-large", 8000),
+)
+DEFAULT_PROMPT_BUDGET = 4000
+# Per-message framing (role markers, separators) most chat formats add
+MESSAGE_OVERHEAD = 4
+# Don't bother condensing a turn into less than this — drop it instead
+CONDENSE_MIN_TOKENS = 48
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough BPE token count: ~4 chars per token for ASCII words (short ones
+    are a single token), ~2 chars per token for other scripts, 1 per symbol."""
+    tokens = 0
+    for piece in _PIECE_RE.findall(text or ""):
+        n = len(piece)
+        if n <= 4:
+            tokens += 1
+        elif piece.isascii():
+            tokens += (n + 3) // 4
+        else:
+            tokens += (n + 1) // 2
+    return tokens
+
+
+# Stored turns are re-packed on every call, and their strings (with cached
+# hashes) are the same objects each time — remembering their counts is nearly
+# free and the cache holds no extra copies.
+_history_tokens = lru_cache(maxsize=2048)(estimate_tokens)
+
+
+def prompt_budget(model: str) -> int:
+    model = (model or "").lower()
+    for pattern, budget in PROMPT_BUDGETS:
+        if pattern in model:
+            return budget
+    return DEFAULT_PROMPT_BUDGET
+
+
+def _condense(text: str, tokens: int, room: int) -> str:
+    """Keep the opening of `text` (~`room` of its `tokens`), marked as cut."""
+    keep = max(int(len(text) * room / max(tokens, 1)) - 1, 0)
+    return text[:keep].rstrip() + "…"
+
+
+class ContextReport(NamedTuple):
+    budget: int
+    prompt_tokens: int     # system + history + user message, estimated
+    history_tokens: int
+    sent: int              # history messages included
+    condensed: int         # ... of which shortened to fit
+    dropped: int           # older messages left out
+
+
+def assemble_history(history: List[Dict[str, str]], model: str,
+                     system_prompt: Optional[str], prompt: str) -> Tuple[List[Dict[str, str]], ContextReport]:
+    """Newest-first packing of `history` into what the model's budget leaves
+    after the system prompt and the new user message."""
+    budget = prompt_budget(model)
+    fixed = estimate_tokens(prompt) + MESSAGE_OVERHEAD
+    if system_prompt:
+        fixed += estimate_tokens(system_prompt) + MESSAGE_OVERHEAD
+    room = budget - fixed
+
+    picked: List[Tuple[Dict[str, str], int, bool]] = []  # (message, cost, condensed)
+    used = 0
+    for msg in reversed(history):
+        content = msg.get("content") or ""
+        cost = _history_tokens(content) + MESSAGE_OVERHEAD
+        if used + cost <= room:
+            picked.append((msg, cost, False))
+            used += cost
+            continue
+        left = room - used - MESSAGE_OVERHEAD
+        if left >= CONDENSE_MIN_TOKENS:
+            short = {"role": msg["role"], "content": _condense(content, cost - MESSAGE_OVERHEAD, left)}
+            picked.append((short, left + MESSAGE_OVERHEAD, True))
+            used += left + MESSAGE_OVERHEAD
+        break
+    # Anthropic/Gemini want the conversation to open with a user turn
+    while picked and picked[-1][0].get("role") != "user":
+        used -= picked.pop()[1]
+    picked.reverse()
+
+    messages = [msg for msg, _, _ in picked]
+    report = ContextReport(
+        budget=budget,
+        prompt_tokens=fixed + used,
+        history_tokens=used,
+        sent=len(messages),
+        condensed=sum(1 for _, _, short in picked if short),
+        dropped=len(history) - len(messages),
+    )
+    return messages, report
@@ -0,0 +1,263 @@
+"""One scheduler for every live-edited message (streamed AI answers).
+
+Each stream only says what its message should show now (`live.update()`);
+the scheduler decides when that becomes an editMessageText call:
+
+  * cadence — a stream is edited at most every `interval()` seconds: the
+    STREAM_EDIT_INTERVAL floor, the chat's own limit (bot/flood.py), or the
+    stream's share of TG_STREAM_EDITS_PER_S when many streams are live, which
+    ever is longest. Text that changes in between is coalesced — only the
+    newest version is sent.
+  * budget — every edit spends a token from the bot-wide telegram_bucket.
+  * RetryAfter — the chat gets nothing until it expires, and the edit rate
+    is halved (it creeps back up with every successful edit).
+  * finals — `await live.finish(text, ...)` jumps ahead of all pending
+    previews (and of the chat's cadence), waits only for the stream's own
+    in-flight edit, and is retried through RetryAfter and network errors.
+
+    live = stream_edits.open(chat_id, placeholder)
+    live.update(text + " ▌")          # as often as you like
+    await live.finish(text, reply_markup=kb)
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from bot.config import TG_STREAM_EDITS_PER_S
+from bot.flood import ChatPacer, TokenBucket, chat_interval, chat_pacer, retry_after_s, telegram_bucket
+
+logger = logging.getLogger(__name__)
+
+# Never edit one stream more often than this, seconds
+STREAM_EDIT_INTERVAL = 1.5
+# Attempts for a final edit that fails on the network / RetryAfter
+FINAL_ATTEMPTS = 4
+# Lower bound for the adaptive edit-rate factor
+MIN_RATE_SCALE = 0.25
+
+
+class LiveEdit:
+    """A message whose text follows a stream."""
+    __slots__ = ("scheduler", "chat_id", "message", "kwargs", "text", "shown", "next_at", "busy", "closed", "dead")
+
+    def __init__(self, scheduler: "EditScheduler", chat_id: int, message, kwargs: Dict[str, Any]):
+        self.scheduler = scheduler
+        self.chat_id = chat_id
+        self.message = message
+        self.kwargs = kwargs  # for preview edits
+        self.text = ""        # what the message should show
+        self.shown = ""       # what it shows (last successful edit)
+        self.next_at = 0.0    # cadence: no preview edit before this
+        self.busy = False     # an edit is in flight
+        self.closed = False   # no more previews (finishing or abandoned)
+        self.dead = False     # the message can't be edited any more (deleted, too old)
+
+    def update(self, text: str):
+        self.scheduler._update(self, text)
+
+    async def finish(self, text: str, **kwargs) -> bool:
+        """Final edit (plus e.g. parse_mode / reply_markup); True once Telegram shows it."""
+        return await self.scheduler._finish(self, text, kwargs)
+
+    def close(self):
+        """Drop pending previews without a final edit (the caller replaces the message)."""
+        self.scheduler._close(self)
+
+
+class _Final:
+    __slots__ = ("live", "text", "kwargs", "future", "attempts")
+
+    def __init__(self, live: LiveEdit, text: str, kwargs: Dict[str, Any], future: asyncio.Future):
+        self.live = live
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+
+class EditScheduler:
+    def __init__(self, edits_per_s: float = TG_STREAM_EDITS_PER_S, bucket: TokenBucket = telegram_bucket,
+                 pacer: ChatPacer = chat_pacer):
+        self.edits_per_s = max(edits_per_s, 0.1)
+        self.bucket = bucket
+        self.pacer = pacer
+        self.rate_scale = 1.0
+        self._live: Dict[int, LiveEdit] = {}
+        self._finals: Deque[_Final] = deque()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.edits = 0
+        self.superseded = 0   # previews replaced by newer text before being sent
+        self.retry_after = 0
+        self.failed = 0
+        self.finals = 0
+
+    def interval(self, chat_id: int) -> float:
+        share = len(self._live) / (self.edits_per_s * self.rate_scale)
+        return max(STREAM_EDIT_INTERVAL, chat_interval(chat_id), share)
+
+    def open(self, chat_id: int, message, **kwargs) -> LiveEdit:
+        """`message` needs an async edit_text(); kwargs go with every preview
+        edit (default: no link previews)."""
+        live = LiveEdit(self, chat_id, message, kwargs or {"disable_web_page_preview": True})
+        self._live[id(live)] = live
+        return live
+
+    # ---- LiveEdit backends ----
+
+    def _update(self, live: LiveEdit, text: str):
+        if live.closed or live.dead or text == live.text:
+            return
+        if live.text != live.shown:
+            self.superseded += 1
+        live.text = text
+        if text != live.shown:
+            self._kick()
+
+    async def _finish(self, live: LiveEdit, text: str, kwargs: Dict[str, Any]) -> bool:
+        self._close(live)
+        if live.dead:
+            return False
+        item = _Final(live, text, kwargs, asyncio.get_running_loop().create_future())
+        self._finals.append(item)
+        self._kick()
+        return await item.future
+
+    def _close(self, live: LiveEdit):
+        live.closed = True
+        self._live.pop(id(live), None)
+
+    # ---- worker ----
+
+    def _kick(self):
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        self._wake.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._live or self._finals:
+            self._wake.clear()
+            wait = self._dispatch()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self) -> Optional[float]:
+        """Start every edit that may go now; seconds until the next one could
+        (None = nothing to do until an update, a finish or an edit completes)."""
+        now = time.monotonic()
+        soonest: Optional[float] = None
+
+        def later(seconds: float):
+            nonlocal soonest
+            soonest = seconds if soonest is None else min(soonest, seconds)
+
+        # Finals first, in order; the chat's cadence doesn't apply to them
+        for item in list(self._finals):
+            if item.live.busy:
+                continue  # its in-flight preview must land first; completion wakes us
+            hold = self.pacer.ready_at(item.live.chat_id, paced=False) - now
+            if hold > 0:
+                later(hold)
+                continue
+            wait = self.bucket.delay()
+            if wait > 0:
+                later(wait)
+                return soonest
+            self.bucket.take()
+            self._finals.remove(item)
+            self._start(item.live, item.text, item.kwargs, item)
+
+        pending = []
+        for live in self._live.values():
+            if live.busy or live.text == live.shown:
+                continue
+            pending.append((max(live.next_at, self.pacer.ready_at(live.chat_id)), live))
+        pending.sort(key=lambda p: p[0])
+        for due, live in pending:
+            if due > now:
+                later(due - now)
+                break
+            ready = self.pacer.ready_at(live.chat_id)
+            if ready > now:
+                later(ready - now)  # another stream in this chat just went
+                continue
+            wait = self.bucket.delay()
+            if wait > 0:
+                later(wait)
+                break
+            self.bucket.take()
+            live.next_at = now + self.interval(live.chat_id)
+            self.pacer.spent(live.chat_id, now)
+            self._start(live, live.text, live.kwargs)
+        return soonest
+
+    def _start(self, live: LiveEdit, text: str, kwargs: Dict[str, Any], final: Optional[_Final] = None):
+        live.busy = True
+        asyncio.create_task(self._edit(live, text, kwargs, final))
+
+    async def _edit(self, live: LiveEdit, text: str, kwargs: Dict[str, Any], final: Optional[_Final]):
+        ok = retry = False
+        try:
+            await live.message.edit_text(text, **kwargs)
+            ok = True
+        except RetryAfter as e:
+            seconds = retry_after_s(e)
+            self.retry_after += 1
+            self.pacer.hold(live.chat_id, seconds)
+            self.rate_scale = max(self.rate_scale / 2, MIN_RATE_SCALE)
+            logger.warning(f"Stream edit in chat {live.chat_id}: RetryAfter {seconds:g}s")
+            retry = True
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                ok = True
+            else:
+                # Deleted message, message too old, bad markup: no point in editing it again
+                live.dead = final is None
+                self.failed += 1
+                logger.debug(f"Stream edit in chat {live.chat_id} rejected: {e}")
+        except NetworkError as e:  # incl. TimedOut
+            retry = True
+            logger.debug(f"Stream edit in chat {live.chat_id} failed: {e}")
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Stream edit in chat {live.chat_id} failed: {e}")
+        finally:
+            live.busy = False
+        if ok:
+            self.edits += 1
+            live.shown = text
+            self.rate_scale = min(self.rate_scale * 1.05, 1.0)
+        if final is not None:
+            final.attempts += 1
+            if retry and final.attempts < FINAL_ATTEMPTS:
+                self._finals.appendleft(final)
+            elif not final.future.done():
+                if ok:
+                    self.finals += 1
+                elif retry:
+                    self.failed += 1  # gave up after FINAL_ATTEMPTS
+                final.future.set_result(ok)
+        self._kick()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "live": len(self._live),
+            "interval_s": round(self.interval(1), 2),
+            "rate_scale": round(self.rate_scale, 2),
+            "edits": self.edits,
+            "superseded": self.superseded,
+            "finals": self.finals,
+            "retry_after": self.retry_after,
+            "failed": self.failed,
+        }
+
+
+stream_edits = EditScheduler()
@@ -0,0 +1,106 @@
+"""Telegram Bot API flood limits.
+
+Telegram throttles a bot that sends (or edits) faster than roughly 30
+messages a second overall, one a second in a private chat and 20 a minute in
+a group; past that, calls fail with RetryAfter and the chat is frozen for the
+given number of seconds. Everything that talks to the Bot API in bulk — live
+stream edits (bot/edits.py) and queued deliveries (bot/outbox.py) — draws from
+the same `telegram_bucket` and spaces its calls per chat with the same
+`chat_pacer`, so together they stay under the limits.
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+from bot.config import TG_GLOBAL_RATE
+
+# Minimum spacing between messages/edits in one chat, seconds
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0   # 20 per minute
+
+
+def chat_interval(chat_id: int) -> float:
+    """Per-chat spacing; group and channel ids are negative."""
+    return GROUP_CHAT_INTERVAL if chat_id < 0 else PRIVATE_CHAT_INTERVAL
+
+
+def retry_after_s(e) -> float:
+    """Seconds from a telegram.error.RetryAfter (int or timedelta, by PTB version)."""
+    ra = e.retry_after
+    return ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+
+
+class TokenBucket:
+    """`rate` tokens a second, at most `burst` banked."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = max(rate, 0.001)
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.burst
+        self._at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._at) * self.rate)
+        self._at = now
+
+    def delay(self, reserve: float = 0.0) -> float:
+        """Seconds until a token is available (0 = now) while leaving `reserve`
+        tokens for others: bulk senders ask with a reserve, so a burst of them
+        never takes the last tokens an interactive call needs."""
+        now = time.monotonic()
+        self._refill(now)
+        need = min(1 + reserve, self.burst)
+        wait = max(self._paused_until - now, 0.0)
+        if self._tokens < need:
+            wait = max(wait, (need - self._tokens) / self.rate)
+        return wait
+
+    def take(self):
+        """Spend a token (callers check delay() first; a debt is paid back by waiting)."""
+        self._refill(time.monotonic())
+        self._tokens -= 1
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.take()
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hand out nothing for `seconds` (a bot-wide RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class ChatPacer:
+    """When each chat may get its next message/edit: chat_interval() after the
+    last one (a bucket one token deep), or later while a RetryAfter holds it."""
+
+    def __init__(self):
+        self._next: Dict[int, float] = {}
+        self._hold: Dict[int, float] = {}
+
+    def ready_at(self, chat_id: int, paced: bool = True) -> float:
+        """Monotonic time the chat is free; paced=False ignores the spacing
+        (final edits, interactive sends) but never a RetryAfter hold."""
+        hold = self._hold.get(chat_id, 0.0)
+        return max(self._next.get(chat_id, 0.0), hold) if paced else hold
+
+    def spent(self, chat_id: int, now: float):
+        self._next[chat_id] = now + chat_interval(chat_id)
+        if len(self._next) > 5000:
+            self._next = {c: t for c, t in self._next.items() if t > now}
+
+    def hold(self, chat_id: int, seconds: float):
+        now = time.monotonic()
+        self._hold[chat_id] = max(self._hold.get(chat_id, 0.0), now + seconds)
+        if len(self._hold) > 500:
+            self._hold = {c: t for c, t in self._hold.items() if t > now}
+
+
+# A small burst only: a full second's worth banked on top of the steady rate
+# would allow ~2x the limit in the first second after a lull.
+telegram_bucket = TokenBucket(TG_GLOBAL_RATE, burst=max(TG_GLOBAL_RATE / 5, 1.0))
+chat_pacer = ChatPacer()
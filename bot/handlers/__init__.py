@@ -5,10 +5,11 @@ from .base import (start_command, help_command, info_command, status_command,
                     share_command, referrals_command, onboard_command,
                     webapp_command)
 from .ai_memory import (setprovider_command, setkey_command, setmodel_command, ai_command, clear_command,
-                         memorysave_command, memoryget_command, memorylist_command, memorydel_command)
+                         failover_command, memorysave_command, memoryget_command, memorylist_command, memorydel_command)
 from .notes import note_command, notes_command, delnote_command, todo_command
 from .vip_creator import (vip_command, remind_command, reminders_command, unremind_command, feedback_command,
-                           grant_vip_command, broadcast_command, stats_command, users_command)
+                           grant_vip_command, broadcast_command, stats_command, users_command,
+                           my_chat_member_handler)
 from .groups import (grouphelp_command, ban_command, warn_command, warnings_command, unwarn_command,
                       mute_command, unmute_command, kick_command, purge_command,
                       antilink_command, antispam_command, welcome_command, goodbye_command,
@@ -1,14 +1,18 @@
 import asyncio
 import html
+import logging
 import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ChatAction
-from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 from bot.storage import storage
 from bot.ai import ai_handler, PROVIDERS, STREAMING_PROVIDERS
+from bot.edits import stream_edits
+from bot.outbox import outbox
 from bot.i18n import t
 
+logger = logging.getLogger(__name__)
+
 
 def _action_buttons(lang: str) -> InlineKeyboardMarkup:
     """Inline keyboard attached under a finished AI response."""
@@ -24,14 +28,32 @@ MAX_MEMORY_VALUE_LEN = 1000
 # Cap memory entries injected into AI system prompts
 MEMORY_SYSTEM_PROMPT_CAP = 30
 
-# Streaming: re-edit Telegram message at most every N seconds.
-# Telegram allows ~30 edits/min per chat → 2s is the safe floor; 1.5s gives
-# us margin while still feeling live.
-STREAM_EDIT_INTERVAL = 1.5
-# Stop streaming-edit if accumulated text exceeds this; switch to send_new_chunks
+# Streaming: how often the placeholder is re-edited is up to bot/edits.py
+# (per-chat limits, the bot-wide edit budget, RetryAfter).
+# Typing indicator lasts ~5s; refresh it this often while a stream runs
+STREAM_TYPING_INTERVAL = 4.5
+# A streamed answer longer than this rolls over: the message is finished at a
+# paragraph/sentence boundary and streaming continues in a new one
 STREAM_MAX_EDIT_LEN = 3800
 
 
+# Fire-and-forget tasks of running streams (the loop only keeps weak references)
+_background = set()
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_reap)
+    return task
+
+
+def _reap(task: asyncio.Task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Stream background task failed: {task.exception()!r}")
+
+
 async def _typing(context, chat_id):
     """Fire-and-forget typing indicator; failure is silent (user may have blocked the bot)."""
     try:
@@ -40,96 +62,109 @@ async def _typing(context, chat_id):
         pass
 
 
-async def _stream_to_message(update, context, prompt, system_prompt, lang):
+async def _stream_to_message(update, context, prompt, system_prompt, lang, *, use_history=True,
+                             image_b64=None, image_mime="image/jpeg", cache=None, placeholder=None):
     """Run a streaming AI response and update the Telegram message live.
-    Returns the final accumulated text. Also stores last_ai_turn on the user
-    and attaches action buttons (regenerate / save as note)."""
+    Returns the final accumulated text. A chat turn (use_history) also stores
+    last_ai_turn on the user and attaches action buttons (regenerate / save
+    as note); one-off analyses (photo, document: use_history=False, optional
+    image/`cache` as in generate_response) just stream their answer, into
+    `placeholder` if the caller already posted a status message."""
     uid = update.effective_user.id
     chat_id = update.effective_chat.id
     user = storage.get_user(uid)
     provider = user.get("ai_provider", "gemini")
     is_private = update.effective_chat.type == "private"
+    is_turn = use_history
 
     await _typing(context, chat_id)
-    placeholder = await update.message.reply_text(t(lang, "ai_thinking"))
+    if placeholder is None:
+        placeholder = await update.message.reply_text(t(lang, "ai_thinking"))
+    ai_kwargs = dict(system_prompt=system_prompt, use_history=use_history,
+                     image_b64=image_b64, image_mime=image_mime, cache=cache)
 
     # If the provider can't stream, do the old single-shot path
     if provider not in STREAMING_PROVIDERS:
-        response = await ai_handler.generate_response(uid, prompt, system_prompt=system_prompt)
+        response = await ai_handler.generate_response(uid, prompt, **ai_kwargs)
         if response.startswith("❌"):
             await placeholder.edit_text(response, parse_mode="HTML")
         elif len(response) > 3800:
             await placeholder.delete()
             await _send_long(update.message, response)
         else:
-            kb = _action_buttons(lang) if is_private else None
+            kb = _action_buttons(lang) if is_private and is_turn else None
             await placeholder.edit_text(response, disable_web_page_preview=True, reply_markup=kb)
-            user["last_ai_turn"] = {"prompt": prompt[:2000], "response": response[:3800],
-                                     "system_prompt": (system_prompt or "")[:1500]}
-            await storage.save()
+            if is_turn:
+                user["last_ai_turn"] = {"prompt": prompt[:2000], "response": response[:3800],
+                                         "system_prompt": (system_prompt or "")[:1500]}
+                await storage.save()
         return response
 
     acc = ""
-    last_edit = 0.0
-    last_text = ""
     error_text = None
+    live = stream_edits.open(chat_id, placeholder)
+    frozen = 0   # acc[:frozen] is in earlier, finished messages
+    carry = ""   # code fence reopened at the top of the current message
+    last_typing = time.monotonic()
+
+    async def roll_over():
+        """Finish the current message at a boundary and continue in a new one."""
+        nonlocal live, frozen, carry
+        while len(carry) + len(acc) - frozen > STREAM_MAX_EDIT_LEN:
+            tail = carry + acc[frozen:]
+            cut = _split_point(tail, STREAM_MAX_EDIT_LEN)
+            head = tail[:cut].rstrip()
+            frozen += cut - len(carry)
+            while frozen < len(acc) and acc[frozen].isspace():
+                frozen += 1
+            # An unclosed ``` block is closed here and reopened in the next message
+            carry = ""
+            if head.count("```") % 2:
+                head += "\n```"
+                carry = "```\n"
+            _spawn(live.finish(head, disable_web_page_preview=True))
+            preview = ((carry + acc[frozen:])[:STREAM_MAX_EDIT_LEN] + " ▌").strip()
+            msg = await outbox.send(chat_id, lambda: update.effective_message.reply_text(
+                preview, disable_web_page_preview=True))
+            live = stream_edits.open(chat_id, msg)
+            live.shown = live.text = preview
 
     try:
-        async for chunk in ai_handler.stream_response(uid, prompt, system_prompt=system_prompt):
+        async for chunk in ai_handler.stream_response(uid, prompt, **ai_kwargs):
             if chunk.startswith("❌"):
                 error_text = chunk
                 break
             acc += chunk
+            if len(carry) + len(acc) - frozen > STREAM_MAX_EDIT_LEN:
+                await roll_over()
+            preview = (carry + acc[frozen:] + " ▌").strip()
+            if preview:
+                live.update(preview)  # sent when the edit scheduler gets to it
             now = time.monotonic()
-            if now - last_edit < STREAM_EDIT_INTERVAL:
-                continue
-            if len(acc) > STREAM_MAX_EDIT_LEN:
-                # Too long to keep editing — finalize current placeholder and break to chunked send
-                break
-            preview = (acc + " ▌").strip()
-            if preview == last_text or not preview:
-                continue
-            try:
-                await placeholder.edit_text(preview, disable_web_page_preview=True)
-                last_text = preview
-                last_edit = now
-                # Refresh typing indicator periodically
-                await _typing(context, chat_id)
-            except BadRequest:
-                # Telegram says "message not modified" or rate-limit; ignore and continue
-                continue
-            except Exception:
-                continue
+            if now - last_typing >= STREAM_TYPING_INTERVAL:
+                last_typing = now
+                _spawn(_typing(context, chat_id))
+        await roll_over()  # a cached answer arrives as one chunk
     except Exception as e:
         error_text = f"❌ {e}"
+    except BaseException:
+        live.close()  # cancelled: nobody will finish this message
+        raise
 
-    final = error_text or acc.strip()
-    if not final:
-        final = "…"
-
+    final = error_text or (carry + acc[frozen:]).strip() or "…"
+    kb = _action_buttons(lang) if (is_private and is_turn and not error_text) else None
+    # Always do a final edit (without cursor, with buttons if applicable)
     try:
-        if len(final) <= 3800:
-            kb = _action_buttons(lang) if (is_private and not error_text) else None
-            # Always do a final edit (without cursor, with buttons if applicable)
-            try:
-                await placeholder.edit_text(
-                    final,
-                    parse_mode="HTML" if error_text else None,
-                    disable_web_page_preview=True,
-                    reply_markup=kb,
-                )
-            except BadRequest:
-                pass
-        else:
-            try:
-                await placeholder.delete()
-            except Exception:
-                pass
-            await _send_long(update.message, final)
+        await live.finish(
+            final,
+            parse_mode="HTML" if error_text else None,
+            disable_web_page_preview=True,
+            reply_markup=kb,
+        )
     except Exception:
         pass
 
-    if not error_text:
+    if not error_text and is_turn:
         ai_handler.push_history(uid, prompt, acc)
         # Award weekly XP for a successful AI turn (small reward, builds streak feel)
         try:
@@ -155,10 +190,10 @@ async def _stream_to_message(update, context, prompt, system_prompt, lang):
             try:
                 from bot.handlers.proactive import maybe_suggest_memory
                 # Fire-and-forget — never blocks the reply
-                asyncio.create_task(maybe_suggest_memory(context, chat_id, user))
+                _spawn(maybe_suggest_memory(context, chat_id, user))
             except Exception:
                 pass
-    return final
+    return error_text or acc.strip() or "…"
 
 
 def _build_system_prompt(user: dict, base: str = "", group: dict | None = None) -> str:
@@ -194,14 +229,28 @@ def _build_system_prompt(user: dict, base: str = "", group: dict | None = None)
     return sp
 
 
+def _split_point(text: str, limit: int) -> int:
+    """Where to cut `text` into a first part of at most `limit` chars: the last
+    paragraph break, line break, sentence end or space in the second half of
+    that window, else hard at `limit`."""
+    if len(text) <= limit:
+        return len(text)
+    window = text[:limit]
+    for sep in ("\n\n", "\n", ". ", "! ", "? ", "; ", ", ", " "):
+        i = window.rfind(sep, limit // 2)
+        if i != -1:
+            return i + len(sep)
+    return limit
+
+
 async def _send_long(message, text: str):
     text = (text or "").strip() or "…"
     # Telegram max ~4096; chunk by 3800 to be safe
-    if len(text) <= 3800:
-        await message.reply_text(text, disable_web_page_preview=True)
-        return
-    for i in range(0, len(text), 3800):
-        await message.reply_text(text[i:i+3800], disable_web_page_preview=True)
+    while len(text) > 3800:
+        cut = _split_point(text, 3800)
+        await message.reply_text(text[:cut].rstrip(), disable_web_page_preview=True)
+        text = text[cut:].lstrip()
+    await message.reply_text(text, disable_web_page_preview=True)
 
 
 async def setprovider_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -226,6 +275,44 @@ async def setprovider_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.reply_text(t(lang, "provider_set", provider=provider), parse_mode="HTML")
 
 
+async def failover_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/failover [provider ...|off] — backup providers raced against the main one."""
+    from bot.ai import FAILOVER_MAX_PROVIDERS
+    from bot.config import AI_HEDGE_AFTER_MS
+    uid = update.effective_user.id
+    user = storage.get_user(uid)
+    lang = user.get("language", "en")
+    primary = user.get("ai_provider", "gemini")
+    if not context.args:
+        chain = " → ".join([primary] + list(user.get("ai_failover") or [])) if user.get("ai_failover") else "—"
+        await update.message.reply_text(t(lang, "failover_info", chain=chain, ms=AI_HEDGE_AFTER_MS), parse_mode="HTML")
+        return
+    if context.args[0].lower() in ("off", "none", "0"):
+        user.pop("ai_failover", None)
+        await storage.save()
+        await update.message.reply_text(t(lang, "failover_off"), parse_mode="HTML")
+        return
+    backups = []
+    for arg in context.args:
+        provider = arg.lower().strip(",")
+        if provider not in PROVIDERS:
+            await update.message.reply_text(t(lang, "provider_unknown", list=', '.join(PROVIDERS)))
+            return
+        if provider != primary and provider not in backups:
+            backups.append(provider)
+    backups = backups[:FAILOVER_MAX_PROVIDERS - 1]
+    if not backups:
+        await update.message.reply_text(t(lang, "failover_info", chain="—", ms=AI_HEDGE_AFTER_MS), parse_mode="HTML")
+        return
+    user["ai_failover"] = backups
+    await storage.save()
+    text = t(lang, "failover_set", chain=" → ".join([primary] + backups))
+    missing = [p for p in backups if not user.get("api_keys", {}).get(p)]
+    if missing:
+        text += "\n" + t(lang, "failover_no_key", list=", ".join(missing))
+    await update.message.reply_text(text, parse_mode="HTML")
+
+
 async def setkey_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     user = storage.get_user(uid)
@@ -32,6 +32,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 if inviter is not None:
                     user["referred_by"] = inviter_uid
                     inviter["referrals"] = int(inviter.get("referrals", 0)) + 1
+                    storage.mark_user_dirty(inviter_uid)
                     # Notify the inviter
                     try:
                         new_name = update.effective_user.first_name or "Friend"
@@ -10,16 +10,15 @@ We guard against replay (a tx hash can be claimed once, globally), require
 the payment to be recent, and require the amount to cover the tier price.
 On success we grant the tier exactly like a Stars purchase does.
 """
-import asyncio
 import logging
 import os
 import re
 import time
 
-import aiohttp
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
+from bot.http_clients import http_clients
 from bot.storage import storage
 from bot.i18n import t
 from bot.config import TIERS
@@ -53,7 +52,6 @@ ETH_RPCS = [
 
 AMOUNT_TOLERANCE = 0.05          # USDT — allow tiny rounding under-pay
 MAX_AGE_SEC = 24 * 3600          # payment must be within the last 24h
-HTTP_TIMEOUT = aiohttp.ClientTimeout(total=25)
 
 _TXHASH_RE = re.compile(r"^(0x)?[0-9a-fA-F]{64}$")
 
@@ -134,7 +132,7 @@ async def crypto_direct_callback(update: Update, context: ContextTypes.DEFAULT_T
         storage.data.setdefault("pending_crypto_direct", {})[str(uid)] = {
             "tier": tier, "net": net, "ts": time.time(),
         }
-        await storage.save()
+        await storage.flush()
 
         await query.edit_message_text(
             t(lang, "cd_pay_instructions",
@@ -234,7 +232,7 @@ async def handle_txhash_submission(update: Update, context: ContextTypes.DEFAULT
     except Exception:
         pass
     storage.data.get("pending_crypto_direct", {}).pop(str(uid), None)
-    await storage.save()
+    await storage.flush()
 
     await update.message.reply_text(
         t(lang, "cd_success",
@@ -264,20 +262,11 @@ async def _verify_trc20(txhash: str, to_addr: str, min_amount: float):
     _tg_key = os.getenv("TRONGRID_API_KEY", "")
     if _tg_key:
         headers["TRON-PRO-API-KEY"] = _tg_key
-    data = None
-    async with aiohttp.ClientSession(timeout=HTTP_TIMEOUT) as s:
-        for attempt in range(3):
-            async with s.get(url, headers=headers) as r:
-                if r.status == 200:
-                    data = await r.json()
-                    break
-                # Keyless TronGrid is rate-limited — back off and retry on 429.
-                if r.status == 429 and attempt < 2:
-                    await asyncio.sleep(1.5 * (attempt + 1))
-                    continue
-                return (False, 0.0, 0, "not_found")
-    if data is None:
-        return (False, 0.0, 0, "not_found")
+    # Keyless TronGrid is rate-limited — the "chain" pool backs off and retries 429s.
+    async with http_clients.request("chain", "GET", url, headers=headers) as r:
+        if r.status != 200:
+            return (False, 0.0, 0, "not_found")
+        data = await r.json()
     for tx in data.get("data", []):
         if str(tx.get("transaction_id", "")).lower() != norm.lower():
             continue
@@ -301,13 +290,13 @@ async def _verify_trc20(txhash: str, to_addr: str, min_amount: float):
     return (False, 0.0, 0, "not_found")
 
 
-async def _eth_rpc(session, method: str, params: list):
-    """Try each public RPC until one answers."""
+async def _eth_rpc(method: str, params: list):
+    """Try each public RPC until one answers (that fail-over is the retry policy)."""
     payload = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
     last = None
     for rpc in ETH_RPCS:
         try:
-            async with session.post(rpc, json=payload) as r:
+            async with http_clients.request("chain", "POST", rpc, json=payload, retries=0) as r:
                 if r.status != 200:
                     last = f"HTTP {r.status}"
                     continue
@@ -325,41 +314,40 @@ async def _eth_rpc(session, method: str, params: list):
 async def _verify_erc20(txhash: str, to_addr: str, min_amount: float):
     """Verify a USDT-ERC20 transfer to `to_addr` via public JSON-RPC."""
     to_clean = to_addr.lower().replace("0x", "")
-    async with aiohttp.ClientSession(timeout=HTTP_TIMEOUT) as s:
-        receipt = await _eth_rpc(s, "eth_getTransactionReceipt", [txhash])
-        if not receipt:
-            return (False, 0.0, 0, "not_found")
-        if str(receipt.get("status", "")).lower() not in ("0x1", "1"):
-            return (False, 0.0, 0, "no_transfer")
-
-        amount = None
-        for log in receipt.get("logs", []):
-            if str(log.get("address", "")).lower() != USDT_ERC20:
-                continue
-            topics = [str(x).lower() for x in log.get("topics", [])]
-            if len(topics) < 3 or topics[0] != TRANSFER_TOPIC:
-                continue
-            to_topic = topics[2][-40:]  # last 20 bytes = address
-            if to_topic != to_clean:
-                continue
-            try:
-                amount = int(log.get("data", "0x0"), 16) / (10 ** USDT_DECIMALS)
-            except (ValueError, TypeError):
-                continue
-            break
-        if amount is None:
-            return (False, 0.0, 0, "no_transfer")
+    receipt = await _eth_rpc("eth_getTransactionReceipt", [txhash])
+    if not receipt:
+        return (False, 0.0, 0, "not_found")
+    if str(receipt.get("status", "")).lower() not in ("0x1", "1"):
+        return (False, 0.0, 0, "no_transfer")
 
-        # Recency via the block timestamp
-        age = 0
-        blk = receipt.get("blockNumber")
-        if blk:
-            block = await _eth_rpc(s, "eth_getBlockByNumber", [blk, False])
-            if block and block.get("timestamp"):
-                ts = int(block["timestamp"], 16)
-                age = int(time.time() - ts)
-        if age > MAX_AGE_SEC:
-            return (False, amount, age, "too_old")
-        if amount < min_amount:
-            return (False, amount, age, "low_amount")
-        return (True, amount, age, "ok")
+    amount = None
+    for log in receipt.get("logs", []):
+        if str(log.get("address", "")).lower() != USDT_ERC20:
+            continue
+        topics = [str(x).lower() for x in log.get("topics", [])]
+        if len(topics) < 3 or topics[0] != TRANSFER_TOPIC:
+            continue
+        to_topic = topics[2][-40:]  # last 20 bytes = address
+        if to_topic != to_clean:
+            continue
+        try:
+            amount = int(log.get("data", "0x0"), 16) / (10 ** USDT_DECIMALS)
+        except (ValueError, TypeError):
+            continue
+        break
+    if amount is None:
+        return (False, 0.0, 0, "no_transfer")
+
+    # Recency via the block timestamp
+    age = 0
+    blk = receipt.get("blockNumber")
+    if blk:
+        block = await _eth_rpc("eth_getBlockByNumber", [blk, False])
+        if block and block.get("timestamp"):
+            ts = int(block["timestamp"], 16)
+            age = int(time.time() - ts)
+    if age > MAX_AGE_SEC:
+        return (False, amount, age, "too_old")
+    if amount < min_amount:
+        return (False, amount, age, "low_amount")
+    return (True, amount, age, "ok")
@@ -20,13 +20,16 @@ The digest itself shows:
 - Daily streak
 - Weekly XP rank (if user is in top 10)
 """
+import asyncio
 import datetime
 import html
 import re
 import time
+from collections.abc import Mapping
 from telegram import Update
 from telegram.ext import ContextTypes
 import pytz
+from bot.outbox import DIGEST, outbox
 from bot.storage import storage
 from bot.i18n import t
 
@@ -219,7 +222,7 @@ async def _maybe_send_digest(bot, user: dict) -> bool:
     lang = user.get("language", "en")
     try:
         text = _build_digest_message(user, lang)
-        await bot.send_message(user["id"], text, parse_mode="HTML")
+        await outbox.send_message(bot, user["id"], text, priority=DIGEST, parse_mode="HTML")
         user["last_digest_date"] = today_local
         return True
     except Exception:
@@ -229,16 +232,18 @@ async def _maybe_send_digest(bot, user: dict) -> bool:
 
 
 async def morning_digest_scheduler_task(bot):
-    """Called by APScheduler every 15 minutes. Iterates opted-in users."""
+    """Called by APScheduler every 15 minutes. Iterates opted-in users; the
+    digests that are due all go to the outbox at once."""
     users = storage.data.get("users", {})
+    checked = [(uid_str, user_obj, user_obj.get("last_digest_date"))
+               for uid_str, user_obj in list(users.items()) if isinstance(user_obj, Mapping)]
+    results = await asyncio.gather(*(_maybe_send_digest(bot, user_obj) for _, user_obj, _ in checked),
+                                   return_exceptions=True)
     sent = 0
-    for uid_str, user_obj in list(users.items()):
-        if not isinstance(user_obj, dict):
-            continue
-        try:
-            if await _maybe_send_digest(bot, user_obj):
-                sent += 1
-        except Exception:
-            continue
+    for (uid_str, user_obj, before), result in zip(checked, results):
+        if result is True:
+            sent += 1
+        if user_obj.get("last_digest_date") != before:
+            storage.mark_user_dirty(uid_str)
     if sent:
         await storage.save()
@@ -443,6 +443,7 @@ async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Reply in the user's language.\n\n--- chat ---\n{formatted}",
             system_prompt="You produce concise group-chat summaries.",
             use_history=False,
+            cache="summary",
         )
         if response.startswith("❌"):
             await msg.edit_text(response, parse_mode="HTML")
@@ -475,6 +476,7 @@ async def translate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Translate the following text to {target_lang}. Output only the translation, nothing else:\n\n{text_to_translate}",
             system_prompt="You are a translator. Output only translated text.",
             use_history=False,
+            cache="translate",
         )
         if response.startswith("❌"):
             await msg.edit_text(response, parse_mode="HTML")
@@ -1,7 +1,8 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 import base64, html, io, aiohttp
-from bot.ai import ai_handler, VISION_PROVIDERS
+from bot.ai import VISION_PROVIDERS
+from bot.http_clients import http_clients
 from bot.storage import storage
 from bot.i18n import t
 from bot.handlers.vip_creator import check_vip
@@ -22,13 +23,11 @@ async def tts_speak(api_key: str, text: str, voice: str = "alloy") -> bytes:
         "input": text[:TTS_MAX_CHARS],
         "response_format": "opus",  # Telegram's native voice format
     }
-    timeout = aiohttp.ClientTimeout(total=60)
-    async with aiohttp.ClientSession(timeout=timeout) as s:
-        async with s.post(url, headers=headers, json=payload) as resp:
-            if resp.status != 200:
-                body = await resp.text()
-                raise RuntimeError(f"TTS HTTP {resp.status}: {body[:300]}")
-            return await resp.read()
+    async with http_clients.request("media", "POST", url, headers=headers, json=payload) as resp:
+        if resp.status != 200:
+            body = await resp.text()
+            raise RuntimeError(f"TTS HTTP {resp.status}: {body[:300]}")
+        return await resp.read()
 
 
 async def voice_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -139,10 +138,8 @@ async def edit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Download the source photo
         photo = photo_msg.photo[-1]
         tg_file = await context.bot.get_file(photo.file_id)
-        timeout = aiohttp.ClientTimeout(total=60)
-        async with aiohttp.ClientSession(timeout=timeout) as s:
-            async with s.get(tg_file.file_path) as r:
-                img_bytes = await r.read()
+        async with http_clients.request("tg-files", "GET", tg_file.file_path) as r:
+            img_bytes = await r.read()
 
         # OpenAI image edit API (gpt-image-1)
         url = "https://api.openai.com/v1/images/edits"
@@ -152,23 +149,21 @@ async def edit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         form.add_field("size", "1024x1024")
         form.add_field("image", img_bytes, filename="src.png", content_type="image/png")
         headers = {"Authorization": f"Bearer {openai_key}"}
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as s:
-            async with s.post(url, headers=headers, data=form) as resp:
-                data = await resp.json()
-                if resp.status != 200 or "data" not in data:
-                    err = data.get("error", {}).get("message") or f"HTTP {resp.status}"
-                    raise RuntimeError(err)
-                b64 = data["data"][0].get("b64_json")
-                if not b64:
-                    # Some responses give url instead
-                    img_url = data["data"][0].get("url")
-                    if not img_url:
-                        raise RuntimeError("no image data returned")
-                    async with aiohttp.ClientSession(timeout=timeout) as s2:
-                        async with s2.get(img_url) as r2:
-                            out_bytes = await r2.read()
-                else:
-                    out_bytes = base64.b64decode(b64)
+        async with http_clients.request("media", "POST", url, headers=headers, data=form) as resp:
+            data = await resp.json()
+            if resp.status != 200 or "data" not in data:
+                err = data.get("error", {}).get("message") or f"HTTP {resp.status}"
+                raise RuntimeError(err)
+        b64 = data["data"][0].get("b64_json")
+        if not b64:
+            # Some responses give url instead
+            img_url = data["data"][0].get("url")
+            if not img_url:
+                raise RuntimeError("no image data returned")
+            async with http_clients.request("media", "GET", img_url) as r2:
+                out_bytes = await r2.read()
+        else:
+            out_bytes = base64.b64decode(b64)
 
         await msg.reply_photo(photo=out_bytes,
                                caption=f"🎨 <i>{html.escape(prompt[:200])}</i>",
@@ -192,13 +187,11 @@ async def _transcribe_voice_openai(api_key: str, ogg_bytes: bytes) -> str:
     form = aiohttp.FormData()
     form.add_field("file", ogg_bytes, filename="voice.ogg", content_type="audio/ogg")
     form.add_field("model", "whisper-1")
-    timeout = aiohttp.ClientTimeout(total=60)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.post(url, headers=headers, data=form) as resp:
-            data = await resp.json()
-            if "error" in data:
-                raise Exception(data["error"].get("message", str(data["error"])))
-            return data.get("text", "").strip()
+    async with http_clients.request("media", "POST", url, headers=headers, data=form) as resp:
+        data = await resp.json()
+        if "error" in data:
+            raise Exception(data["error"].get("message", str(data["error"])))
+        return data.get("text", "").strip()
 
 
 async def voice_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -225,10 +218,8 @@ async def voice_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
     status = await msg.reply_text(t(lang, "voice_transcribing"))
     try:
         tg_file = await context.bot.get_file(voice.file_id)
-        timeout = aiohttp.ClientTimeout(total=30)
-        async with aiohttp.ClientSession(timeout=timeout) as s:
-            async with s.get(tg_file.file_path) as r:
-                raw = await r.read()
+        async with http_clients.request("tg-files", "GET", tg_file.file_path) as r:
+            raw = await r.read()
         text = await _transcribe_voice_openai(api_key, raw)
         if not text:
             await status.edit_text(t(lang, "voice_empty"))
@@ -251,11 +242,9 @@ async def _download_photo_b64(context, file_id: str) -> tuple[str, str]:
     """Download Telegram photo and return (base64, mime)."""
     tg_file = await context.bot.get_file(file_id)
     file_url = tg_file.file_path
-    # 30s timeout: a slow CDN must not be able to hang the handler forever
-    timeout = aiohttp.ClientTimeout(total=30)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.get(file_url) as resp:
-            content = await resp.read()
+    # The tg-files pool caps this at 30s: a slow CDN must not hang the handler forever
+    async with http_clients.request("tg-files", "GET", file_url) as resp:
+        content = await resp.read()
     return base64.b64encode(content).decode("utf-8"), "image/jpeg"
 
 
@@ -285,28 +274,21 @@ async def media_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
             msg = await update.message.reply_text(t(lang, "doc_reading"))
             try:
                 tg_file = await context.bot.get_file(doc.file_id)
-                timeout = aiohttp.ClientTimeout(total=30)
-                async with aiohttp.ClientSession(timeout=timeout) as s:
-                    async with s.get(tg_file.file_path) as r:
-                        raw = await r.read()
+                async with http_clients.request("tg-files", "GET", tg_file.file_path) as r:
+                    raw = await r.read()
                 # Defensive cap if file_size was missing
                 if len(raw) > 200_000:
                     await msg.edit_text(t(lang, "doc_too_big"))
                     return
                 text = raw.decode("utf-8", errors="replace")[:12000]
                 caption = (update.message.caption or t(lang, "doc_default_prompt")).strip()
-                from bot.handlers.ai_memory import _build_system_prompt, _send_long
-                response = await ai_handler.generate_response(
-                    uid,
+                from bot.handlers.ai_memory import _build_system_prompt, _stream_to_message
+                await _stream_to_message(
+                    update, context,
                     f"{caption}\n\n--- File content ---\n{text}",
-                    system_prompt=_build_system_prompt(user),
-                    use_history=False,
+                    _build_system_prompt(user), lang,
+                    use_history=False, cache="document", placeholder=msg,
                 )
-                if response.startswith("❌"):
-                    await msg.edit_text(response, parse_mode="HTML")
-                else:
-                    await msg.delete()
-                    await _send_long(update.message, response)
             except Exception as e:
                 await msg.edit_text(f"❌ {e}")
             return
@@ -326,20 +308,11 @@ async def media_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
             photo = update.message.photo[-1]
             b64, mime = await _download_photo_b64(context, photo.file_id)
             caption = (update.message.caption or t(lang, "vision_default_prompt")).strip()
-            from bot.handlers.ai_memory import _build_system_prompt, _send_long
-            response = await ai_handler.generate_response(
-                uid,
-                caption,
-                system_prompt=_build_system_prompt(user),
-                use_history=False,
-                image_b64=b64,
-                image_mime=mime,
+            from bot.handlers.ai_memory import _build_system_prompt, _stream_to_message
+            await _stream_to_message(
+                update, context, caption, _build_system_prompt(user), lang,
+                use_history=False, image_b64=b64, image_mime=mime, placeholder=msg,
             )
-            if response.startswith("❌"):
-                await msg.edit_text(response, parse_mode="HTML")
-            else:
-                await msg.delete()
-                await _send_long(update.message, response)
         except Exception as e:
             await msg.edit_text(f"❌ {e}")
 
@@ -383,26 +356,25 @@ async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             headers = {"Authorization": f"Bearer {use_key}", "Content-Type": "application/json"}
             payload = {"model": "dall-e-3", "prompt": prompt, "n": 1, "size": "1024x1024"}
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                data = await resp.json()
-                if "error" in data:
-                    err = data["error"]
-                    err_msg = err.get("message", str(err)) if isinstance(err, dict) else str(err)
-                    await msg.edit_text(f"❌ {err_msg}")
-                    return
-                if "data" in data and len(data["data"]) > 0:
-                    image_url = data["data"][0].get("url")
-                    if image_url and image_url.startswith("http"):
-                        await update.message.reply_photo(photo=image_url, caption=f"🎨 {prompt}")
-                        await msg.delete()
-                    elif data["data"][0].get("b64_json"):
-                        img_bytes = base64.b64decode(data["data"][0]["b64_json"])
-                        await update.message.reply_photo(photo=img_bytes, caption=f"🎨 {prompt}")
-                        await msg.delete()
-                    else:
-                        await msg.edit_text("❌ No image URL returned.")
-                else:
-                    await msg.edit_text("❌ No image returned.")
+        async with http_clients.request("media", "POST", url, headers=headers, json=payload) as resp:
+            data = await resp.json()
+        if "error" in data:
+            err = data["error"]
+            err_msg = err.get("message", str(err)) if isinstance(err, dict) else str(err)
+            await msg.edit_text(f"❌ {err_msg}")
+            return
+        if "data" in data and len(data["data"]) > 0:
+            image_url = data["data"][0].get("url")
+            if image_url and image_url.startswith("http"):
+                await update.message.reply_photo(photo=image_url, caption=f"🎨 {prompt}")
+                await msg.delete()
+            elif data["data"][0].get("b64_json"):
+                img_bytes = base64.b64decode(data["data"][0]["b64_json"])
+                await update.message.reply_photo(photo=img_bytes, caption=f"🎨 {prompt}")
+                await msg.delete()
+            else:
+                await msg.edit_text("❌ No image URL returned.")
+        else:
+            await msg.edit_text("❌ No image returned.")
     except Exception as e:
         await msg.edit_text(f"❌ {e}")
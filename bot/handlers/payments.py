@@ -24,11 +24,11 @@ import html
 import json
 import secrets
 import time
-import aiohttp
 from telegram import (
     Update, LabeledPrice, InlineKeyboardButton, InlineKeyboardMarkup,
 )
 from telegram.ext import ContextTypes
+from bot.http_clients import http_clients
 from bot.storage import storage
 from bot.i18n import t
 from bot.config import (
@@ -259,7 +259,7 @@ async def successful_payment_callback(update: Update, context: ContextTypes.DEFA
     info = TIERS[tier_id]
     grant_tier(user, tier_id, days=info["days"])
     await _award_partner_if_first_paid(context, user)
-    await storage.save()
+    await storage.flush()
     await msg.reply_text(
         t(lang, "purchase_success",
           tier=info["label"], days=info["days"], credits=info["image_credits"]),
@@ -304,13 +304,12 @@ async def tier_crypto_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         payload["success_url"] = f"https://t.me/{(await context.bot.get_me()).username}?start=paid_{order_id}"
         payload["cancel_url"] = f"https://t.me/{(await context.bot.get_me()).username}?start=cancel_{order_id}"
     headers = {"x-api-key": NOWPAYMENTS_API_KEY, "Content-Type": "application/json"}
-    timeout = aiohttp.ClientTimeout(total=30)
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as s:
-            async with s.post("https://api.nowpayments.io/v1/invoice", headers=headers, json=payload) as resp:
-                data = await resp.json()
-                if resp.status not in (200, 201):
-                    raise RuntimeError(f"NOWPayments HTTP {resp.status}: {data}")
+        async with http_clients.request("payments", "POST", "https://api.nowpayments.io/v1/invoice",
+                                        headers=headers, json=payload) as resp:
+            data = await resp.json()
+            if resp.status not in (200, 201):
+                raise RuntimeError(f"NOWPayments HTTP {resp.status}: {data}")
         url = data.get("invoice_url")
         if not url:
             raise RuntimeError("NOWPayments returned no invoice_url")
@@ -331,7 +330,7 @@ async def tier_crypto_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     pending = storage.data["pending_crypto"]
     for k in [k for k, v in pending.items() if v.get("ts", 0) < cutoff]:
         pending.pop(k, None)
-    await storage.save()
+    await storage.flush()
 
     text = t(lang, "crypto_invoice_ready",
              tier=info["label"], usd=info["usd"], url=url)
@@ -391,7 +390,7 @@ async def handle_nowpayments_webhook(bot, body: dict):
         def __init__(self, b):
             self.bot = b
     await _award_partner_if_first_paid(_Ctx(bot), user)
-    await storage.save()
+    await storage.flush()
     try:
         lang = user.get("language", "en")
         await bot.send_message(
@@ -419,6 +418,7 @@ async def _award_partner_if_first_paid(context, user: dict):
     if not referrer:
         return
     grant_tier(referrer, "plus", days=PARTNER_REWARD_DAYS)
+    storage.mark_user_dirty(referrer_uid)
     # Notify the referrer
     try:
         ref_lang = referrer.get("language", "en")
@@ -19,9 +19,9 @@ Usage:
 """
 import html
 import re
-import aiohttp
 from telegram import Update
 from telegram.ext import ContextTypes
+from bot.http_clients import http_clients
 from bot.storage import storage
 from bot.i18n import t
 
@@ -104,13 +104,11 @@ async def _piston_run(language: str, version: str, code: str) -> dict:
         "compile_memory_limit": -1,
         "run_memory_limit": -1,
     }
-    timeout = aiohttp.ClientTimeout(total=30)
-    async with aiohttp.ClientSession(timeout=timeout) as s:
-        async with s.post(PISTON_URL, json=payload) as resp:
-            if resp.status != 200:
-                body = await resp.text()
-                raise RuntimeError(f"Piston HTTP {resp.status}: {body[:200]}")
-            return await resp.json()
+    async with http_clients.request("sandbox", "POST", PISTON_URL, json=payload) as resp:
+        if resp.status != 200:
+            body = await resp.text()
+            raise RuntimeError(f"Piston HTTP {resp.status}: {body[:200]}")
+        return await resp.json()
 
 
 async def run_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -12,9 +12,9 @@ the response provided (BYOK — never our key).
 """
 import html
 import urllib.parse
-import aiohttp
 from telegram import Update
 from telegram.ext import ContextTypes
+from bot.http_clients import http_clients
 from bot.storage import storage
 from bot.ai import ai_handler
 from bot.i18n import t
@@ -33,16 +33,13 @@ async def _ddg_instant(query: str) -> dict:
         "skip_disambig": "1",
     }
     url = f"{DDG_API}?{urllib.parse.urlencode(params)}"
-    headers = {"User-Agent": "ai-disco-bot/3.0 (https://t.me/AI_DISCO_BOT)"}
-    timeout = aiohttp.ClientTimeout(total=15)
-    async with aiohttp.ClientSession(headers=headers, timeout=timeout) as s:
-        async with s.get(url) as resp:
-            if resp.status != 200:
-                raise RuntimeError(f"DDG HTTP {resp.status}")
-            # DDG sometimes returns HTML-style content-type — read as text first
-            text = await resp.text()
-            import json as _json
-            return _json.loads(text)
+    async with http_clients.request("search", "GET", url) as resp:
+        if resp.status != 200:
+            raise RuntimeError(f"DDG HTTP {resp.status}")
+        # DDG sometimes returns HTML-style content-type — read as text first
+        text = await resp.text()
+        import json as _json
+        return _json.loads(text)
 
 
 def _format_ddg(result: dict, query: str, lang: str) -> tuple[str, bool]:
@@ -1,8 +1,9 @@
 from telegram import Update
 from telegram.ext import ContextTypes
+from bot.http_clients import http_clients
 from bot.storage import storage
 from bot.i18n import t
-import datetime, pytz, random, string, aiohttp
+import datetime, pytz, random, string
 from urllib.parse import quote
 
 
@@ -40,21 +41,19 @@ async def weather_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(t(lang, "weather_usage"))
         return
     city = " ".join(context.args)
-    headers = {"User-Agent": "ai-disco-bot"}
     try:
-        async with aiohttp.ClientSession(headers=headers, timeout=aiohttp.ClientTimeout(total=15)) as session:
-            url = f"https://wttr.in/{quote(city)}?format=%t|%f|%C|%h|%w&lang={lang}"
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    data = (await resp.text()).strip()
-                    parts = data.split("|")
-                    if len(parts) == 5 and "Unknown" not in data:
-                        temp, feels, desc, hum, wind = parts
-                        await update.message.reply_text(
-                            f"🌍 <b>{city}</b>\n\n🌡 {temp}\n🤔 {feels}\n☁️ {desc}\n💧 {hum}\n💨 {wind}",
-                            parse_mode="HTML",
-                        )
-                        return
+        url = f"https://wttr.in/{quote(city)}?format=%t|%f|%C|%h|%w&lang={lang}"
+        async with http_clients.request("weather", "GET", url) as resp:
+            if resp.status == 200:
+                data = (await resp.text()).strip()
+                parts = data.split("|")
+                if len(parts) == 5 and "Unknown" not in data:
+                    temp, feels, desc, hum, wind = parts
+                    await update.message.reply_text(
+                        f"🌍 <b>{city}</b>\n\n🌡 {temp}\n🤔 {feels}\n☁️ {desc}\n💧 {hum}\n💨 {wind}",
+                        parse_mode="HTML",
+                    )
+                    return
     except Exception:
         pass
     await update.message.reply_text(t(lang, "weather_error"))
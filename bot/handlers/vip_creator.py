@@ -1,9 +1,11 @@
-import asyncio
 import datetime
 import html
-from telegram import Update
+from telegram import ChatMember, Update
 from telegram.ext import ContextTypes
 from bot.storage import storage
+from bot.http_clients import http_clients
+from bot.loopmon import loop_monitor
+from bot.outbox import outbox
 from bot.config import CREATOR_ID, BOT_VERSION
 from bot.i18n import t
 
@@ -62,6 +64,7 @@ async def _ai_parse_reminder(uid: int, raw: str, now_iso: str):
             uid, prompt,
             system_prompt="You output ONLY valid JSON, no markdown fences, no extra text.",
             use_history=False,
+            cache="reminder",
         )
     except Exception as e:
         return None, f"AI error: {e}"
@@ -327,36 +330,59 @@ async def grant_vip_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pass
 
 
+_BROADCAST_USAGE = ("Usage: /broadcast [text]\n"
+                    "/broadcast status|pause|resume|cancel [id] — последняя рассылка, если id не указан")
+
+
 async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != CREATOR_ID:
         await update.message.reply_text("❌")
         return
     if not context.args:
-        await update.message.reply_text("Usage: /broadcast [text]")
+        await update.message.reply_text(_BROADCAST_USAGE)
+        return
+    from bot.broadcast import broadcasts
+    sub = context.args[0].lower()
+    if sub in ("status", "pause", "resume", "cancel") and (
+            len(context.args) == 1 or (len(context.args) == 2 and context.args[1].isdigit())):
+        job_id = context.args[1] if len(context.args) == 2 else broadcasts.latest_id()
+        job = broadcasts.jobs.get(job_id) if job_id else None
+        if job is None:
+            await update.message.reply_text("❌ Рассылка не найдена")
+            return
+        if sub == "status":
+            ok = True
+        elif sub == "resume":
+            ok = broadcasts.resume(context.bot, job_id)
+        else:
+            ok = broadcasts.stop(job_id, "paused" if sub == "pause" else "cancelled")
+        if not ok:
+            await update.message.reply_text(f"❌ Нельзя: рассылка в состоянии {job['state']}")
+            return
+        await update.message.reply_text(broadcasts.render(job), parse_mode="HTML")
         return
     raw = " ".join(context.args)
     # Escape user input so unbalanced <, >, & don't break HTML parsing for every recipient
     safe = html.escape(raw)
     text = f"📢 <b>Объявление:</b>\n\n{safe}"
-    users = list(storage.data["users"].keys())
-    total = len(users)
-    progress = await update.message.reply_text(f"📤 Рассылка для {total} пользователей...")
-    success = 0
-    failed = 0
-    for i, uid in enumerate(users, 1):
-        try:
-            await context.bot.send_message(chat_id=int(uid), text=text, parse_mode="HTML")
-            success += 1
-        except Exception:
-            failed += 1
-        # Telegram limit: ~25 msg/sec → 40ms sleep
-        await asyncio.sleep(0.05)
-        if i % 25 == 0:
-            try:
-                await progress.edit_text(f"📤 {i}/{total}  ✅ {success}  ❌ {failed}")
-            except Exception:
-                pass
-    await progress.edit_text(f"✅ Готово: <b>{success}</b>/{total}  ❌ ошибок: {failed}", parse_mode="HTML")
+    if not any(not u.get("blocked_bot") for u in storage.data["users"].values()):
+        await update.message.reply_text("❌ Некому отправлять")
+        return
+    progress = await update.message.reply_text("📤 Рассылка запускается...")
+    # Sends run in the background (bot/broadcast.py); the progress message is
+    # kept up to date, and the job survives a restart.
+    broadcasts.start(context.bot, text, progress_chat_id=update.effective_chat.id,
+                     progress_message_id=progress.message_id)
+
+
+async def my_chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """The bot's membership in a private chat changed: "kicked" means the user
+    blocked it (broadcasts skip them until they unblock)."""
+    change = update.my_chat_member
+    if change is None or change.chat.type != "private":
+        return
+    from bot.broadcast import mark_blocked
+    mark_blocked(change.chat.id, change.new_chat_member.status == ChatMember.BANNED)
 
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -371,6 +397,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     total_msgs = sum(u.get("stats", {}).get("msgs", 0) for u in users_data.values())
     total_notes = sum(len(u.get("notes", [])) for u in users_data.values())
     total_memory = sum(len(u.get("memory", {})) for u in users_data.values())
+    blocked = sum(1 for u in users_data.values() if u.get("blocked_bot"))
 
     # Provider breakdown
     providers: dict = {}
@@ -380,17 +407,54 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     prov_text = "\n".join(f"  • {p}: {n}" for p, n in sorted(providers.items(), key=lambda x: -x[1])[:6])
 
     active_reminders = len(storage.data.get("reminders", []))
+    lm = loop_monitor.stats()
+    loop_text = (f"⏱ Event loop: p99 <b>{lm['p99_ms']} ms</b>, max <b>{lm['max_ms']} ms</b>, "
+                 f"stalls <b>{lm['stalls']}</b>\n")
+    from bot.ai import ai_handler
+    ai = ai_handler.stats()
+    ai_text = (f"🧩 AI: запросов к провайдерам <b>{ai['flights']}</b>, совмещено дублей <b>{ai['coalesced']}</b>, "
+               f"кэш hit <b>{ai['cache']['hit_ratio']:.0%}</b> ({ai['cache']['size']} ответов), "
+               f"промпт ~<b>{ai['avg_prompt_tokens']}</b> токенов, "
+               f"резерв запущен <b>{ai['hedged']}</b> (выиграл <b>{ai['hedge_wins']}</b>)\n")
+    health = ai["health"]["providers"]
+    if health:
+        ai_text += "🩺 Провайдеры: " + ", ".join(
+            f"{name} {'✅' if h['state'] == 'closed' else '⛔ ' + h['state']} ×{h['limit']:g}"
+            for name, h in health.items()) + f" (ключей в ограничении: {ai['health']['keys_open']})\n"
+    pc = ai["prompt_cache"]
+    if pc["by_provider"]:
+        ai_text += (f"💾 Кэш промптов у провайдеров: <b>{pc['cached_ratio']:.0%}</b> токенов из кэша ("
+                    + ", ".join(f"{name} {p['cached_tokens']}/{p['prompt_tokens']}" for name, p in pc["by_provider"].items())
+                    + f"), Gemini-контекстов <b>{pc['gemini_contexts']['live']}</b>\n")
+    from bot.edits import stream_edits
+    se = stream_edits.stats()
+    ai_text += (f"✏️ Стриминг: сейчас <b>{se['live']}</b>, правка раз в <b>{se['interval_s']:g} с</b>, "
+                f"правок <b>{se['edits']}</b> (схлопнуто {se['superseded']}), RetryAfter <b>{se['retry_after']}</b>\n")
+    ob = outbox.stats()
+    ai_text += (f"📬 Очередь отправки: ждут <b>{sum(ob['queued'].values())}</b>, "
+                f"отправлено <b>{sum(ob['sent'].values())}</b>, ошибок <b>{sum(ob['failed'].values())}</b>, "
+                f"повторов {ob['retries']} (RetryAfter {ob['retry_after']}, общих пауз {ob['paused']})\n")
+    pools = http_clients.stats().values()
+    http_text = (f"🌐 HTTP: запросов <b>{sum(p['requests'] for p in pools)}</b>, "
+                 f"новых соединений <b>{sum(p['handshakes'] for p in pools)}</b>, "
+                 f"ожидание пула max <b>{max((p['max_wait_ms'] for p in pools), default=0)} ms</b>\n")
+    pager_text = ""
+    if storage.pager is not None:
+        ps = storage.pager.stats()
+        pager_text = (f"🗄 Pager: в памяти <b>{ps['resident']}</b>, на диске <b>{ps['paged']}</b>, "
+                      f"hit <b>{ps['hit_ratio']:.0%}</b> ({ps['misses']} miss)\n")
 
     text = (
         f"📈 <b>Статистика AI DISCO BOT v{BOT_VERSION}</b>\n\n"
-        f"👥 Пользователей: <b>{users_count}</b>\n"
+        f"👥 Пользователей: <b>{users_count}</b> (заблокировали бота: {blocked})\n"
         f"💎 VIP: <b>{vips}</b>\n"
         f"💬 Групп: <b>{groups_count}</b>\n"
         f"⚡ Команд: <b>{total_cmds}</b>\n"
         f"📨 Сообщений: <b>{total_msgs}</b>\n"
         f"📝 Заметок: <b>{total_notes}</b>\n"
         f"🧠 Memory entries: <b>{total_memory}</b>\n"
-        f"⏰ Активных напоминаний: <b>{active_reminders}</b>\n\n"
+        f"⏰ Активных напоминаний: <b>{active_reminders}</b>\n"
+        f"{pager_text}{loop_text}{http_text}{ai_text}\n"
         f"<b>Топ провайдеров:</b>\n{prov_text}\n\n"
         f"📋 Список: /users"
     )
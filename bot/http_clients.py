@@ -0,0 +1,262 @@
+"""Process-wide outbound HTTP clients.
+
+Every integration (AI providers, GitHub storage, search, weather, the code
+sandbox, Telegram file downloads, on-chain payment checks) gets a named,
+long-lived pool instead of a throwaway ClientSession per call, so repeat calls
+skip DNS + TCP + TLS. Each pool has its own timeouts, connection caps and
+retry policy (POOLS below), and counts what it does:
+
+  * in_flight / peak   — requests waiting for response headers right now
+  * queued / wait_ms   — requests that had to wait for a free pooled connection
+  * handshakes         — new connections opened (DNS + TCP + TLS), vs. reused
+
+Usage:
+
+    async with http_clients.request("search", "GET", url) as resp: ...   # with retries
+    session = http_clients.session("ai:openai")                          # raw pooled session
+
+Pool names may carry a ":suffix" ("ai:openai", "ai:gemini") — the suffix gets
+its own connector (own per-host cap, own metrics) with the base name's policy.
+"""
+import asyncio
+import contextlib
+import logging
+import random
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, FrozenSet, Optional, Tuple
+
+import aiohttp
+
+from bot.config import HTTP_DNS_TTL_S, HTTP_KEEPALIVE_S
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "ai-disco-bot/3.0 (https://t.me/AI_DISCO_BOT)"
+# The request was refused before being processed — safe to resend any method
+_REFUSED = frozenset((429,))
+_IDEMPOTENT = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+
+@dataclass(frozen=True)
+class PoolSpec:
+    timeout: aiohttp.ClientTimeout
+    limit_per_host: int = 8
+    # Retries on top of the first attempt, for connection failures (any method
+    # if the connection never opened, idempotent methods otherwise) and for
+    # retry_statuses (429 for any method, the rest for idempotent ones).
+    retries: int = 0
+    backoff_s: float = 0.5
+    backoff_max_s: float = 8.0
+    retry_statuses: FrozenSet[int] = frozenset((429, 502, 503, 504))
+    headers: Tuple[Tuple[str, str], ...] = ()
+
+
+POOLS: Dict[str, PoolSpec] = {
+    # AI chat/stream calls: never resent automatically (tokens cost money);
+    # the per-provider suffix keeps one provider from starving another.
+    "ai":       PoolSpec(aiohttp.ClientTimeout(total=60, sock_connect=10), limit_per_host=32),
+    # GitHub storage: loads can be large (no total cap, but a stalled read
+    # aborts); storage.py has its own conflict-aware retry loop for writes.
+    "github":   PoolSpec(aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30),
+                         limit_per_host=16, retries=2),
+    "search":   PoolSpec(aiohttp.ClientTimeout(total=15), retries=1,
+                         headers=(("User-Agent", USER_AGENT),)),
+    "weather":  PoolSpec(aiohttp.ClientTimeout(total=15), retries=1,
+                         headers=(("User-Agent", "ai-disco-bot"),)),
+    # Piston's public instance rate-limits hard; 429s are worth waiting out.
+    "sandbox":  PoolSpec(aiohttp.ClientTimeout(total=30), limit_per_host=4, retries=2, backoff_s=1.0),
+    # OpenAI media endpoints (TTS, Whisper, image gen/edit): slow, multipart bodies
+    "media":    PoolSpec(aiohttp.ClientTimeout(total=120), limit_per_host=8),
+    # Telegram file CDN: a slow download must not hang a handler
+    "tg-files": PoolSpec(aiohttp.ClientTimeout(total=30), limit_per_host=16, retries=1),
+    # TronGrid / public ETH RPCs (keyless, rate-limited)
+    "chain":    PoolSpec(aiohttp.ClientTimeout(total=25), limit_per_host=4, retries=2, backoff_s=1.5),
+    "payments": PoolSpec(aiohttp.ClientTimeout(total=30), limit_per_host=4),
+}
+
+
+@dataclass
+class PoolStats:
+    requests: int = 0
+    errors: int = 0
+    retries: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    queued: int = 0          # requests that waited for a free connection
+    wait_ms: float = 0.0     # total time spent waiting
+    max_wait_ms: float = 0.0
+    handshakes: int = 0      # new connections (DNS + TCP + TLS)
+    handshake_ms: float = 0.0
+    reused: int = 0          # requests served on a kept-alive connection
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "queued": self.queued,
+            "wait_ms": round(self.wait_ms),
+            "max_wait_ms": round(self.max_wait_ms, 1),
+            "handshakes": self.handshakes,
+            "handshake_ms": round(self.handshake_ms),
+            "reused": self.reused,
+        }
+
+
+def _trace_config(stats: PoolStats) -> aiohttp.TraceConfig:
+    """aiohttp tracing hooks that feed `stats`."""
+    loop_time = asyncio.get_running_loop().time
+    trace = aiohttp.TraceConfig()
+
+    async def request_start(session, ctx, params):
+        stats.requests += 1
+        stats.in_flight += 1
+        if stats.in_flight > stats.peak_in_flight:
+            stats.peak_in_flight = stats.in_flight
+
+    async def request_end(session, ctx, params):
+        stats.in_flight -= 1
+
+    async def request_exception(session, ctx, params):
+        stats.in_flight -= 1
+        stats.errors += 1
+
+    async def queued_start(session, ctx, params):
+        ctx.queued_at = loop_time()
+
+    async def queued_end(session, ctx, params):
+        waited = (loop_time() - ctx.queued_at) * 1000
+        stats.queued += 1
+        stats.wait_ms += waited
+        if waited > stats.max_wait_ms:
+            stats.max_wait_ms = waited
+
+    async def create_start(session, ctx, params):
+        ctx.connect_at = loop_time()
+
+    async def create_end(session, ctx, params):
+        stats.handshakes += 1
+        stats.handshake_ms += (loop_time() - ctx.connect_at) * 1000
+
+    async def reuse(session, ctx, params):
+        stats.reused += 1
+
+    trace.on_request_start.append(request_start)
+    trace.on_request_end.append(request_end)
+    trace.on_request_exception.append(request_exception)
+    trace.on_connection_queued_start.append(queued_start)
+    trace.on_connection_queued_end.append(queued_end)
+    trace.on_connection_create_start.append(create_start)
+    trace.on_connection_create_end.append(create_end)
+    trace.on_connection_reuseconn.append(reuse)
+    return trace
+
+
+@dataclass
+class _Pool:
+    spec: PoolSpec
+    stats: PoolStats = field(default_factory=PoolStats)
+    session: Optional[aiohttp.ClientSession] = None
+    loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class HttpClients:
+    def __init__(self, specs: Dict[str, PoolSpec] = POOLS):
+        self.specs = specs
+        self._pools: Dict[str, _Pool] = {}
+
+    def _pool(self, name: str) -> _Pool:
+        pool = self._pools.get(name)
+        if pool is None:
+            spec = self.specs.get(name) or self.specs.get(name.split(":", 1)[0])
+            if spec is None:
+                raise KeyError(f"unknown HTTP pool {name!r}")
+            pool = self._pools[name] = _Pool(spec)
+        return pool
+
+    def session(self, name: str) -> aiohttp.ClientSession:
+        """Pooled session for `name`, created on first use (needs a running loop)."""
+        pool = self._pool(name)
+        loop = asyncio.get_running_loop()
+        if pool.session is None or pool.session.closed or pool.loop is not loop:
+            # A session is bound to the loop it was made on; tools that call
+            # asyncio.run() more than once get a fresh one per loop.
+            connector = aiohttp.TCPConnector(
+                limit=0,
+                limit_per_host=pool.spec.limit_per_host,
+                ttl_dns_cache=HTTP_DNS_TTL_S,
+                keepalive_timeout=HTTP_KEEPALIVE_S,
+            )
+            pool.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=pool.spec.timeout,
+                headers=dict(pool.spec.headers),
+                trace_configs=[_trace_config(pool.stats)],
+            )
+            pool.loop = loop
+        return pool.session
+
+    def _delay(self, spec: PoolSpec, attempt: int, resp: Optional[aiohttp.ClientResponse] = None) -> float:
+        if resp is not None:
+            try:
+                # Retry-After in seconds (the HTTP-date form is rare for APIs)
+                return min(float(resp.headers.get("Retry-After", "")), spec.backoff_max_s)
+            except ValueError:
+                pass
+        delay = min(spec.backoff_s * (2 ** attempt), spec.backoff_max_s)
+        return delay * random.uniform(0.5, 1.0)
+
+    @contextlib.asynccontextmanager
+    async def request(self, name: str, method: str, url: str, *,
+                      retries: Optional[int] = None, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """`session.request()` on pool `name` with its retry/backoff policy.
+        Only failures before the response is handed over are retried; the
+        last response (whatever its status) or exception goes to the caller."""
+        pool = self._pool(name)
+        spec = pool.spec
+        method = method.upper()
+        idempotent = method in _IDEMPOTENT
+        attempts = 1 + max(spec.retries if retries is None else retries, 0)
+        for attempt in range(attempts):
+            last = attempt + 1 >= attempts
+            try:
+                resp = await self.session(name).request(method, url, **kwargs)
+            except (aiohttp.ClientConnectorError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # Connector errors mean nothing was sent; anything later may have been.
+                if last or not (idempotent or isinstance(e, aiohttp.ClientConnectorError)):
+                    raise
+                pool.stats.retries += 1
+                logger.warning(f"HTTP {name} {method} failed ({e}); retry {attempt + 1}/{attempts - 1}")
+                await asyncio.sleep(self._delay(spec, attempt))
+                continue
+            retryable = resp.status in spec.retry_statuses and (idempotent or resp.status in _REFUSED)
+            if retryable and not last:
+                delay = self._delay(spec, attempt, resp)
+                resp.release()
+                pool.stats.retries += 1
+                logger.warning(f"HTTP {name} {method} → {resp.status}; retry {attempt + 1}/{attempts - 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            try:
+                yield resp
+            finally:
+                resp.release()
+            return
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.stats.as_dict() for name, pool in sorted(self._pools.items())}
+
+    async def close(self):
+        """Close every pool (application shutdown)."""
+        loop = asyncio.get_running_loop()
+        for pool in self._pools.values():
+            session, owner = pool.session, pool.loop
+            pool.session = pool.loop = None
+            # Sessions left behind by an earlier (now closed) loop can't be closed from here
+            if session is not None and not session.closed and owner is loop:
+                await session.close()
+
+
+http_clients = HttpClients()
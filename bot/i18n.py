@@ -67,6 +67,14 @@ translations = {
         "provider_set": "✅ Провайдер: <b>{provider}</b>\nУстановите ключ: <code>/setkey {provider} [ключ]</code>",
         "provider_unknown": "❌ Неизвестный провайдер.\nДоступные: {list}",
         "provider_usage": "Использование: /setprovider [провайдер]\nДоступные: {list}",
+        "failover_info": ("🔀 <b>Резервные провайдеры</b>: {chain}\n\n"
+                          "Если основной провайдер не начал отвечать за {ms} мс или выдал ошибку, "
+                          "запрос уходит и следующему — побеждает первый ответ.\n"
+                          "Включить: <code>/failover groq openai</code> (нужны ключи через /setkey)\n"
+                          "Выключить: <code>/failover off</code>"),
+        "failover_off": "🔀 Резервные провайдеры выключены.",
+        "failover_set": "✅ Порядок: <b>{chain}</b>",
+        "failover_no_key": "⚠️ Нет ключа для: {list} — они будут пропущены, пока не добавите /setkey.",
         "key_saved": "✅ Ключ для <b>{provider}</b> сохранён!",
         "key_usage": "Использование: /setkey [провайдер] [ключ]",
         "key_group_refuse": "🚫 <b>Никогда не вводите API-ключи в группах!</b>\nОтправьте /setkey мне в <b>личные сообщения</b>.",
@@ -514,6 +522,14 @@ translations = {
         "provider_set": "✅ Provider: <b>{provider}</b>\nSet key: <code>/setkey {provider} [key]</code>",
         "provider_unknown": "❌ Unknown provider.\nAvailable: {list}",
         "provider_usage": "Usage: /setprovider [provider]\nAvailable: {list}",
+        "failover_info": ("🔀 <b>Backup providers</b>: {chain}\n\n"
+                          "If your provider hasn't started answering within {ms} ms or fails, "
+                          "the request also goes to the next one — the first answer wins.\n"
+                          "Turn on: <code>/failover groq openai</code> (keys via /setkey)\n"
+                          "Turn off: <code>/failover off</code>"),
+        "failover_off": "🔀 Backup providers turned off.",
+        "failover_set": "✅ Order: <b>{chain}</b>",
+        "failover_no_key": "⚠️ No key for: {list} — skipped until you add one with /setkey.",
         "key_saved": "✅ Key for <b>{provider}</b> saved!", "key_usage": "Usage: /setkey [provider] [key]",
         "key_group_refuse": "🚫 <b>Never paste API keys in groups!</b>\nSend /setkey to me in a <b>private chat</b>.",
         "key_group_dm_hint": "👋 Send keys here. Format: <code>/setkey gemini YOUR_KEY</code>",
@@ -946,6 +962,14 @@ translations = {
         "provider_set": "✅ Provider: <b>{provider}</b>\nImposta chiave: <code>/setkey {provider} [chiave]</code>",
         "provider_unknown": "❌ Provider sconosciuto.\nDisponibili: {list}",
         "provider_usage": "Uso: /setprovider [provider]\nDisponibili: {list}",
+        "failover_info": ("🔀 <b>Provider di riserva</b>: {chain}\n\n"
+                          "Se il tuo provider non inizia a rispondere entro {ms} ms o dà errore, "
+                          "la richiesta va anche al successivo — vince la prima risposta.\n"
+                          "Attiva: <code>/failover groq openai</code> (chiavi con /setkey)\n"
+                          "Disattiva: <code>/failover off</code>"),
+        "failover_off": "🔀 Provider di riserva disattivati.",
+        "failover_set": "✅ Ordine: <b>{chain}</b>",
+        "failover_no_key": "⚠️ Nessuna chiave per: {list} — saltati finché non la aggiungi con /setkey.",
         "key_saved": "✅ Chiave per <b>{provider}</b> salvata!", "key_usage": "Uso: /setkey [provider] [chiave]",
         "key_group_refuse": "🚫 <b>Mai inserire chiavi API nei gruppi!</b>\nInvia /setkey in <b>chat privata</b>.",
         "key_group_dm_hint": "👋 Invia le chiavi qui. Formato: <code>/setkey gemini TUA_CHIAVE</code>",
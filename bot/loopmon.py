@@ -0,0 +1,83 @@
+"""Event-loop stall monitor.
+
+Everything in the bot (Telegram polling, stream edits, the aiohttp server)
+shares one asyncio loop, so any synchronous chunk of work — a big json.dumps,
+base64 over megabytes, a slow regex — delays all of it. The monitor runs a
+probe task that asks to wake every `interval` seconds and records how late it
+actually woke: that lateness is how long the loop was blocked.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Dict, Optional
+
+from bot.config import LOOP_MONITOR_INTERVAL_MS, LOOP_STALL_WARN_MS
+
+logger = logging.getLogger(__name__)
+
+# Lag samples kept for percentiles (~1 min at the default 50 ms interval)
+_WINDOW = 1200
+
+
+class LoopMonitor:
+    def __init__(self, interval_ms: int = LOOP_MONITOR_INTERVAL_MS,
+                 warn_ms: int = LOOP_STALL_WARN_MS):
+        self.interval = max(interval_ms, 5) / 1000
+        self.warn_ms = warn_ms
+        self.samples: deque = deque(maxlen=_WINDOW)
+        self.max_ms = 0.0
+        self.stalls = 0          # lags above warn_ms since start
+        self.stalled_ms = 0.0    # total time lost to those
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def reset(self):
+        self.samples.clear()
+        self.max_ms = 0.0
+        self.stalls = 0
+        self.stalled_ms = 0.0
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag_ms = max((loop.time() - start - self.interval) * 1000, 0.0)
+            self.samples.append(lag_ms)
+            if lag_ms > self.max_ms:
+                self.max_ms = lag_ms
+            if lag_ms >= self.warn_ms:
+                self.stalls += 1
+                self.stalled_ms += lag_ms
+                logger.warning(f"Event loop stalled for {lag_ms:.0f} ms")
+
+    def stats(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+
+        def pct(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)], 1)
+
+        return {
+            "p50_ms": pct(0.50),
+            "p99_ms": pct(0.99),
+            "max_ms": round(self.max_ms, 1),
+            "stalls": self.stalls,
+            "stalled_ms": round(self.stalled_ms),
+        }
+
+
+loop_monitor = LoopMonitor()
@@ -0,0 +1,204 @@
+"""Outbound delivery queue for messages the bot sends on its own.
+
+Reminders, the morning digest and /broadcast used to call send_message one
+after another with a fixed sleep (or none) and gave up on the first
+RetryAfter. They now hand their sends to `outbox`, which delivers them as
+fast as Telegram allows (bot/flood.py: the bot-wide telegram_bucket plus
+per-chat spacing) and in priority order:
+
+    INTERACTIVE  a user is waiting for it (e.g. a long answer's next message)
+    REMINDER     due reminders
+    DIGEST       the morning digest
+    BROADCAST    creator announcements
+
+A lower class only goes when no higher one is ready, and bulk classes leave
+a few tokens of the global bucket unused so a stream edit or an interactive
+reply never waits behind a 10k-user broadcast. RetryAfter holds the chat (and
+pauses everything if it hit a chat that wasn't over its own limit — then the
+bot as a whole is), network errors back off; both are retried up to
+MAX_ATTEMPTS. Anything else (blocked by the user, chat not found) fails at
+once and is raised to the caller.
+
+    await outbox.send_message(bot, chat_id, text, priority=REMINDER, parse_mode="HTML")
+    msg = await outbox.send(chat_id, lambda: message.reply_text(text))
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from bot.flood import ChatPacer, TokenBucket, chat_interval, chat_pacer, retry_after_s, telegram_bucket
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, REMINDER, DIGEST, BROADCAST = range(4)
+CLASS_NAMES = ("interactive", "reminder", "digest", "broadcast")
+# Global-bucket tokens each class must leave for the ones above it
+RESERVE = (0, 1, 2, 2)
+# Sends in flight at once (they mostly wait on Telegram's response)
+MAX_IN_FLIGHT = 64
+MAX_ATTEMPTS = 5
+BACKOFF_MAX_S = 30
+# Queued sends looked at per class and pass — past that they're all waiting on busy chats
+SCAN_DEPTH = 200
+
+
+class _Delivery:
+    __slots__ = ("chat_id", "call", "priority", "future", "attempts", "not_before")
+
+    def __init__(self, chat_id: int, call: Callable[[], Awaitable[Any]], priority: int, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.not_before = 0.0   # network-error backoff
+
+
+class Outbox:
+    def __init__(self, bucket: TokenBucket = telegram_bucket, pacer: ChatPacer = chat_pacer,
+                 max_in_flight: int = MAX_IN_FLIGHT):
+        self.bucket = bucket
+        self.pacer = pacer
+        self.max_in_flight = max_in_flight
+        self._queues: List[Deque[_Delivery]] = [deque() for _ in CLASS_NAMES]
+        self._in_flight = 0
+        self._last_sent: Dict[int, float] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = [0] * len(CLASS_NAMES)
+        self.failed = [0] * len(CLASS_NAMES)
+        self.retries = 0
+        self.retry_after = 0
+        self.paused = 0     # RetryAfter taken as bot-wide
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable[Any]], *, priority: int = INTERACTIVE) -> asyncio.Future:
+        """Queue `call()` (a Bot API coroutine factory, called once per attempt);
+        the future gets its result or final exception."""
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].append(_Delivery(chat_id, call, priority, future))
+        self._kick()
+        return future
+
+    async def send(self, chat_id: int, call: Callable[[], Awaitable[Any]], *, priority: int = INTERACTIVE) -> Any:
+        return await self.submit(chat_id, call, priority=priority)
+
+    async def send_message(self, bot, chat_id: int, text: str, *, priority: int = INTERACTIVE, **kwargs) -> Any:
+        return await self.send(chat_id, lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs),
+                               priority=priority)
+
+    # ---- worker ----
+
+    def _kick(self):
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        self._wake.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while any(self._queues):
+            self._wake.clear()
+            wait = self._dispatch()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self) -> Optional[float]:
+        """Start what may go now, best class first; seconds until more could."""
+        now = time.monotonic()
+        soonest: Optional[float] = None
+
+        def later(seconds: float):
+            nonlocal soonest
+            soonest = seconds if soonest is None else min(soonest, seconds)
+
+        for priority, queue in enumerate(self._queues):
+            skipped: List[_Delivery] = []
+            looked = 0
+            while queue and looked < SCAN_DEPTH:
+                if self._in_flight >= self.max_in_flight:
+                    queue.extendleft(reversed(skipped))
+                    return soonest  # a finishing send wakes us
+                item = queue.popleft()
+                looked += 1
+                ready = max(item.not_before, self.pacer.ready_at(item.chat_id, paced=priority != INTERACTIVE))
+                if ready > now:
+                    later(ready - now)
+                    skipped.append(item)
+                    continue
+                wait = self.bucket.delay(RESERVE[priority])
+                if wait > 0:
+                    later(wait)
+                    skipped.append(item)
+                    queue.extendleft(reversed(skipped))
+                    return soonest  # lower classes need at least as many tokens
+                self.bucket.take()
+                self.pacer.spent(item.chat_id, now)
+                self._in_flight += 1
+                asyncio.create_task(self._deliver(item))
+            queue.extendleft(reversed(skipped))
+            if queue and looked >= SCAN_DEPTH:
+                later(0.05)
+        return soonest
+
+    async def _deliver(self, item: _Delivery):
+        retry_in = None
+        try:
+            result = await item.call()
+        except RetryAfter as e:
+            seconds = retry_after_s(e)
+            self.retry_after += 1
+            self.pacer.hold(item.chat_id, seconds)
+            last = self._last_sent.get(item.chat_id, 0.0)
+            if time.monotonic() - last >= chat_interval(item.chat_id) * 2:
+                # This chat wasn't being pushed — the bot as a whole is over the limit
+                self.bucket.pause(seconds)
+                self.paused += 1
+            logger.warning(f"Outbox ({CLASS_NAMES[item.priority]}) chat {item.chat_id}: RetryAfter {seconds:g}s")
+            retry_in, error = 0.0, e
+        except BadRequest as e:  # a NetworkError subclass, but resending won't help
+            error = e
+        except NetworkError as e:  # incl. TimedOut
+            retry_in, error = min(2 ** item.attempts, BACKOFF_MAX_S), e
+        except Exception as e:  # Forbidden (blocked by the user), ChatMigrated, ...
+            error = e
+        else:
+            self.sent[item.priority] += 1
+            if not item.future.done():
+                item.future.set_result(result)
+            return
+        finally:
+            self._in_flight -= 1
+            self._last_sent[item.chat_id] = time.monotonic()
+            if len(self._last_sent) > 5000:
+                self._last_sent.clear()
+            self._kick()
+        item.attempts += 1
+        if retry_in is not None and item.attempts < MAX_ATTEMPTS:
+            self.retries += 1
+            item.not_before = time.monotonic() + retry_in
+            self._queues[item.priority].appendleft(item)  # keep its place (and the chat's order)
+            self._kick()
+            return
+        self.failed[item.priority] += 1
+        if not item.future.done():
+            item.future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": {name: len(q) for name, q in zip(CLASS_NAMES, self._queues)},
+            "in_flight": self._in_flight,
+            "sent": dict(zip(CLASS_NAMES, self.sent)),
+            "failed": dict(zip(CLASS_NAMES, self.failed)),
+            "retries": self.retries,
+            "retry_after": self.retry_after,
+            "paused": self.paused,
+        }
+
+
+outbox = Outbox()
@@ -0,0 +1,169 @@
+"""Compact in-memory user/group records.
+
+A plain dict per user costs a full hash table (~1–2 KB once a user has 25+
+keys) and, when records are parsed one by one (shards, SQLite rows, journal),
+a private copy of every key string. UserRecord/GroupRecord keep the hot
+scalar fields in __slots__ and everything else (nested containers, rare keys)
+in a small overflow dict with interned keys. Short string values that repeat
+across users ("free", "UTC", "08:00", "en", "gemini") are interned too.
+
+Both classes implement the MutableMapping API, so handlers keep using
+user.get(...), user["x"] = ..., setdefault, pop, `in`. They are NOT dict
+subclasses: use collections.abc.Mapping for isinstance checks, and
+records.json_default when serializing (storage does this).
+
+A UserRecord can also be "paged": storage's cold-user pager moves its heavy
+containers (_paged_fields) to disk and sets _paged. Touching one of those keys
+(or iterating the record) pages them back in; to_dict() reads them from disk
+without bringing them back into memory.
+"""
+import sys
+from collections.abc import MutableMapping
+from typing import Any, Iterator
+
+_MISSING = object()
+# Interning long free-form values (names, prompts) buys nothing
+_INTERN_MAX_LEN = 32
+
+
+def _intern_value(value):
+    if type(value) is str and len(value) <= _INTERN_MAX_LEN:
+        return sys.intern(value)
+    return value
+
+
+class CompactRecord(MutableMapping):
+    __slots__ = ("_extra", "_paged")
+    # Subclasses list their hot scalar keys here AND in __slots__.
+    _fields: tuple = ()
+    _field_set: frozenset = frozenset()
+    # Overflow keys the storage pager may move to disk
+    _paged_fields: frozenset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls._fields)
+
+    def __init__(self, data=None):
+        self._extra = {}
+        self._paged = None
+        if data:
+            fields = self._field_set
+            extra = self._extra
+            for key, value in data.items():
+                if key in fields:
+                    setattr(self, key, _intern_value(value))
+                else:
+                    extra[sys.intern(key) if type(key) is str else key] = value
+
+    # ---- Mapping API ----
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            value = getattr(self, key, _MISSING)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        if self._paged is not None and key in self._paged_fields:
+            self._paged.pager.page_in(self)
+        return self._extra[key]
+
+    def get(self, key, default=None):
+        if key in self._field_set:
+            return getattr(self, key, default)
+        if self._paged is not None and key in self._paged_fields:
+            self._paged.pager.page_in(self)
+        return self._extra.get(key, default)
+
+    def __setitem__(self, key, value):
+        if key in self._field_set:
+            setattr(self, key, _intern_value(value))
+        else:
+            if self._paged is not None:
+                self._paged.pager.page_in(self)
+            self._extra[sys.intern(key) if type(key) is str else key] = value
+
+    def __delitem__(self, key):
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        else:
+            if self._paged is not None:
+                self._paged.pager.page_in(self)
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key in self._field_set:
+            return hasattr(self, key)
+        if self._paged is not None and key in self._paged_fields:
+            self._paged.pager.page_in(self)
+        return key in self._extra
+
+    def setdefault(self, key, default=None):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self[key] = value = default
+        return value
+
+    def __iter__(self) -> Iterator:
+        for key in self._fields:
+            if hasattr(self, key):
+                yield key
+        if self._paged is not None:
+            self._paged.pager.page_in(self)
+        yield from self._extra
+
+    def __len__(self) -> int:
+        if self._paged is not None:
+            self._paged.pager.page_in(self)
+        return sum(1 for key in self._fields if hasattr(self, key)) + len(self._extra)
+
+    def to_dict(self) -> dict:
+        out = {key: getattr(self, key) for key in self._fields if hasattr(self, key)}
+        out.update(self._paged.pager.peek(self) if self._paged is not None else self._extra)
+        return out
+
+    def has_paged_data(self) -> bool:
+        """True if paging this record out would actually free something."""
+        extra = self._extra
+        return any(extra.get(key) for key in self._paged_fields)
+
+    def copy(self) -> dict:
+        return self.to_dict()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class UserRecord(CompactRecord):
+    _fields = (
+        "id", "language", "username", "first_name", "ai_provider", "ai_model",
+        "vip", "vip_expires", "tier", "tier_expires", "image_credits", "image_credits_reset",
+        "referrals", "referred_by", "first_paid", "last_seen_level",
+        "digest_enabled", "digest_time", "timezone", "last_digest_date",
+        "daily_streak", "daily_last", "state", "persona", "disco_mode",
+        "voice_reply", "voice_name", "memory_last_suggested_at_pairs",
+    )
+    __slots__ = _fields
+    _paged_fields = frozenset(("chat_history", "history_summary", "memory", "notes", "active_quizzes",
+                               "last_ai_turn"))
+
+
+class GroupRecord(CompactRecord):
+    _fields = (
+        "id", "vip", "welcome_enabled", "welcome_msg", "goodbye_enabled", "goodbye_msg",
+        "rules", "ai_enabled", "antilink", "antispam", "guardian",
+    )
+    __slots__ = _fields
+
+
+RECORD_TYPES = {"users": UserRecord, "groups": GroupRecord}
+
+
+def json_default(obj: Any):
+    """`default=` hook for json.dumps so compact records serialize like dicts."""
+    if isinstance(obj, CompactRecord):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
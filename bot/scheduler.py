@@ -1,7 +1,9 @@
+import asyncio
 import html
 import logging
 import time
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from bot.outbox import REMINDER, outbox
 from bot.storage import storage
 
 logger = logging.getLogger(__name__)
@@ -11,26 +13,22 @@ async def _check_reminders_task(bot):
     try:
         now = time.time()
         reminders = storage.data.get("reminders", [])
-        to_remove = []
+        to_remove = [r for r in reminders if r["time"] <= now]
+        sends = []
 
-        for r in reminders:
-            if r["time"] <= now:
-                try:
-                    overdue_min = int((now - r["time"]) / 60)
-                    prefix = "⏰ <b>НАПОМИНАНИЕ:</b>"
-                    if overdue_min > 5:
-                        prefix = f"⏰ <b>НАПОМИНАНИЕ</b> (опоздало на {overdue_min} мин):"
-                    # Escape so a reminder body with < or & doesn't fail delivery
-                    body = html.escape(r.get("text", ""))
-                    await bot.send_message(
-                        chat_id=r["chat_id"],
-                        text=f"{prefix}\n\n{body}",
-                        parse_mode="HTML",
-                    )
-                    to_remove.append(r)
-                except Exception as e:
-                    logger.error(f"Failed to send reminder: {e}")
-                    to_remove.append(r)
+        for r in to_remove:
+            overdue_min = int((now - r["time"]) / 60)
+            prefix = "⏰ <b>НАПОМИНАНИЕ:</b>"
+            if overdue_min > 5:
+                prefix = f"⏰ <b>НАПОМИНАНИЕ</b> (опоздало на {overdue_min} мин):"
+            # Escape so a reminder body with < or & doesn't fail delivery
+            body = html.escape(r.get("text", ""))
+            # All due reminders go out together, as fast as the outbox allows
+            sends.append(outbox.send_message(bot, r["chat_id"], f"{prefix}\n\n{body}",
+                                             priority=REMINDER, parse_mode="HTML"))
+        for result in await asyncio.gather(*sends, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to send reminder: {result}")
 
         if to_remove:
             for r in to_remove:
@@ -2,7 +2,7 @@
 
 Public endpoints:
   GET    /                       — health
-  GET    /healthz                — JSON health
+  GET    /healthz                — JSON health (+ event-loop, HTTP, provider, stream-edit, outbox, broadcast stats)
   POST   /webhook/nowpayments    — NOWPayments IPN (HMAC-verified)
   GET    /webapp                 — Telegram Mini App shell HTML
 
@@ -29,7 +29,6 @@ import secrets
 import time
 import urllib.parse
 
-import aiohttp
 from aiohttp import web
 
 from bot.config import (
@@ -40,6 +39,8 @@ from bot.config import (
     BOT_VERSION,
     TIERS,
 )
+from bot.http_clients import http_clients
+from bot.loopmon import loop_monitor
 
 logger = logging.getLogger(__name__)
 
@@ -53,7 +54,14 @@ async def _root(request: web.Request) -> web.Response:
 
 
 async def _healthz(request: web.Request) -> web.Response:
-    return web.json_response({"status": "ok", "version": BOT_VERSION})
+    from bot.ai import ai_handler
+    from bot.edits import stream_edits
+    from bot.outbox import outbox
+    from bot.broadcast import broadcasts
+    return web.json_response({"status": "ok", "version": BOT_VERSION, "loop": loop_monitor.stats(),
+                              "http": http_clients.stats(), "providers": ai_handler.health.stats(),
+                              "stream_edits": stream_edits.stats(), "outbox": outbox.stats(),
+                              "broadcasts": broadcasts.stats()})
 
 
 async def _nowpayments_webhook(request: web.Request) -> web.Response:
@@ -350,15 +358,14 @@ async def _api_topup_crypto(request: web.Request) -> web.Response:
 
     headers = {"x-api-key": NOWPAYMENTS_API_KEY, "Content-Type": "application/json"}
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as s:
-            async with s.post("https://api.nowpayments.io/v1/invoice",
-                              headers=headers, json=np_payload) as resp:
-                data = await resp.json()
-                if resp.status not in (200, 201):
-                    return web.json_response(
-                        {"error": "nowpayments_error", "detail": data},
-                        status=502,
-                    )
+        async with http_clients.request("payments", "POST", "https://api.nowpayments.io/v1/invoice",
+                                        headers=headers, json=np_payload) as resp:
+            data = await resp.json()
+            if resp.status not in (200, 201):
+                return web.json_response(
+                    {"error": "nowpayments_error", "detail": data},
+                    status=502,
+                )
         url = data.get("invoice_url")
         if not url:
             return web.json_response({"error": "no_invoice_url"}, status=502)
@@ -370,7 +377,7 @@ async def _api_topup_crypto(request: web.Request) -> web.Response:
     storage.data.setdefault("pending_crypto", {})[order_id] = {
         "user_id": uid, "tier": tier_id, "ts": time.time(),
     }
-    await storage.save()
+    await storage.flush()
     return web.json_response({"invoice_url": url, "tier": tier_id, "usd": info["usd"]})
 
 
@@ -0,0 +1,100 @@
+"""Incremental Server-Sent Events parser for the streaming AI providers.
+
+Works on raw `bytes` as they come off the socket: each read is split into
+lines in one C-level pass, field names are compared as bytes, and `data:`
+payloads are handed over as bytes — only they get decoded (once, by the
+consumer), never the framing around them. Handles what a line-at-a-time
+reader gets wrong:
+
+  * events split across network reads (a read may end mid-line or mid-event)
+  * multi-line events (several `data:` lines joined with "\\n")
+  * `event:`, `id:` and `retry:` fields, `:` comment / keep-alive lines
+  * LF and CRLF line endings (bare CR isn't used by any provider we talk to)
+
+    async for event in iter_sse(resp.content):
+        obj = json.loads(event.data.decode())   # str parses ~2x faster than bytes
+"""
+from typing import AsyncIterator, List, NamedTuple, Optional
+
+import aiohttp
+
+
+class SSEEvent(NamedTuple):
+    event: str            # "message" unless the server sent `event:`
+    data: bytes           # `data:` lines joined with b"\n"
+    id: Optional[str]     # last `id:` seen on the stream
+
+
+class SSEParser:
+    def __init__(self):
+        self._tail = b""               # unfinished last line of the previous read
+        self._data: List[bytes] = []
+        self._event = b""
+        self.last_id: Optional[str] = None
+        self.retry_ms: Optional[int] = None  # server's reconnection hint
+        self.comments = 0
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """Consume one network read; return the events it completed."""
+        if self._tail:
+            chunk = self._tail + chunk
+        lines = chunk.split(b"\n")  # one C-level pass; the last piece is unfinished
+        self._tail = lines.pop()
+        events: List[SSEEvent] = []
+        data = self._data
+        for line in lines:
+            if line[-1:] == b"\r":
+                line = line[:-1]
+            if line[:5] == b"data:":  # the hot path: almost every line
+                data.append(line[6:] if line[5:6] == b" " else line[5:])
+            elif not line:
+                if data:
+                    name = _EVENT_NAMES.get(self._event) or self._event.decode("utf-8", "replace")
+                    events.append(SSEEvent(name, data[0] if len(data) == 1 else b"\n".join(data), self.last_id))
+                    data = self._data = []
+                self._event = b""
+            else:
+                self._field(line)
+        return events
+
+    def close(self) -> List[SSEEvent]:
+        """End of stream: a last event without its blank line is still delivered."""
+        events = self.feed(b"\n\n") if self._tail else self.feed(b"\n")
+        self._tail = b""
+        return events
+
+    def _field(self, line: bytes):
+        if line[:1] == b":":
+            self.comments += 1
+            return
+        field, colon, value = line.partition(b":")
+        if colon and value[:1] == b" ":
+            value = value[1:]
+        if field == b"event":
+            self._event = value
+        elif field == b"id":
+            if b"\0" not in value:
+                self.last_id = value.decode("utf-8", "replace")
+        elif field == b"retry":
+            if value.isdigit():
+                self.retry_ms = int(value)
+        elif field == b"data":  # "data" with no colon: an empty data line
+            self._data.append(b"")
+
+
+# Event names the providers send, so dispatch doesn't decode them every time
+_EVENT_NAMES = {name.encode(): name for name in (
+    "message", "message_start", "message_delta", "message_stop", "content_block_start",
+    "content_block_delta", "content_block_stop", "ping", "error",
+)}
+_EVENT_NAMES[b""] = "message"
+
+
+async def iter_sse(content: aiohttp.StreamReader) -> AsyncIterator[SSEEvent]:
+    """Events from an aiohttp response body, as soon as each one is complete."""
+    parser = SSEParser()
+    async for chunk in content.iter_any():
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.close():
+        yield event
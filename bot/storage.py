@@ -2,34 +2,1197 @@ import asyncio
 import base64
 import json
 import logging
-from typing import Dict, Any
+import os
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, Any, Optional, List, Iterable, Iterator, Tuple
 import aiohttp
-from bot.config import GITHUB_TOKEN, GITHUB_REPO, GITHUB_FILE_PATH
+from bot.config import (GITHUB_TOKEN, GITHUB_REPO, GITHUB_FILE_PATH, GITHUB_API_URL, GITHUB_BRANCH,
+                        STORAGE_BACKEND, STORAGE_LAYOUT, STORAGE_SHARDS, STORAGE_DATA_DIR,
+                        STORAGE_SQLITE_PATH, STORAGE_WRITE_BEHIND, STORAGE_FLUSH_WINDOW_MS,
+                        STORAGE_JOURNAL_DIR, STORAGE_JOURNAL_FSYNC_MS, STORAGE_COMPACT_RECORDS,
+                        STORAGE_PAGER_DIR, STORAGE_RESIDENT_USERS, STORAGE_PAGE_IDLE_S,
+                        STORAGE_SNAPSHOT_FORMAT)
+from bot.http_clients import http_clients
+from bot.records import RECORD_TYPES, CompactRecord, json_default
 
 logger = logging.getLogger(__name__)
 
+# Collections that are keyed per-record and tracked record-by-record. Every
+# other top-level key (reminders, pending_crypto, used_tx, …) is small enough
+# to re-serialize on each save and is diffed against its last saved fragment.
+_RECORD_COLLECTIONS = ("users", "groups")
+_DEFAULT_KEYS = (("users", dict), ("groups", dict), ("notes", dict), ("reminders", list), ("stats", dict))
+
+# Parallel blob downloads/uploads against the Git Data API
+_SHARD_CONCURRENCY = 8
+SAVE_TIMEOUT = aiohttp.ClientTimeout(total=30)
+# Bytes per base64 slice when encoding a save (multiple of 3 → no padding mid-stream)
+_B64_SLICE = 3 * 64 * 1024
+# Cold-user pager: how often it looks for users to page out, the minimum idle
+# time before the resident budget may evict someone (a handler can hold a user
+# across an AI call), and when the page file gets compacted.
+_PAGER_INTERVAL = 60
+_PAGER_MIN_IDLE_S = 120
+_PAGER_COMPACT_BYTES = 8 * 1024 * 1024
+# Users paged out per slice; the loop yields between slices so a big backlog
+# (first pass after start) doesn't stall the event loop.
+_PAGER_BATCH = 500
+# Ids one task may have handed out before its next save(); past this the set is
+# restarted (a long-lived task that never saves mustn't grow it forever).
+_HANDOUT_CAP = 4096
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=json_default)
+
+
+def _b64_stream(chunks: Iterable[bytes]) -> bytes:
+    """base64 over a stream of byte chunks, a bounded slice at a time.
+    str.encode and b64encode hold the GIL for their whole input, so one call
+    over a multi-MB document would stall the event loop even from a worker
+    thread; slicing lets the loop run in between. The final join releases it."""
+    out = []
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        if len(buf) >= _B64_SLICE:
+            cut = len(buf) - len(buf) % 3
+            out.append(base64.b64encode(memoryview(buf)[:cut]))
+            del buf[:cut]
+    out.append(base64.b64encode(buf))
+    return b"".join(out)
+
+
+def _object_pieces(items) -> Iterator[str]:
+    """`{"k":v,...}` as pieces, from (key, json) pairs."""
+    yield "{"
+    first = True
+    for key, raw in items:
+        yield f"{_dumps(key)}:" if first else f",{_dumps(key)}:"
+        yield raw
+        first = False
+    yield "}"
+
+
+def _utf8(pieces: Iterable[str]) -> Iterator[bytes]:
+    for piece in pieces:
+        yield piece.encode("utf-8")
+
+
+def _record_line(collection: str, rid: str, frag: str) -> str:
+    return f'{{"c":{_dumps(collection)},"id":{_dumps(rid)},"v":{frag}}}\n'
+
+
+def _top_line(key: str, frag: str) -> str:
+    return f'{{"k":{_dumps(key)},"v":{frag}}}\n'
+
+
+def _compact(collection: str, record):
+    """Wrap a loaded/new record in its compact in-memory type (bot/records.py)."""
+    if STORAGE_COMPACT_RECORDS and type(record) is dict:
+        return RECORD_TYPES[collection](record)
+    return record
+
+
+def shard_of(record_id: str, shards: int) -> int:
+    """Stable shard index for a user/group id (crc32 — same on every process)."""
+    return zlib.crc32(record_id.encode("utf-8")) % shards
+
+
+class _Changes:
+    """What one save() has to write, computed from the dirty marks."""
+
+    def __init__(self):
+        self.fresh: Dict[str, Dict[str, str]] = {}  # collection -> {id: json} whose JSON changed
+        self.removed: Dict[str, set] = {}           # collection -> ids deleted since last save
+        self.taken: Dict[str, set] = {}             # collection -> dirty marks consumed
+        self.top: Dict[str, str] = {}               # every non-record key -> json
+        self.top_changed = False
+
+    @property
+    def changed(self) -> bool:
+        return self.top_changed or any(self.fresh.values()) or any(self.removed.values())
+
+
+class _Snapshot:
+    """Everything one save writes, frozen on the event loop so a backend can
+    render and encode it in a worker thread while handlers keep mutating
+    storage.data. Dirty records were already serialized into changes.fresh;
+    the {id: record} tables are copied (shallow). A record that wasn't dirty
+    has not changed since it was saved, so frag() serializes it again in the
+    worker (paged-out users are read from their page instead). Anything a
+    handler changes meanwhile was handed out by get_user() and is rewritten by
+    the next save."""
+
+    def __init__(self, data: dict, changes: _Changes, render):
+        self.changes = changes
+        self.keys = list(data)
+        self.records = {name: dict(data[name]) for name in changes.fresh}
+        self.ids = {name: list(records) for name, records in self.records.items()}
+        self._render = render
+
+    def frag(self, collection: str, rid: str) -> str:
+        frag = self.changes.fresh[collection].get(rid)
+        if frag is None:
+            frag = self._render(collection, rid, self.records[collection][rid])
+        return frag
+
+
+# ============== SCHEMA ==============
+#
+# Records are upgraded once, at load time, so get_user()/get_group() can be a
+# plain lookup. To add a field: add it to _new_user()/_new_group(), write a
+# _user_vN/_group_vN step that backfills it, and bump SCHEMA_VERSION. Steps
+# must be idempotent — journal replay re-runs all of them on replayed records.
+
+SCHEMA_VERSION = 1
+
+
+def _new_user(user_id: int) -> dict:
+    return {
+        "id": user_id,
+        "ai_provider": "gemini",
+        "api_keys": {},
+        "vip": False,                # legacy boolean — kept for back-compat
+        "tier": "free",              # "free" | "plus" | "pro"
+        "tier_expires": None,        # epoch seconds; None = forever or free
+        "image_credits": 0,
+        "image_credits_reset": 0,    # epoch seconds when monthly bucket refills
+        "memory": {},
+        "notes": [],
+        "chat_history": [],
+        "stats": {"msgs": 0, "commands": 0},
+        "referrals": 0,
+        "xp_by_week": {},
+        "xp_by_day": {},
+        "last_seen_level": 0,
+        "first_paid": False,
+        "digest_enabled": False,
+        "digest_time": "08:00",
+        "timezone": "UTC",
+        "last_digest_date": "",
+    }
+
+
+def _new_group(chat_id: int) -> dict:
+    return {
+        "id": chat_id,
+        "vip": False,
+        "welcome_enabled": False,
+        "welcome_msg": "",
+        "goodbye_enabled": False,
+        "goodbye_msg": "",
+        "rules": "",
+        "warns": {},
+        "ai_enabled": True,
+        "antilink": False,
+        "antispam": False,
+        "stats": {"msgs": 0, "users": {}},
+        "memory": {},
+        "messages": [],
+    }
+
+
+def _user_v1(u: dict):
+    """Backfill everything get_user() used to setdefault on every call."""
+    u.setdefault("chat_history", [])
+    u.setdefault("memory", {})
+    u.setdefault("notes", [])
+    u.setdefault("api_keys", {})
+    u.setdefault("stats", {"msgs": 0, "commands": 0})
+    u.setdefault("referrals", 0)
+    u.setdefault("xp_by_week", {})
+    u.setdefault("xp_by_day", {})
+    u.setdefault("last_seen_level", 0)
+    u.setdefault("tier", "pro" if u.get("vip") else "free")
+    u.setdefault("tier_expires", u.get("vip_expires"))
+    u.setdefault("image_credits", 0)
+    u.setdefault("image_credits_reset", 0)
+    u.setdefault("first_paid", False)
+    u.setdefault("digest_enabled", False)
+    u.setdefault("digest_time", "08:00")
+    u.setdefault("timezone", "UTC")
+    u.setdefault("last_digest_date", "")
+
+
+def _group_v1(g: dict):
+    g.setdefault("messages", [])
+    g.setdefault("warns", {})
+    g.setdefault("stats", {"msgs": 0, "users": {}})
+
+
+# version -> step; a step brings a record from version-1 to version
+_MIGRATIONS = {
+    "users": {1: _user_v1},
+    "groups": {1: _group_v1},
+}
+
+
+def migrate_record(collection: str, record: dict, from_version: int = 0) -> bool:
+    """Run the steps after from_version on one record. Returns True if it changed."""
+    before = len(record)
+    for version, step in sorted(_MIGRATIONS.get(collection, {}).items()):
+        if version > from_version:
+            step(record)
+    return len(record) != before
+
+
+# ============== SNAPSHOT FORMAT ==============
+#
+# What the GitHub backends store. "v1" (default):
+#
+#     b"DSNP" | version byte | codec byte (b"z" = zlib) | codec stream of
+#     newline-delimited entries, the same shapes the journal uses:
+#         {"k":"reminders","v":[...]}            top-level value
+#         {"c":"users","id":"42","v":{...}}      one record
+#
+# "json" writes the legacy single JSON document (readable by older releases —
+# switch to it before rolling back). Readers take either: no magic = legacy.
+# Both directions stream: the encoder compresses entry by entry, the decoder
+# parses each line as it is decompressed, so a load/save never holds the
+# plaintext document as one string.
+
+SNAPSHOT_MAGIC = b"DSNP"
+SNAPSHOT_VERSION = 1
+_CODEC_ZLIB = ord("z")
+_CODEC_NONE = ord("n")
+_HEADER_LEN = len(SNAPSHOT_MAGIC) + 2
+
+
+def _snapshot_stream(lines: Iterable[str]) -> Iterator[bytes]:
+    """Encode entry lines as a v1 snapshot, yielding compressed chunks."""
+    yield SNAPSHOT_MAGIC + bytes((SNAPSHOT_VERSION, _CODEC_ZLIB))
+    z = zlib.compressobj(6)
+    batch: List[str] = []
+    size = 0
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if size >= _B64_SLICE:
+            out = z.compress("".join(batch).encode("utf-8"))
+            batch, size = [], 0
+            if out:
+                yield out
+    yield z.compress("".join(batch).encode("utf-8")) + z.flush()
+
+
+class SnapshotReader:
+    """Incremental decoder for both formats. feed() raw bytes as they arrive,
+    then finish() returns the document. A legacy JSON document can only be
+    parsed whole; v1 is parsed line by line. For v1 with keep_digests,
+    `digests` also collects hash() of each record's stored JSON so Storage can
+    prime its digest cache instead of re-serializing every record."""
+
+    def __init__(self, keep_digests: bool = True):
+        self.version: Optional[int] = None  # 0 = legacy JSON
+        self.data: Dict[str, Any] = {}
+        self.digests: Dict[str, Dict[str, int]] = {}
+        self.keep_digests = keep_digests
+        self._buf = bytearray()
+        self._z = None
+
+    def feed(self, chunk: bytes):
+        if self.version is None:
+            self._buf += chunk
+            if len(self._buf) < _HEADER_LEN:
+                return
+            if not self._buf.startswith(SNAPSHOT_MAGIC):
+                self.version = 0
+                return
+            version, codec = self._buf[4], self._buf[5]
+            if version > SNAPSHOT_VERSION:
+                raise ValueError(f"snapshot format v{version} is newer than this release (v{SNAPSHOT_VERSION})")
+            if codec == _CODEC_ZLIB:
+                self._z = zlib.decompressobj()
+            elif codec != _CODEC_NONE:
+                raise ValueError(f"unknown snapshot codec {codec!r}")
+            self.version = version
+            body = bytes(self._buf[_HEADER_LEN:])
+            self._buf = bytearray()
+            self._feed_body(body)
+        elif self.version == 0:
+            self._buf += chunk
+        else:
+            self._feed_body(chunk)
+
+    def _feed_body(self, chunk: bytes):
+        self._feed_text(self._z.decompress(chunk) if self._z is not None else chunk)
+
+    def _feed_text(self, text: bytes):
+        self._buf += text
+        start = 0
+        while True:
+            end = self._buf.find(b"\n", start)
+            if end < 0:
+                break
+            self._entry(self._buf[start:end])
+            start = end + 1
+        del self._buf[:start]
+
+    def _entry(self, raw: bytes):
+        if not raw.strip():
+            return
+        line = raw.decode("utf-8")
+        entry = json.loads(line)
+        if "k" in entry:
+            self.data[entry["k"]] = entry["v"]
+            return
+        collection, rid = entry["c"], entry["id"]
+        value = entry["v"]
+        if collection in _RECORD_COLLECTIONS:
+            # Per-line json.loads can't share key strings between records —
+            # compact (interning) right away so they don't pile up until _install.
+            value = _compact(collection, value)
+        self.data.setdefault(collection, {})[rid] = value
+        if not self.keep_digests:
+            return
+        prefix = f'{{"c":{_dumps(collection)},"id":{_dumps(rid)},"v":'
+        if line.startswith(prefix) and line.endswith("}"):
+            self.digests.setdefault(collection, {})[rid] = hash(line[len(prefix):-1])
+
+    def finish(self) -> dict:
+        if not self.version:
+            data = json.loads(self._buf)
+            self._buf = bytearray()
+            if not isinstance(data, dict):
+                raise ValueError("top-level JSON is not an object")
+            return data
+        if self._z is not None:
+            self._feed_text(self._z.flush())
+            if not self._z.eof:
+                # Never treat a cut-off download as the whole state.
+                raise ValueError("snapshot is truncated")
+        if self._buf:
+            self._entry(bytes(self._buf))
+            self._buf = bytearray()
+        return self.data
+
+
+def read_snapshot(path: str) -> dict:
+    """Decode a snapshot file from disk (either format)."""
+    reader = SnapshotReader(keep_digests=False)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_B64_SLICE), b""):
+            reader.feed(chunk)
+    return reader.finish()
+
+
+# ============== BACKENDS ==============
+#
+# A backend moves state between Storage and durable storage. load() returns
+# the state dict, {} for a confirmed-empty baseline, or None when it could not
+# read (Storage then refuses to save). write() gets a _Snapshot (change set
+# plus a frag(collection, id) lookup for unchanged records' JSON) and returns
+# True once the changes are durable. Rendering/encoding a snapshot is CPU work
+# on megabytes — do it through _offload() so the event loop keeps serving.
+
+class StorageBackend:
+    name = "none"
+    # True when write() diffs against the digest cache, so it must be primed
+    # with what is already stored right after load().
+    needs_primed_cache = False
+    # Render snapshots in a worker thread (tools/bench_save_stall.py turns it off
+    # to measure the difference).
+    offload = True
 
-class Storage:
     def __init__(self):
+        # Optional {collection: {id: hash(json)}} produced by load() — lets
+        # Storage prime its digest cache without re-serializing every record.
+        self.loaded_digests: Optional[Dict[str, Dict[str, int]]] = None
+
+    async def load(self) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def write(self, snap: _Snapshot) -> bool:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def _offload(self, fn, *args):
+        if self.offload:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+
+class GitHubFileBackend(StorageBackend):
+    """One JSON document at GITHUB_FILE_PATH via the Contents API (legacy layout)."""
+    name = "github-file"
+
+    def __init__(self, api_base: str = GITHUB_API_URL):
+        super().__init__()
+        self.sha = None
+        self.headers = {
+            "Authorization": f"token {GITHUB_TOKEN}",
+            "Accept": "application/vnd.github.v3+json",
+        }
+        self.repo_url = f"{api_base.rstrip('/')}/repos/{GITHUB_REPO}"
+        self.api_url = f"{self.repo_url}/contents/{GITHUB_FILE_PATH}"
+        self.snapshot_format = STORAGE_SNAPSHOT_FORMAT
+
+    async def load(self) -> Optional[dict]:
+        return await self._load_file()
+
+    async def _load_file(self) -> Optional[dict]:
+        async with http_clients.request("github", "GET", self.api_url, headers=self.headers) as resp:
+            if resp.status == 200:
+                data = await resp.json()
+                self.sha = data.get("sha")
+                raw = data.get("content", "")
+                reader = SnapshotReader()
+                try:
+                    if raw:
+                        reader.feed(base64.b64decode(raw))
+                    elif self.sha:
+                        # Contents API omits content for files over 1 MB — stream the blob.
+                        await self._stream_blob(self.sha, reader)
+                    loaded_data = reader.finish()
+                except (ValueError, zlib.error) as e:
+                    logger.error(f"Failed to parse data from GitHub: {e} — refusing to overwrite.")
+                    return None
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.error(f"Failed to download data from GitHub: {e} — refusing to overwrite.")
+                    return None
+                if reader.version:
+                    self.loaded_digests = reader.digests
+                return loaded_data
+            if resp.status == 404:
+                logger.info("Data file not found on GitHub. Will create on first save.")
+                # 404 is a SAFE baseline — file genuinely doesn't exist yet
+                return {}
+            logger.error(f"Failed to load data from GitHub: {resp.status} {await resp.text()}")
+            return None
+
+    async def _stream_blob(self, sha: str, reader: SnapshotReader):
+        """Feed a blob's raw bytes to `reader` as they arrive (no base64/JSON wrapper)."""
+        headers = {**self.headers, "Accept": "application/vnd.github.raw+json"}
+        async with http_clients.request("github", "GET", f"{self.repo_url}/git/blobs/{sha}",
+                                        headers=headers) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(_B64_SLICE):
+                reader.feed(chunk)
+
+    async def _put(self, body: bytes):
+        headers = {**self.headers, "Content-Type": "application/json"}
+        # No pool-level retries: _upload decides (a resent PUT may 409 on its own commit)
+        async with http_clients.request("github", "PUT", self.api_url, retries=0,
+                                        headers=headers, data=body, timeout=SAVE_TIMEOUT) as resp:
+            return resp.status, await resp.json() if resp.content_type == "application/json" else await resp.text()
+
+    def _encode_document(self, snap: _Snapshot) -> bytes:
+        """Whole document, base64-encoded for the Contents API (worker thread)."""
+        changes = snap.changes
+
+        def lines():
+            for key in snap.keys:
+                if key in changes.fresh:
+                    for rid in snap.ids[key]:
+                        yield _record_line(key, rid, snap.frag(key, rid))
+                else:
+                    yield _top_line(key, changes.top[key])
+
+        def pieces():
+            yield "{"
+            for i, key in enumerate(snap.keys):
+                yield f",{_dumps(key)}:" if i else f"{_dumps(key)}:"
+                if key in changes.fresh:
+                    yield from _object_pieces((rid, snap.frag(key, rid)) for rid in snap.ids[key])
+                else:
+                    yield changes.top[key]
+            yield "}"
+
+        if self.snapshot_format == "json":
+            return _b64_stream(_utf8(pieces()))
+        return _b64_stream(_snapshot_stream(lines()))
+
+    async def write(self, snap: _Snapshot) -> bool:
+        return await self._upload(await self._offload(self._encode_document, snap))
+
+    async def _upload(self, content_b64: bytes) -> bool:
+        """PUT the whole (base64-encoded) document via the Contents API. Returns True on success."""
+        for attempt in (1, 2):
+            head = {"message": "Update bot data"}
+            if self.sha:
+                head["sha"] = self.sha
+            # Splice the big base64 blob into the JSON body without json.dumps
+            # re-scanning it on the loop; bytes.join releases the GIL.
+            request_body = await self._offload(b"".join, (
+                json.dumps(head)[:-1].encode() + b',"content":"', content_b64, b'"}'))
+
+            try:
+                status, body = await self._put(request_body)
+            except aiohttp.ClientError as e:
+                logger.error(f"Save network error (attempt {attempt}): {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if status in (200, 201):
+                if isinstance(body, dict):
+                    self.sha = body.get("content", {}).get("sha")
+                logger.info("Data saved to GitHub.")
+                return True
+
+            # Conflict (stale sha) — refresh sha and retry once
+            if status == 409 and attempt == 1:
+                logger.warning("Save 409 (stale sha). Refreshing and retrying.")
+                try:
+                    async with http_clients.request("github", "GET", self.api_url, headers=self.headers) as resp:
+                        if resp.status == 200:
+                            data = await resp.json()
+                            self.sha = data.get("sha")
+                            continue
+                except aiohttp.ClientError as e:
+                    logger.error(f"SHA refresh failed: {e}")
+                return False
+
+            logger.error(f"Failed to save data to GitHub (attempt {attempt}): {status} {body}")
+            if attempt == 1:
+                await asyncio.sleep(0.5)
+                continue
+            return False
+        return False
+
+
+class GitHubShardedBackend(GitHubFileBackend):
+    """Users/groups hashed into `shards` files per collection under `data_dir`,
+    plus meta.json for the small collections. Every save is one commit through
+    the Git Data API (blobs → tree → commit → ref) containing only the shard
+    files whose records changed."""
+    name = "github-sharded"
+    needs_primed_cache = True
+
+    def __init__(self, api_base: str = GITHUB_API_URL, shards: int = STORAGE_SHARDS,
+                 data_dir: str = STORAGE_DATA_DIR, branch: str = GITHUB_BRANCH):
+        super().__init__(api_base)
+        self.shards = max(shards, 1)
+        self.data_dir = data_dir.strip("/")
+        self.branch = branch
+        self._head_sha: Optional[str] = None
+        self._tree_sha: Optional[str] = None
+
+    async def _git(self, method: str, path: str, payload=None):
+        """Git Data API call. `payload` is a JSON-able object, or bytes that are
+        already a JSON body (big blobs, encoded off the loop)."""
+        if isinstance(payload, bytes):
+            kwargs = {"data": payload, "headers": {**self.headers, "Content-Type": "application/json"}}
+        else:
+            kwargs = {"json": payload, "headers": self.headers}
+        if method != "GET":
+            kwargs["timeout"] = SAVE_TIMEOUT
+        async with http_clients.request("github", method, f"{self.repo_url}/git/{path}", **kwargs) as resp:
+            body = await resp.json() if resp.content_type == "application/json" else await resp.text()
+            return resp.status, body
+
+    async def _refresh_head(self) -> bool:
+        if not self.branch:
+            async with http_clients.request("github", "GET", self.repo_url, headers=self.headers) as resp:
+                if resp.status != 200:
+                    logger.error(f"Failed to read repo metadata: {resp.status} {await resp.text()}")
+                    return False
+                self.branch = (await resp.json()).get("default_branch") or "main"
+        status, ref = await self._git("GET", f"ref/heads/{self.branch}")
+        if status != 200:
+            logger.error(f"Failed to read branch {self.branch}: {status} {ref}")
+            return False
+        self._head_sha = ref["object"]["sha"]
+        status, commit = await self._git("GET", f"commits/{self._head_sha}")
+        if status != 200:
+            logger.error(f"Failed to read head commit: {status} {commit}")
+            return False
+        self._tree_sha = commit["tree"]["sha"]
+        return True
+
+    def _shard_path(self, collection: str, index: int) -> str:
+        return f"{self.data_dir}/{collection}/{index:03d}.json"
+
+    async def load(self) -> Optional[dict]:
+        if not await self._refresh_head():
+            return None
+        status, tree = await self._git("GET", f"trees/{self._tree_sha}?recursive=1")
+        if status != 200:
+            logger.error(f"Failed to read tree: {status} {tree}")
+            return None
+        if tree.get("truncated"):
+            logger.error("Git tree listing truncated; refusing to load a partial shard set.")
+            return None
+        prefix = self.data_dir + "/"
+        blobs = {e["path"]: e["sha"] for e in tree.get("tree", [])
+                 if e.get("type") == "blob" and e["path"].startswith(prefix) and e["path"].endswith(".json")}
+        meta_path = f"{self.data_dir}/meta.json"
+        # No sharded data yet → start from the legacy single file (if any) and
+        # leave the digest cache empty, so the first save writes every shard.
+        self.needs_primed_cache = meta_path in blobs
+        if not self.needs_primed_cache:
+            logger.info("No sharded data on GitHub; importing legacy data file.")
+            loaded = await self._load_file()
+            self.loaded_digests = None  # nothing is in shard form yet
+            return loaded
+
+        sem = asyncio.Semaphore(_SHARD_CONCURRENCY)
+
+        async def fetch(path, sha):
+            reader = SnapshotReader()
+            async with sem:
+                await self._stream_blob(sha, reader)
+            return path, reader.finish(), reader
+
+        try:
+            results = await asyncio.gather(*(fetch(p, sha) for p, sha in blobs.items()))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, zlib.error) as e:
+            logger.error(f"Failed to load shards: {e} — refusing to overwrite.")
+            return None
+
+        loaded_data: Dict[str, Any] = {name: {} for name in _RECORD_COLLECTIONS}
+        # Digests of the stored record JSON, usable as the cache if every shard is v1
+        digests: Optional[Dict[str, Dict[str, int]]] = {name: {} for name in _RECORD_COLLECTIONS}
+        for path, content, reader in results:
+            if path == meta_path:
+                stored = int(content.pop("_shards", self.shards))
+                if stored != self.shards:
+                    logger.warning(f"Data was sharded {stored}-way; keeping that instead of {self.shards}.")
+                    self.shards = stored
+                loaded_data.update(content)
+                continue
+            collection = path[len(prefix):].split("/", 1)[0]
+            if collection in _RECORD_COLLECTIONS:
+                if reader.version:
+                    content = content.get(collection, {})
+                    if digests is not None:
+                        digests[collection].update(reader.digests.get(collection, {}))
+                else:
+                    digests = None
+                loaded_data[collection].update(content)
+        self.loaded_digests = digests
+        return loaded_data
+
+    def _render_shards(self, snap: _Snapshot) -> Dict[str, bytes]:
+        """Only the shard files touched by this change set (+ meta if needed),
+        each as a ready-to-send blobs API request body (worker thread)."""
+        changes = snap.changes
+        legacy = self.snapshot_format == "json"
+        files: Dict[str, bytes] = {}
+        for key, fresh in changes.fresh.items():
+            touched = {shard_of(rid, self.shards) for rid in fresh}
+            touched |= {shard_of(rid, self.shards) for rid in changes.removed[key]}
+            if not touched:
+                continue
+            members: Dict[int, List[str]] = {i: [] for i in touched}
+            for rid in snap.ids[key]:
+                idx = shard_of(rid, self.shards)
+                if idx in members:
+                    members[idx].append(rid)
+            for idx, rids in members.items():
+                if legacy:
+                    chunks = _utf8(_object_pieces((rid, snap.frag(key, rid)) for rid in rids))
+                else:
+                    chunks = _snapshot_stream(_record_line(key, rid, snap.frag(key, rid)) for rid in rids)
+                files[self._shard_path(key, idx)] = _b64_stream(chunks)
+        if changes.top_changed:
+            meta = [("_shards", str(self.shards)), *changes.top.items()]
+            if legacy:
+                chunks = _utf8(_object_pieces(meta))
+            else:
+                chunks = _snapshot_stream(_top_line(k, v) for k, v in meta)
+            files[f"{self.data_dir}/meta.json"] = _b64_stream(chunks)
+        return {path: b"".join((b'{"encoding":"base64","content":"', content, b'"}'))
+                for path, content in files.items()}
+
+    async def write(self, snap: _Snapshot) -> bool:
+        return await self._upload_shards(await self._offload(self._render_shards, snap))
+
+    async def _upload_shards(self, files: Dict[str, bytes]) -> bool:
+        """Write changed shard files (path → blob request body) as one commit:
+        blobs → tree → commit → ref. Returns True on success."""
+        sem = asyncio.Semaphore(_SHARD_CONCURRENCY)
+
+        async def make_blob(path, request_body):
+            async with sem:
+                status, body = await self._git("POST", "blobs", request_body)
+            if status != 201:
+                raise RuntimeError(f"blob {path}: {status} {body}")
+            return {"path": path, "mode": "100644", "type": "blob", "sha": body["sha"]}
+
+        try:
+            entries = await asyncio.gather(*(make_blob(p, c) for p, c in files.items()))
+        except (aiohttp.ClientError, RuntimeError) as e:
+            logger.error(f"Failed to upload shard blobs: {e}")
+            return False
+
+        for attempt in (1, 2):
+            try:
+                if not self._head_sha and not await self._refresh_head():
+                    return False
+                status, tree = await self._git("POST", "trees",
+                                               {"base_tree": self._tree_sha, "tree": entries})
+                if status != 201:
+                    logger.error(f"Failed to create tree: {status} {tree}")
+                    return False
+                status, commit = await self._git("POST", "commits", {
+                    "message": f"Update bot data ({len(entries)} shard(s))",
+                    "tree": tree["sha"],
+                    "parents": [self._head_sha],
+                })
+                if status != 201:
+                    logger.error(f"Failed to create commit: {status} {commit}")
+                    return False
+                status, ref = await self._git("PATCH", f"refs/heads/{self.branch}",
+                                              {"sha": commit["sha"], "force": False})
+            except aiohttp.ClientError as e:
+                logger.error(f"Shard save network error (attempt {attempt}): {e}")
+                self._head_sha = None
+                await asyncio.sleep(1)
+                continue
+            if status == 200:
+                self._head_sha, self._tree_sha = commit["sha"], tree["sha"]
+                logger.info(f"Data saved to GitHub ({len(entries)} shard(s)).")
+                return True
+            # Someone else moved the branch — rebase our entries on the new head once
+            logger.warning(f"Ref update rejected ({status}); refreshing head and retrying.")
+            self._head_sha = None
+        return False
+
+
+class SQLiteBackend(StorageBackend):
+    """Local embedded database (WAL mode). One row per user/group, one row per
+    small top-level collection; a save upserts only the changed rows."""
+    name = "sqlite"
+
+    def __init__(self, path: str = STORAGE_SQLITE_PATH):
+        super().__init__()
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            # Calls are serialized by Storage._save_lock but run in worker threads.
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS records ("
+                         "collection TEXT NOT NULL, id TEXT NOT NULL, json TEXT NOT NULL, "
+                         "PRIMARY KEY (collection, id)) WITHOUT ROWID")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, json TEXT NOT NULL)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _load_sync(self) -> dict:
+        conn = self._connect()
+        loaded_data: Dict[str, Any] = {name: {} for name in _RECORD_COLLECTIONS}
+        digests: Dict[str, Dict[str, int]] = {name: {} for name in _RECORD_COLLECTIONS}
+        for collection, rid, raw in conn.execute("SELECT collection, id, json FROM records"):
+            loaded_data.setdefault(collection, {})[rid] = json.loads(raw)
+            digests.setdefault(collection, {})[rid] = hash(raw)
+        for key, raw in conn.execute("SELECT key, json FROM meta"):
+            loaded_data[key] = json.loads(raw)
+        # Rows hold exactly _dumps(record), so their hashes prime the digest cache.
+        self.loaded_digests = digests
+        return loaded_data
+
+    async def load(self) -> Optional[dict]:
+        try:
+            return await asyncio.to_thread(self._load_sync)
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Failed to load SQLite storage at {self.path}: {e} — refusing to overwrite.")
+            return None
+
+    def _write_sync(self, changes: _Changes):
+        conn = self._connect()
+        with conn:
+            for collection, fresh in changes.fresh.items():
+                conn.executemany(
+                    "INSERT INTO records (collection, id, json) VALUES (?, ?, ?) "
+                    "ON CONFLICT (collection, id) DO UPDATE SET json = excluded.json",
+                    ((collection, rid, raw) for rid, raw in fresh.items()))
+                conn.executemany("DELETE FROM records WHERE collection = ? AND id = ?",
+                                 ((collection, rid) for rid in changes.removed.get(collection, ())))
+            if changes.top_changed:
+                conn.execute("DELETE FROM meta")
+                conn.executemany("INSERT INTO meta (key, json) VALUES (?, ?)", changes.top.items())
+
+    async def write(self, snap: _Snapshot) -> bool:
+        changes = snap.changes
+        try:
+            await asyncio.to_thread(self._write_sync, changes)
+        except sqlite3.Error as e:
+            logger.error(f"SQLite save failed: {e}")
+            return False
+        logger.debug(f"Data saved to SQLite ({sum(map(len, changes.fresh.values()))} record(s)).")
+        return True
+
+    async def import_all(self, data: dict):
+        """Replace the database contents with `data` (migration helper)."""
+        changes = _Changes()
+        for key, value in data.items():
+            if key in _RECORD_COLLECTIONS and isinstance(value, dict):
+                changes.fresh[key] = {rid: _dumps(rec) for rid, rec in value.items()}
+            else:
+                changes.top[key] = _dumps(value)
+        changes.top_changed = True
+
+        def run():
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM records")
+            self._write_sync(changes)
+        await asyncio.to_thread(run)
+
+    async def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await asyncio.to_thread(conn.close)
+
+
+# ============== WRITE-AHEAD JOURNAL ==============
+
+class Journal:
+    """Append-only local log of record snapshots, one JSON object per line:
+
+        {"c": "users", "id": "42", "v": {...}}   record written
+        {"c": "users", "id": "42", "d": 1}       record deleted
+        {"k": "reminders", "v": [...]}           small top-level collection
+
+    Lines go to numbered segment files. Before each remote save the active
+    segment is sealed; once the save succeeds every sealed segment is covered
+    by the backend and deleted. On startup all remaining segments are replayed
+    on top of the backend state, so a crash loses at most one fsync batch."""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self._fh = None
+        self.seq = 0
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        out = []
+        for name in os.listdir(self.folder):
+            if name.startswith("journal-") and name.endswith(".log"):
+                try:
+                    out.append((int(name[8:-4]), os.path.join(self.folder, name)))
+                except ValueError:
+                    continue
+        return sorted(out)
+
+    def replay(self) -> Iterator[dict]:
+        os.makedirs(self.folder, exist_ok=True)
+        for _, path in self._segments():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # Torn tail from a crash mid-write — everything after is garbage.
+                        logger.warning(f"Journal {path}: skipping unreadable tail.")
+                        break
+
+    def open(self):
+        segments = self._segments()
+        self.seq = segments[-1][0] + 1 if segments else 1
+        self._fh = open(os.path.join(self.folder, f"journal-{self.seq:08d}.log"), "a", encoding="utf-8")
+
+    def append(self, lines: List[str]):
+        """Write one batch and fsync it (called from a worker thread)."""
+        self._fh.write("".join(lines))
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def seal(self) -> int:
+        """Close the active segment and start a new one. Returns the sealed seq."""
+        sealed = self.seq
+        self._fh.close()
+        self.seq += 1
+        self._fh = open(os.path.join(self.folder, f"journal-{self.seq:08d}.log"), "a", encoding="utf-8")
+        return sealed
+
+    def drop_through(self, seq: int):
+        for num, path in self._segments():
+            if num <= seq:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Could not remove journal segment {path}: {e}")
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+# ============== COLD-USER PAGER ==============
+
+class _Page:
+    """Where a paged-out user's last saved JSON sits in the page file. Set as
+    record._paged; records reach the pager through it."""
+    __slots__ = ("pager", "uid", "offset", "length")
+
+    def __init__(self, pager: "Pager", uid: str, offset: int, length: int):
+        self.pager = pager
+        self.uid = uid
+        self.offset = offset
+        self.length = length
+
+
+class Pager:
+    """Moves the heavy fields of cold users to a compressed local file.
+
+    A page is zlib(the user's full saved JSON). Paging out drops the record's
+    _paged_fields from memory and replaces its digest-cache entry with the
+    _Page, so saves read the page rather than the trimmed record. Paging in
+    restores both. The file
+    is a cache of state the backend already holds: it is truncated on start
+    and deleted on close.
+
+    Resident users are kept in LRU order by last get_user(). A user is paged
+    out once idle for idle_s, or earlier (after _PAGER_MIN_IDLE_S) when more
+    than `budget` users are resident."""
+
+    def __init__(self, folder: str, budget: int = STORAGE_RESIDENT_USERS,
+                 idle_s: int = STORAGE_PAGE_IDLE_S):
+        self.folder = folder
+        self.path = os.path.join(folder, "pages.bin")
+        self.budget = max(budget, 0)
+        self.idle_s = max(idle_s, _PAGER_MIN_IDLE_S)
+        self._fd: Optional[int] = None
+        # Saves read pages from a worker thread; compaction moves them.
+        self._io_lock = threading.Lock()
+        self._end = 0
+        self._live_bytes = 0
+        self._lru: "OrderedDict[str, float]" = OrderedDict()  # resident uid -> last access
+        self._pages: Dict[str, _Page] = {}                    # paged-out uid -> page
+        # Called as on_page_in(uid, page, frag) so storage can restore its cache
+        self.on_page_in = None
+        self.hits = 0
+        self.misses = 0
+        self.page_outs = 0
+
+    def open(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        self._end = 0
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def track(self, uids):
+        """Register already-resident users (at load) as just used."""
+        now = time.monotonic()
+        for uid in uids:
+            self._lru[uid] = now
+
+    def touch(self, uid: str, record):
+        """get_user() hook: page the record in if needed, mark it most recent."""
+        if record._paged is not None:
+            self.page_in(record)
+        else:
+            self.hits += 1
+        self._lru[uid] = time.monotonic()
+        self._lru.move_to_end(uid)
+
+    def cold(self, limit: int = _PAGER_BATCH) -> List[str]:
+        """Pop and return up to `limit` users due for paging out, coldest first."""
+        now = time.monotonic()
+        out = []
+        lru = self._lru
+        while lru and len(out) < limit:
+            uid, seen = next(iter(lru.items()))
+            idle = now - seen
+            if idle < self.idle_s and (len(lru) <= self.budget or idle < _PAGER_MIN_IDLE_S):
+                break
+            del lru[uid]
+            out.append(uid)
+        return out
+
+    def keep(self, uid: str):
+        """Put a user cold() returned back in the resident set (retry later)."""
+        self._lru[uid] = time.monotonic()
+
+    def _read(self, page: _Page) -> str:
+        with self._io_lock:
+            blob = os.pread(self._fd, page.length, page.offset)
+        return zlib.decompress(blob).decode("utf-8")
+
+    def read_frag(self, page: _Page) -> str:
+        return self._read(page)
+
+    def page_out(self, uid: str, record, frag: str) -> _Page:
+        """Write `frag` (the record's current JSON) and drop its heavy fields."""
+        blob = zlib.compress(frag.encode("utf-8"))
+        os.pwrite(self._fd, blob, self._end)
+        old = self._pages.get(uid)
+        if old is not None:
+            self._live_bytes -= old.length
+        page = self._pages[uid] = _Page(self, uid, self._end, len(blob))
+        self._end += len(blob)
+        self._live_bytes += len(blob)
+        extra = record._extra
+        for key in record._paged_fields:
+            extra.pop(key, None)
+        record._paged = page
+        self._lru.pop(uid, None)
+        self.page_outs += 1
+        return page
+
+    def _merged(self, record, frag: str) -> dict:
+        """The record's overflow dict with the paged fields put back, in the
+        key order of the saved JSON (so re-serializing it matches the cache)."""
+        doc = json.loads(frag)
+        paged = record._paged_fields
+        extra = record._extra
+        merged = {}
+        for key, value in doc.items():
+            if key in paged:
+                merged[sys.intern(key)] = value
+            elif key in extra:
+                merged[key] = extra[key]
+        for key, value in extra.items():
+            if key not in merged:
+                merged[key] = value
+        return merged
+
+    def peek(self, record) -> dict:
+        """Overflow fields of a paged record, read from disk, left on disk."""
+        return self._merged(record, self._read(record._paged))
+
+    def page_in(self, record):
+        page = record._paged
+        frag = self._read(page)
+        record._extra = self._merged(record, frag)
+        record._paged = None
+        if self._pages.get(page.uid) is page:
+            del self._pages[page.uid]
+            self._live_bytes -= page.length
+        self.misses += 1
+        # Paged in by a get_user() → touch() moves it to the hot end. Paged in
+        # by something scanning storage.data (stats, digests) → leave it coldest
+        # so the next pass pages it straight back out.
+        self._lru[page.uid] = 0.0
+        self._lru.move_to_end(page.uid, last=False)
+        if self.on_page_in is not None:
+            self.on_page_in(page.uid, page, frag)
+
+    def maybe_compact(self):
+        """Rewrite the page file without dead pages once it is mostly garbage."""
+        if self._end < _PAGER_COMPACT_BYTES or self._end < 2 * self._live_bytes:
+            return
+        tmp = self.path + ".tmp"
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        end = 0
+        offsets = []
+        try:
+            for page in self._pages.values():
+                os.pwrite(fd, os.pread(self._fd, page.length, page.offset), end)
+                offsets.append(end)
+                end += page.length
+            os.replace(tmp, self.path)
+        except OSError:
+            os.close(fd)
+            raise
+        with self._io_lock:
+            for page, offset in zip(self._pages.values(), offsets):
+                page.offset = offset
+            os.close(self._fd)
+            self._fd = fd
+        logger.info(f"Pager: compacted page file {self._end} → {end} bytes.")
+        self._end = end
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "resident": len(self._lru),
+            "paged": len(self._pages),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 1.0,
+            "page_outs": self.page_outs,
+            "file_bytes": self._end,
+        }
+
+
+def make_backend(kind: str = STORAGE_BACKEND, layout: str = STORAGE_LAYOUT,
+                 api_base: str = GITHUB_API_URL) -> Optional[StorageBackend]:
+    """Backend selected by config. None means in-memory only (no GitHub creds)."""
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if not (GITHUB_TOKEN and GITHUB_REPO):
+        return None
+    if layout == "sharded":
+        return GitHubShardedBackend(api_base)
+    return GitHubFileBackend(api_base)
+
+
+class Storage:
+    def __init__(self, backend: Optional[StorageBackend] = None):
         self.data: Dict[str, Any] = {
             "users": {},
             "groups": {},
             "notes": {},
             "reminders": [],
             "stats": {},
+            "schema_version": SCHEMA_VERSION,
         }
-        self.sha = None
+        self.backend = backend if backend is not None else make_backend()
         self._save_lock = asyncio.Lock()
-        # True only after a successful load() OR confirmed-404. False means we have no
-        # safe baseline — saving would risk wiping real data on GitHub.
+        # True only after a successful load() OR confirmed-empty baseline. False means
+        # we have no safe baseline — saving would risk wiping real data.
         self.loaded = False
         # When False, save() is a no-op (e.g. running locally without GitHub).
-        self.persistent = bool(GITHUB_TOKEN and GITHUB_REPO)
-        self.headers = {
-            "Authorization": f"token {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json",
-        }
-        self.api_url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_FILE_PATH}"
+        self.persistent = self.backend is not None
+        # Dirty tracking. Handlers mutate the dicts returned by get_user() /
+        # get_group() in place, so handing one out marks it dirty. Code that
+        # reaches into storage.data["users"] directly must call
+        # mark_user_dirty() / mark_group_dirty() itself.
+        self._dirty: Dict[str, set] = {name: set() for name in _RECORD_COLLECTIONS}
+        # A flush while a handler awaits consumes the mark its get_user() set,
+        # before the handler has written anything. So each task's handed-out
+        # ids are kept here too, and its save() marks them again.
+        self._handouts: "weakref.WeakKeyDictionary[asyncio.Task, Dict[str, set]]" = (
+            weakref.WeakKeyDictionary())
+        # hash() of each record's last-saved JSON (a _Page for paged-out users),
+        # and the last-saved JSON of each small collection. A save only
+        # re-serializes dirty records and compares them against their digest;
+        # a full JSON copy of every record would cost about half the heap.
+        self._digests: Dict[str, Dict[str, Any]] = {name: {} for name in _RECORD_COLLECTIONS}
+        self._top_frags: Dict[str, str] = {}
+        # Write-behind: save() sets _pending and the flusher task coalesces
+        # every save() inside one window into a single upload.
+        self.write_behind = STORAGE_WRITE_BEHIND
+        self.flush_window = max(STORAGE_FLUSH_WINDOW_MS, 0) / 1000
+        self._pending = False
+        self._flusher: Optional[asyncio.Task] = None
+        # Optional local write-ahead journal (STORAGE_JOURNAL_DIR). _jdirty is a
+        # second set of dirty marks consumed by journal ticks (a tick during a
+        # handler's await eats them like a flush does, so save() re-marks the
+        # task's handouts here as well); _jlast remembers the hash of each
+        # record's last journaled JSON (and its segment) so untouched reads
+        # are not re-journaled.
+        self.journal = Journal(STORAGE_JOURNAL_DIR) if (STORAGE_JOURNAL_DIR and self.persistent) else None
+        self.journal_interval = max(STORAGE_JOURNAL_FSYNC_MS, 10) / 1000
+        self._jdirty: Optional[Dict[str, set]] = (
+            {name: set() for name in _RECORD_COLLECTIONS} if self.journal else None)
+        self._jlast: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self._jtop: Dict[str, str] = {}
+        self._journal_lock = asyncio.Lock()
+        self._journaler: Optional[asyncio.Task] = None
+        # Optional cold-user pager (STORAGE_PAGER_DIR). It only works on compact
+        # records, and only pages out users whose state is already saved.
+        self.pager = (Pager(STORAGE_PAGER_DIR)
+                      if (STORAGE_PAGER_DIR and STORAGE_COMPACT_RECORDS and self.persistent) else None)
+        self._pager_task: Optional[asyncio.Task] = None
 
     async def load(self):
         if not self.persistent:
@@ -44,163 +1207,423 @@ class Storage:
             self.loaded = True
             return
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.api_url, headers=self.headers) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    self.sha = data.get("sha")
-                    content = base64.b64decode(data.get("content", "")).decode("utf-8")
-                    try:
-                        loaded_data = json.loads(content)
-                        if isinstance(loaded_data, dict):
-                            # Merge defaults so missing top-level keys are added
-                            for key, default in (("users", {}), ("groups", {}), ("notes", {}),
-                                                 ("reminders", []), ("stats", {})):
-                                loaded_data.setdefault(key, default)
-                            self.data = loaded_data
-                            self.loaded = True
-                            logger.info(f"Data loaded from GitHub: {len(self.data.get('users', {}))} users, "
-                                        f"{len(self.data.get('groups', {}))} groups.")
-                        else:
-                            logger.error("Loaded data is not a dict; refusing to overwrite.")
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Failed to parse JSON from GitHub: {e} — refusing to overwrite.")
-                elif resp.status == 404:
-                    logger.info("Data file not found on GitHub. Will create on first save.")
-                    # 404 is a SAFE baseline — file genuinely doesn't exist yet
-                    self.loaded = True
+        loaded_data = await self.backend.load()
+        if loaded_data is None:
+            return  # self.loaded stays False → save() will refuse
+        self._install(loaded_data)
+        replayed = 0
+        if self.journal is not None:
+            replayed = await asyncio.to_thread(self._replay_journal)
+            self.journal.open()
+            self._journaler = asyncio.create_task(self._journal_loop())
+        if self._migrate() or replayed:
+            await self.save()
+        if self.pager is not None:
+            self.pager.open()
+            self.pager.on_page_in = self._restore_frag
+            self.pager.track(uid for uid, user in self.data["users"].items()
+                             if isinstance(user, CompactRecord) and user.has_paged_data())
+            self._pager_task = asyncio.create_task(self._pager_loop())
+
+    def _install(self, loaded_data: dict):
+        # Merge defaults so missing top-level keys are added
+        for key, default in _DEFAULT_KEYS:
+            if key not in loaded_data:
+                loaded_data[key] = default()
+        for name in _RECORD_COLLECTIONS:
+            records = loaded_data[name]
+            for rid, record in records.items():
+                records[rid] = _compact(name, record)
+        self.data = loaded_data
+        self._reset_tracking()
+        if self.backend.loaded_digests is not None:
+            for name in _RECORD_COLLECTIONS:
+                self._digests[name] = self.backend.loaded_digests.get(name, {})
+            self._top_frags = {k: _dumps(v) for k, v in self.data.items() if k not in _RECORD_COLLECTIONS}
+            self.backend.loaded_digests = None
+        elif self.backend.needs_primed_cache and any(self.data[name] for name in _RECORD_COLLECTIONS):
+            # The backend decides what to rewrite by diffing digests, so the
+            # cache must reflect what is already stored.
+            for name in _RECORD_COLLECTIONS:
+                self._digests[name] = {rid: hash(_dumps(rec)) for rid, rec in self.data[name].items()}
+            self._top_frags = {k: _dumps(v) for k, v in self.data.items() if k not in _RECORD_COLLECTIONS}
+        self.loaded = True
+        logger.info(f"Data loaded via {self.backend.name}: {len(self.data.get('users', {}))} users, "
+                    f"{len(self.data.get('groups', {}))} groups.")
+
+    def _migrate(self) -> bool:
+        """Upgrade every record to SCHEMA_VERSION once. Returns True if it did
+        (the bumped schema_version itself needs saving)."""
+        version = int(self.data.get("schema_version", 0) or 0)
+        if version >= SCHEMA_VERSION:
+            return False
+        changed = 0
+        for name in _RECORD_COLLECTIONS:
+            for rid, record in self.data[name].items():
+                if isinstance(record, Mapping) and migrate_record(name, record, version):
+                    self._dirty[name].add(rid)
+                    changed += 1
+        self.data["schema_version"] = SCHEMA_VERSION
+        logger.info(f"Schema migrated v{version} → v{SCHEMA_VERSION}: {changed} record(s) upgraded.")
+        return True
+
+    # ============== JOURNAL ==============
+
+    def _replay_journal(self) -> int:
+        replayed = 0
+        for entry in self.journal.replay():
+            if "k" in entry:
+                self.data[entry["k"]] = entry["v"]
+            elif entry.get("c") in _RECORD_COLLECTIONS:
+                records = self.data[entry["c"]]
+                if entry.get("d"):
+                    records.pop(entry["id"], None)
                 else:
-                    logger.error(f"Failed to load data from GitHub: {resp.status} {await resp.text()}")
-                    # self.loaded stays False → save() will refuse
+                    record = records[entry["id"]] = _compact(entry["c"], entry["v"])
+                    # May predate a schema bump; steps are idempotent.
+                    migrate_record(entry["c"], record)
+                # Not on the backend yet → the next save must include it
+                self._dirty[entry["c"]].add(entry["id"])
+            replayed += 1
+        self._jtop = {k: _dumps(v) for k, v in self.data.items() if k not in _RECORD_COLLECTIONS}
+        if replayed:
+            logger.info(f"Replayed {replayed} journal entries on top of {self.backend.name} data.")
+        return replayed
 
-    async def _put(self, session, payload):
-        async with session.put(self.api_url, headers=self.headers, json=payload) as resp:
-            return resp.status, await resp.json() if resp.content_type == "application/json" else await resp.text()
+    def _journal_lines(self) -> List[str]:
+        lines = []
+        seq = self.journal.seq
+        for name in _RECORD_COLLECTIONS:
+            rids, self._jdirty[name] = self._jdirty[name], set()
+            records = self.data.get(name, {})
+            cache = self._digests[name]
+            for rid in rids:
+                key = (name, rid)
+                if rid not in records:
+                    if key in self._jlast or rid in cache:
+                        lines.append(f'{{"c":{_dumps(name)},"id":{_dumps(rid)},"d":1}}\n')
+                        self._jlast.pop(key, None)
+                    continue
+                frag = _dumps(records[rid])
+                h = hash(frag)
+                last = self._jlast.get(key)
+                if (last[0] == h) if last else (cache.get(rid) == h):
+                    continue
+                self._jlast[key] = (h, seq)
+                lines.append(_record_line(name, rid, frag))
+        for key, value in self.data.items():
+            if key in _RECORD_COLLECTIONS:
+                continue
+            frag = _dumps(value)
+            if self._jtop.get(key) != frag:
+                self._jtop[key] = frag
+                lines.append(_top_line(key, frag))
+        return lines
+
+    async def _journal_tick(self):
+        async with self._journal_lock:
+            lines = self._journal_lines()
+            if lines:
+                await asyncio.to_thread(self.journal.append, lines)
+
+    async def _journal_loop(self):
+        while True:
+            await asyncio.sleep(self.journal_interval)
+            try:
+                await self._journal_tick()
+            except Exception as e:
+                logger.error(f"Journal write failed: {e}")
+
+    async def _journal_seal(self) -> int:
+        """Journal everything up to now and seal the segment before a save."""
+        await self._journal_tick()
+        async with self._journal_lock:
+            return self.journal.seal()
+
+    def _journal_drop(self, sealed: int):
+        self.journal.drop_through(sealed)
+        self._jlast = {k: v for k, v in self._jlast.items() if v[1] > sealed}
+
+    # ============== PAGER ==============
+
+    def _page_out_cold(self) -> Tuple[int, int]:
+        """Page out one slice of the users the pager considers cold.
+        Returns (looked at, paged out)."""
+        pager = self.pager
+        users = self.data["users"]
+        cache = self._digests["users"]
+        dirty = self._dirty["users"]
+        jdirty = self._jdirty["users"] if self._jdirty is not None else ()
+        paged = 0
+        if self._save_lock.locked():
+            # A save may be serializing resident users in a worker thread
+            return 0, 0
+        cold = pager.cold()
+        for uid in cold:
+            user = users.get(uid)
+            if not isinstance(user, CompactRecord) or user._paged is not None or not user.has_paged_data():
+                continue
+            digest = cache.get(uid)
+            if uid in dirty or uid in jdirty or type(digest) is not int:
+                # Not saved yet — the page must never be newer than the backend.
+                pager.keep(uid)
+                continue
+            frag = _dumps(user)
+            if hash(frag) != digest:
+                # Changed after its dirty mark was consumed: get it saved first.
+                self.mark_user_dirty(uid)
+                pager.keep(uid)
+                continue
+            cache[uid] = pager.page_out(uid, user, frag)
+            paged += 1
+        return len(cold), paged
+
+    async def _pager_loop(self):
+        while True:
+            await asyncio.sleep(_PAGER_INTERVAL)
+            try:
+                paged = 0
+                while True:
+                    looked, done = self._page_out_cold()
+                    paged += done
+                    if looked < _PAGER_BATCH:
+                        break
+                    await asyncio.sleep(0)
+                if not self._save_lock.locked():
+                    self.pager.maybe_compact()
+                if paged:
+                    logger.info(f"Pager: paged out {paged} cold user(s); {self.pager.stats()}")
+            except Exception as e:
+                logger.error(f"Pager pass failed: {e}")
+
+    def _restore_frag(self, uid: str, page: _Page, frag: str):
+        cache = self._digests["users"]
+        if cache.get(uid) is page:
+            cache[uid] = hash(frag)
+
+    def _saved_digest(self, collection: str, rid: str) -> Optional[int]:
+        digest = self._digests[collection].get(rid)
+        if digest is not None and type(digest) is not int:
+            return hash(self.pager.read_frag(digest))
+        return digest
+
+    def _render_saved(self, collection: str, rid: str, record) -> str:
+        """JSON of a record unchanged since its last save (worker thread)."""
+        digest = self._digests[collection].get(rid)
+        if digest is not None and type(digest) is not int:
+            return self.pager.read_frag(digest)
+        return _dumps(record)
+
+    # ============== DIRTY TRACKING ==============
+
+    def _reset_tracking(self):
+        for name in _RECORD_COLLECTIONS:
+            self._dirty[name].clear()
+            self._digests[name] = {}
+        self._top_frags = {}
+
+    def mark_user_dirty(self, user_id):
+        self._dirty["users"].add(str(user_id))
+        if self._jdirty is not None:
+            self._jdirty["users"].add(str(user_id))
+
+    def mark_group_dirty(self, chat_id):
+        self._dirty["groups"].add(str(chat_id))
+        if self._jdirty is not None:
+            self._jdirty["groups"].add(str(chat_id))
+
+    def _hand_out(self, name: str, rid: str):
+        self._dirty[name].add(rid)
+        if self._jdirty is not None:
+            self._jdirty[name].add(rid)
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:  # no running loop (scripts, tools)
+            return
+        if task is None:
+            return
+        handed = self._handouts.get(task)
+        if handed is None:
+            handed = self._handouts[task] = {n: set() for n in _RECORD_COLLECTIONS}
+        ids = handed[name]
+        if len(ids) >= _HANDOUT_CAP:
+            ids.clear()
+        ids.add(rid)
+
+    def _remark_handouts(self):
+        """Mark again everything the calling task was handed since its last
+        save(), so the save covers changes made after a flush in between."""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            return
+        handed = self._handouts.pop(task, None) if task is not None else None
+        if not handed:
+            return
+        for name, rids in handed.items():
+            self._dirty[name] |= rids
+            if self._jdirty is not None:
+                self._jdirty[name] |= rids
+
+    def _collect(self) -> _Changes:
+        """Re-serialize dirty records and diff them against the last save."""
+        changes = _Changes()
+        for key, value in self.data.items():
+            if key in _RECORD_COLLECTIONS and isinstance(value, dict):
+                cache = self._digests[key]
+                taken = changes.taken[key] = self._dirty[key]
+                self._dirty[key] = set()
+                fresh = {}
+                for rid in taken:
+                    if rid in value:
+                        frag = _dumps(value[rid])
+                        if self._saved_digest(key, rid) != hash(frag):
+                            fresh[rid] = frag
+                new = 0
+                for rid in value:
+                    if rid not in cache:
+                        new += 1
+                        if rid not in fresh:
+                            fresh[rid] = _dumps(value[rid])
+                removed = set()
+                if len(cache) + new != len(value):
+                    removed = {rid for rid in cache if rid not in value}
+                changes.fresh[key] = fresh
+                changes.removed[key] = removed
+            else:
+                changes.top[key] = _dumps(value)
+        changes.top_changed = changes.top != self._top_frags
+        return changes
+
+    def _commit(self, changes: _Changes):
+        for key, fresh in changes.fresh.items():
+            cache = self._digests[key]
+            cache.update((rid, hash(frag)) for rid, frag in fresh.items())
+            for rid in changes.removed.get(key, ()):
+                cache.pop(rid, None)
+            if self.pager is not None and key == "users":
+                # A paged-out user saved without being paged in (e.g. a digest
+                # flag): keep its cache entry on disk too.
+                records = self.data[key]
+                for rid, frag in fresh.items():
+                    record = records.get(rid)
+                    if isinstance(record, CompactRecord) and record._paged is not None:
+                        cache[rid] = self.pager.page_out(rid, record, frag)
+        self._top_frags = changes.top
+
+    def _rollback(self, changes: _Changes):
+        for key, rids in changes.taken.items():
+            self._dirty[key] |= rids
+
+    # ============== SAVE ==============
 
     async def save(self):
+        """Request a save. In write-behind mode this returns immediately and the
+        upload happens within flush_window; use flush() when the caller must
+        know the state is durable (payments)."""
         if not self.persistent:
             return
+        self._remark_handouts()
+        if not self.write_behind:
+            await self.flush()
+            return
+        self._pending = True
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_window)
+            self._pending = False
+            try:
+                await self.flush()
+            except Exception as e:
+                # Dirty marks were rolled back; the next save() retries them.
+                logger.error(f"Background flush failed: {e}")
+
+    async def close(self):
+        """Stop the flusher and force out anything still pending (shutdown)."""
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        self._pending = False
+        if self._pager_task is not None:
+            self._pager_task.cancel()
+            try:
+                await self._pager_task
+            except asyncio.CancelledError:
+                pass
+        if self._journaler is not None:
+            self._journaler.cancel()
+            try:
+                await self._journaler
+            except asyncio.CancelledError:
+                pass
+            # Whatever the final flush can't upload must survive in the journal.
+            await self._journal_tick()
+        await self.flush()
+        if self.journal is not None:
+            self.journal.close()
+        if self.pager is not None:
+            self.pager.close()
+        if self.backend is not None:
+            await self.backend.close()
+
+    async def flush(self):
+        """Write now and wait for it. Coalesces with any pending write-behind save."""
+        if not self.persistent:
+            return
+        self._remark_handouts()
+        self._pending = False
         if not self.loaded:
-            # CRITICAL safety: never overwrite GitHub data we never managed to read.
+            # CRITICAL safety: never overwrite data we never managed to read.
             # Otherwise a transient 5xx during startup would wipe production data.
             logger.error("Refusing to save: storage was never loaded successfully.")
             return
 
         async with self._save_lock:
-            content_str = json.dumps(self.data, indent=2, ensure_ascii=False)
-            content_b64 = base64.b64encode(content_str.encode("utf-8")).decode("utf-8")
-
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
-                for attempt in (1, 2):
-                    payload = {"message": "Update bot data", "content": content_b64}
-                    if self.sha:
-                        payload["sha"] = self.sha
+            sealed = await self._journal_seal() if self._journaler is not None else None
+            changes = self._collect()
+            if not changes.changed:
+                # Every dirty mark was a read-only get_user() — nothing to write.
+                self._commit(changes)
+                if sealed is not None:
+                    self._journal_drop(sealed)
+                logger.debug("Save skipped: no changes since last save.")
+                return
 
-                    try:
-                        status, body = await self._put(session, payload)
-                    except aiohttp.ClientError as e:
-                        logger.error(f"Save network error (attempt {attempt}): {e}")
-                        await asyncio.sleep(1)
-                        continue
-
-                    if status in (200, 201):
-                        if isinstance(body, dict):
-                            self.sha = body.get("content", {}).get("sha")
-                        logger.info("Data saved to GitHub.")
-                        return
-
-                    # Conflict (stale sha) — refresh sha and retry once
-                    if status == 409 and attempt == 1:
-                        logger.warning("Save 409 (stale sha). Refreshing and retrying.")
-                        try:
-                            async with session.get(self.api_url, headers=self.headers) as resp:
-                                if resp.status == 200:
-                                    data = await resp.json()
-                                    self.sha = data.get("sha")
-                                    continue
-                        except aiohttp.ClientError as e:
-                            logger.error(f"SHA refresh failed: {e}")
-                        return
-
-                    logger.error(f"Failed to save data to GitHub (attempt {attempt}): {status} {body}")
-                    if attempt == 1:
-                        await asyncio.sleep(0.5)
-                        continue
-                    return
+            snap = _Snapshot(self.data, changes, self._render_saved)
+            saved = False
+            try:
+                saved = await self.backend.write(snap)
+            finally:
+                if saved:
+                    self._commit(changes)
+                    if sealed is not None:
+                        self._journal_drop(sealed)
+                else:
+                    self._rollback(changes)
 
     def get_user(self, user_id: int) -> dict:
         uid = str(user_id)
-        if uid not in self.data["users"]:
-            self.data["users"][uid] = {
-                "id": user_id,
-                "ai_provider": "gemini",
-                "api_keys": {},
-                "vip": False,                # legacy boolean — kept for back-compat
-                "tier": "free",              # "free" | "plus" | "pro"
-                "tier_expires": None,        # epoch seconds; None = forever or free
-                "image_credits": 0,
-                "image_credits_reset": 0,    # epoch seconds when monthly bucket refills
-                "memory": {},
-                "notes": [],
-                "chat_history": [],
-                "stats": {"msgs": 0, "commands": 0},
-                "referrals": 0,
-                "xp_by_week": {},
-                "xp_by_day": {},
-                "last_seen_level": 0,
-                "first_paid": False,
-                "digest_enabled": False,
-                "digest_time": "08:00",
-                "timezone": "UTC",
-                "last_digest_date": "",
-            }
-        else:
-            u = self.data["users"][uid]
-            u.setdefault("chat_history", [])
-            u.setdefault("memory", {})
-            u.setdefault("notes", [])
-            u.setdefault("api_keys", {})
-            u.setdefault("stats", {"msgs": 0, "commands": 0})
-            u.setdefault("referrals", 0)
-            u.setdefault("xp_by_week", {})
-            u.setdefault("xp_by_day", {})
-            u.setdefault("last_seen_level", 0)
-            u.setdefault("tier", "pro" if u.get("vip") else "free")
-            u.setdefault("tier_expires", u.get("vip_expires"))
-            u.setdefault("image_credits", 0)
-            u.setdefault("image_credits_reset", 0)
-            u.setdefault("first_paid", False)
-            u.setdefault("digest_enabled", False)
-            u.setdefault("digest_time", "08:00")
-            u.setdefault("timezone", "UTC")
-            u.setdefault("last_digest_date", "")
-        return self.data["users"][uid]
+        self._hand_out("users", uid)
+        user = self.data["users"].get(uid)
+        if user is None:
+            user = self.data["users"][uid] = _compact("users", _new_user(user_id))
+        if self.pager is not None:
+            self.pager.touch(uid, user)
+        return user
 
     def get_group(self, chat_id: int) -> dict:
         cid = str(chat_id)
-        if cid not in self.data["groups"]:
-            self.data["groups"][cid] = {
-                "id": chat_id,
-                "vip": False,
-                "welcome_enabled": False,
-                "welcome_msg": "",
-                "goodbye_enabled": False,
-                "goodbye_msg": "",
-                "rules": "",
-                "warns": {},
-                "ai_enabled": True,
-                "antilink": False,
-                "antispam": False,
-                "stats": {"msgs": 0, "users": {}},
-                "memory": {},
-                "messages": [],
-            }
-        else:
-            g = self.data["groups"][cid]
-            g.setdefault("messages", [])
-            g.setdefault("warns", {})
-            g.setdefault("stats", {"msgs": 0, "users": {}})
-        return self.data["groups"][cid]
+        self._hand_out("groups", cid)
+        group = self.data["groups"].get(cid)
+        if group is None:
+            group = self.data["groups"][cid] = _compact("groups", _new_group(chat_id))
+        return group
 
 
 storage = Storage()
@@ -2,8 +2,8 @@ import logging
 import os
 from dotenv import load_dotenv
 from telegram.ext import (ApplicationBuilder, CommandHandler, MessageHandler,
-                          CallbackQueryHandler, InlineQueryHandler, PreCheckoutQueryHandler,
-                          filters)
+                          CallbackQueryHandler, ChatMemberHandler, InlineQueryHandler,
+                          PreCheckoutQueryHandler, filters)
 
 load_dotenv()
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -17,7 +17,8 @@ def main():
 
     from bot import handlers
 
-    application = ApplicationBuilder().token(BOT_TOKEN).post_init(post_init).build()
+    application = (ApplicationBuilder().token(BOT_TOKEN)
+                   .post_init(post_init).post_shutdown(post_shutdown).build())
 
     # ============== Commands ==============
     base = [
@@ -38,6 +39,7 @@ def main():
     ai_mem = [
         ("setprovider", handlers.setprovider_command), ("setkey", handlers.setkey_command),
         ("setmodel", handlers.setmodel_command), ("ai", handlers.ai_command),
+        ("failover", handlers.failover_command),
         ("clear", handlers.clear_command),
         ("memorysave", handlers.memorysave_command), ("memoryget", handlers.memoryget_command),
         ("memorylist", handlers.memorylist_command), ("memorydel", handlers.memorydel_command),
@@ -124,6 +126,9 @@ def main():
         group=-1,
     )
 
+    # Users blocking / unblocking the bot (broadcasts skip blocked users)
+    application.add_handler(ChatMemberHandler(handlers.my_chat_member_handler, ChatMemberHandler.MY_CHAT_MEMBER))
+
     # Inline mode: @bot <query> in any chat
     from bot.handlers.inline import inline_query_handler, inline_generate_callback
     application.add_handler(InlineQueryHandler(inline_query_handler))
@@ -150,10 +155,15 @@ async def post_init(application):
     from bot.storage import storage
     from bot.scheduler import start_scheduler
     from bot.server import start_webhook_server
+    from bot.loopmon import loop_monitor
 
+    loop_monitor.start()
     logger.info("Initializing storage and scheduler...")
     await storage.load()
     start_scheduler(application.bot)
+    # Broadcasts a previous run left unfinished continue where they stopped
+    from bot.broadcast import broadcasts
+    broadcasts.resume_all(application.bot)
     # Spin up the HTTP server (NOWPayments webhook + Mini App)
     try:
         await start_webhook_server(application)
@@ -163,6 +173,27 @@ async def post_init(application):
     logger.info("Bot is ready!")
 
 
+async def post_shutdown(application):
+    from bot.storage import storage
+    from bot.loopmon import loop_monitor
+    from bot.http_clients import http_clients
+
+    await loop_monitor.stop()
+
+    # Running broadcasts: let in-flight sends land and checkpoint them for the next start
+    from bot.broadcast import broadcasts
+    await broadcasts.shutdown()
+
+    # Write-behind storage may still hold un-uploaded changes — push them out.
+    try:
+        await storage.close()
+    except Exception as e:
+        logger.error(f"Final storage flush failed: {e}")
+    # Pooled outbound connections (the final flush above still needed them) —
+    # close them so aiohttp doesn't warn about unclosed sessions on exit.
+    await http_clients.close()
+
+
 async def _set_bot_commands(application):
     """Register a clean BotCommand list so users see them in Telegram's UI."""
     from telegram import BotCommand, BotCommandScopeAllGroupChats, BotCommandScopeAllPrivateChats
@@ -174,6 +205,7 @@ async def _set_bot_commands(application):
         BotCommand("setprovider", "Choose AI provider"),
         BotCommand("setkey", "Set API key"),
         BotCommand("setmodel", "Pick model"),
+        BotCommand("failover", "Backup AI providers"),
         BotCommand("note", "Create a note"),
         BotCommand("notes", "List notes"),
         BotCommand("todo", "Tasks"),
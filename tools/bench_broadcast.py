@@ -0,0 +1,154 @@
+"""Broadcast throughput: the old one-at-a-time loop vs bot/broadcast.py jobs,
+plus a crash in the middle of a job and its resume.
+
+    python tools/bench_broadcast.py                        # 1500 users, 30 msg/s, 50 ms RTT
+    python tools/bench_broadcast.py --users 10000 --rate 30
+    python tools/bench_broadcast.py --rate 300             # limit raised (paid broadcasts)
+
+Runs against tools/fake_bot_api.py in-process through a real python-telegram-bot
+Bot, with storage in memory. The fake answers 429 past --rate messages a second
+(and 1/s per chat) and 403 for --blocked-pct of the users. "before" replays the
+old broadcast_command loop (send, sleep 50 ms) on --sample users and
+extrapolates; "after" is BroadcastEngine over the outbox. The crash run
+snapshots the job as a save would see it, kills it (queued sends vanish, in-flight
+ones land), restores the snapshot and resumes.
+"""
+import argparse
+import asyncio
+import copy
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop("GITHUB_TOKEN", None)   # in-memory storage
+
+
+def _parse_args():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=1500)
+    ap.add_argument("--rate", type=float, default=30, help="Bot API limit, messages per second")
+    ap.add_argument("--latency-ms", type=float, default=50, help="round trip of every call")
+    ap.add_argument("--blocked-pct", type=float, default=3)
+    ap.add_argument("--sample", type=int, default=200, help="users for the old loop")
+    ap.add_argument("--port", type=int, default=8082)
+    return ap.parse_args()
+
+
+ARGS = _parse_args()
+os.environ["TG_GLOBAL_RATE"] = str(int(ARGS.rate))
+
+from telegram import Bot  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+from bot import outbox as outbox_module  # noqa: E402
+from bot.broadcast import BroadcastEngine, broadcasts  # noqa: E402
+from bot.storage import storage  # noqa: E402
+from fake_bot_api import FakeBotAPI, start  # noqa: E402
+
+PROGRESS_CHAT = 999_999_999
+TEXT = "📢 <b>Объявление:</b>\n\nbench"
+
+
+async def _old_loop(bot: Bot, users):
+    """broadcast_command before the job engine."""
+    success = failed = 0
+    for uid in users:
+        try:
+            await bot.send_message(chat_id=uid, text=TEXT, parse_mode="HTML")
+            success += 1
+        except Exception:
+            failed += 1
+        await asyncio.sleep(0.05)
+    return success, failed
+
+
+async def _wait_idle(engine: BroadcastEngine):
+    while engine._runs:
+        await asyncio.sleep(0.05)
+
+
+async def _drain_outbox():
+    box = outbox_module.outbox
+    while box._in_flight:
+        await asyncio.sleep(0.01)
+
+
+async def main():
+    logging.disable(logging.CRITICAL)
+    api = FakeBotAPI(rate=ARGS.rate, latency_ms=ARGS.latency_ms)
+    runner = await start(api, ARGS.port)
+    bot = Bot("1:bench", base_url=f"http://127.0.0.1:{ARGS.port}/bot",
+              request=HTTPXRequest(connection_pool_size=128))
+    await bot.initialize()
+    await storage.load()
+
+    rng = random.Random(5)
+    users = list(range(1, ARGS.users + 1))
+    for uid in users:
+        storage.get_user(uid)
+    api.blocked = set(rng.sample(users, int(len(users) * ARGS.blocked_pct / 100)))
+    print(f"users={len(users):,} blocked={len(api.blocked)} rate={ARGS.rate:g}/s latency={ARGS.latency_ms:g} ms")
+
+    try:
+        # before: one at a time, on other chat ids so nothing collides with the runs below
+        sample = [10 ** 8 + uid for uid in users[:ARGS.sample]]
+        t0 = time.monotonic()
+        ok, bad = await _old_loop(bot, sample)
+        old = (time.monotonic() - t0) / len(sample)
+        print(f"before  {len(sample)} sent in {old * len(sample):.1f}s → {1 / old:.1f} msg/s; "
+              f"{len(users):,} users ≈ {old * len(users):.0f}s, 10k ≈ {old * 10_000 / 60:.1f} min")
+
+        # after
+        api.reset()
+        t0 = time.monotonic()
+        job = broadcasts.start(bot, TEXT, progress_chat_id=PROGRESS_CHAT, progress_message_id=1)
+        await _wait_idle(broadcasts)
+        took = time.monotonic() - t0
+        counts = job["counts"]
+        marked = sum(1 for uid in users if storage.get_user(uid).get("blocked_bot"))
+        st = api.stats()
+        print(f"after   {counts['sent']} sent, {counts['blocked']} blocked, {counts['failed']} failed "
+              f"in {took:.1f}s → {len(users) / took:.1f} msg/s; 10k ≈ {10_000 / (len(users) / took) / 60:.1f} min")
+        print(f"        429s={st['429']} duplicates={st['duplicates']} progress edits={sum(api.edits.values())} "
+              f"blocked marked={marked}/{len(api.blocked)}")
+
+        # crash at ~40% and resume
+        api.reset()
+        job = broadcasts.start(bot, TEXT, progress_chat_id=PROGRESS_CHAT, progress_message_id=1)
+        run = broadcasts._runs[job["id"]]
+        print(f"resume  recipients={len(run.recipients):,} (blocked users skipped)")
+        while run.done < len(run.recipients) * 0.4:
+            await asyncio.sleep(0.05)
+        saved = copy.deepcopy(job)  # what a save between two checkpoints stores
+        await asyncio.sleep(0.5)    # sends the saved state won't know about
+        for queue in outbox_module.outbox._queues:
+            queue.clear()           # the process dies: queued sends vanish...
+        run.task.cancel()
+        for task in asyncio.all_tasks():
+            if task.get_coro().__qualname__ == "BroadcastEngine._send":
+                task.cancel()
+        await _drain_outbox()       # ...the ones already on the wire land
+        await _wait_idle(broadcasts)
+        before_crash = sum(api.delivered.values())
+
+        storage.data["broadcasts"][job["id"]] = saved
+        unknown = set(saved["in_flight"])
+        t0 = time.monotonic()
+        broadcasts.resume_all(bot)
+        await _wait_idle(broadcasts)
+        counts = saved["counts"]
+        st = api.stats()
+        missing = sum(1 for uid in users if uid not in api.blocked and uid not in unknown and not api.delivered[uid])
+        print(f"        crash after {before_crash} sends; resumed in {time.monotonic() - t0:.1f}s: "
+              f"sent={counts['sent']} unknown(?)={counts['unknown']} duplicates={st['duplicates']} "
+              f"skipped (not unknown)={missing}")
+    finally:
+        await bot.shutdown()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
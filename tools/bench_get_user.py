@@ -0,0 +1,103 @@
+"""Micro-benchmark: per-call cost of Storage.get_user() before/after the
+load-time schema migration, on a synthetic dataset.
+
+    python tools/bench_get_user.py            # 50k users, 500k lookups
+    python tools/bench_get_user.py --users 10000 --calls 100000
+
+"before" replays the old get_user() (18 setdefault calls per lookup) against
+the same data; "after" is the current Storage.get_user(). Users are generated
+in the pre-migration shape (only a few fields) so the migration has work to do.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.storage import Storage, StorageBackend  # noqa: E402
+
+
+def _legacy_get_user(data: dict, user_id: int) -> dict:
+    """get_user() as it was before schema_version (existing-user path)."""
+    uid = str(user_id)
+    u = data["users"][uid]
+    u.setdefault("chat_history", [])
+    u.setdefault("memory", {})
+    u.setdefault("notes", [])
+    u.setdefault("api_keys", {})
+    u.setdefault("stats", {"msgs": 0, "commands": 0})
+    u.setdefault("referrals", 0)
+    u.setdefault("xp_by_week", {})
+    u.setdefault("xp_by_day", {})
+    u.setdefault("last_seen_level", 0)
+    u.setdefault("tier", "pro" if u.get("vip") else "free")
+    u.setdefault("tier_expires", u.get("vip_expires"))
+    u.setdefault("image_credits", 0)
+    u.setdefault("image_credits_reset", 0)
+    u.setdefault("first_paid", False)
+    u.setdefault("digest_enabled", False)
+    u.setdefault("digest_time", "08:00")
+    u.setdefault("timezone", "UTC")
+    u.setdefault("last_digest_date", "")
+    return u
+
+
+class _SyntheticBackend(StorageBackend):
+    name = "synthetic"
+
+    def __init__(self, users: int):
+        super().__init__()
+        self.users = users
+
+    async def load(self):
+        return {"users": {str(i): {"id": i, "language": "en", "vip": i % 50 == 0}
+                          for i in range(self.users)}}
+
+    async def write(self, snap):
+        return True
+
+
+def _time(fn, ids) -> float:
+    start = time.perf_counter()
+    for i in ids:
+        fn(i)
+    return time.perf_counter() - start
+
+
+async def _main(users: int, calls: int):
+    storage = Storage(_SyntheticBackend(users))
+    storage.write_behind = False
+
+    t0 = time.perf_counter()
+    await storage.load()
+    migrate_s = time.perf_counter() - t0
+
+    rng = random.Random(42)
+    ids = [rng.randrange(users) for _ in range(calls)]
+    data = storage.data
+    # Warm-up, then measure each variant against the same (migrated) records.
+    _time(lambda i: _legacy_get_user(data, i), ids[:1000])
+    _time(storage.get_user, ids[:1000])
+    before = _time(lambda i: _legacy_get_user(data, i), ids)
+    after = _time(storage.get_user, ids)
+
+    print(f"users={users:,} lookups={calls:,}")
+    print(f"load + one-time migration:  {migrate_s * 1000:8.1f} ms  (includes synthesizing + first save)")
+    print(f"before (setdefault x18):    {before / calls * 1e9:8.0f} ns/call")
+    print(f"after  (lookup):            {after / calls * 1e9:8.0f} ns/call")
+    print(f"speed-up:                   {before / after:8.1f}x")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=50_000)
+    ap.add_argument("--calls", type=int, default=500_000)
+    args = ap.parse_args()
+    asyncio.run(_main(args.users, args.calls))
+
+
+if __name__ == "__main__":
+    main()
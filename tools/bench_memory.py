@@ -0,0 +1,125 @@
+"""Memory benchmark: resident bytes per user for plain dicts vs compact records,
+and the whole process once Storage has loaded them.
+
+    python tools/bench_memory.py                      # 10k, 100k, 1M users
+    python tools/bench_memory.py --sizes 10000 100000 --storage-sizes 10000
+
+Users are parsed one JSON document at a time (like shard/SQLite/journal loads,
+where json.loads cannot share key strings between records) and held in the
+same {uid: record} layout storage uses. Measured with tracemalloc, so the
+numbers are Python-heap bytes attributable to the user table.
+
+The storage table loads the same users through Storage + SQLiteBackend in a
+fresh process and reports its RSS (VmRSS) before and after load, which
+includes Storage's per-record digest cache; "JSON copy" is what keeping every
+record's saved JSON instead would add on top.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.records import UserRecord  # noqa: E402
+from bot.storage import SQLiteBackend, Storage, _dumps, _new_user  # noqa: E402
+
+
+def _synthetic_user_json(i: int, rng: random.Random) -> str:
+    u = _new_user(i)
+    u["language"] = rng.choice(("en", "en", "ru", "it"))
+    u["username"] = f"user{i}"
+    u["first_name"] = f"Name{i % 997}"
+    u["stats"] = {"msgs": rng.randrange(200), "commands": rng.randrange(50)}
+    if rng.random() < 0.3:
+        u["daily_streak"] = rng.randrange(1, 30)
+        u["daily_last"] = "2026-10-16"
+        u["xp_by_day"] = {"2026-10-16": rng.randrange(100)}
+        u["xp_by_week"] = {"2026-W42": rng.randrange(500)}
+    if rng.random() < 0.1:
+        u["api_keys"] = {"groq": "gsk_" + "x" * 40}
+        u["ai_provider"] = "groq"
+    return json.dumps(u)
+
+
+def _measure(n: int, compact: bool) -> int:
+    rng = random.Random(7)
+    docs = [_synthetic_user_json(i, rng) for i in range(n)]
+    gc.collect()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    users = {}
+    for i, doc in enumerate(docs):
+        record = json.loads(doc)
+        users[str(i)] = UserRecord(record) if compact else record
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del users, docs
+    gc.collect()
+    return used - base
+
+
+def _rss() -> int:
+    """Resident set size of this process, bytes (Linux)."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _write_db(path: str, n: int):
+    rng = random.Random(7)
+    users = {str(i): json.loads(_synthetic_user_json(i, rng)) for i in range(n)}
+    asyncio.run(SQLiteBackend(path).import_all({"users": users}))
+
+
+def _measure_storage(path: str) -> tuple:
+    """(RSS before load, RSS after load, digest cache bytes, JSON copy bytes)
+    — run in a fresh process so earlier allocations don't skew RSS."""
+    gc.collect()
+    before = _rss()
+    storage = Storage(SQLiteBackend(path))
+    asyncio.run(storage.load())
+    gc.collect()
+    after = _rss()
+    digests = storage._digests["users"]
+    cache = sys.getsizeof(digests) + sum(sys.getsizeof(d) for d in digests.values())
+    copy = sum(sys.getsizeof(_dumps(u)) for u in storage.data["users"].values())
+    asyncio.run(storage.backend.close())
+    return before, after, cache, copy
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--storage-sizes", type=int, nargs="*", default=[10_000, 100_000])
+    args = ap.parse_args()
+    print(f"{'users':>10} {'dict B/user':>12} {'compact B/user':>15} {'saved':>7}")
+    for n in args.sizes:
+        plain = _measure(n, compact=False) / n
+        compact = _measure(n, compact=True) / n
+        print(f"{n:>10,} {plain:>12,.0f} {compact:>15,.0f} {1 - compact / plain:>7.0%}")
+    if not args.storage_sizes:
+        return
+    mb = 1024 * 1024
+    print(f"\n{'users':>10} {'RSS before':>11} {'RSS loaded':>11} {'digests':>9} {'JSON copy':>10}")
+    ctx = multiprocessing.get_context("spawn")
+    for n in args.storage_sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "bench.sqlite3")
+            _write_db(path, n)
+            with ctx.Pool(1) as pool:
+                before, after, cache, copy = pool.apply(_measure_storage, (path,))
+        print(f"{n:>10,} {before / mb:>10.1f}M {after / mb:>10.1f}M {cache / mb:>8.1f}M {copy / mb:>9.1f}M")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Event-loop stall during Storage saves: rendering on the loop vs in a thread.
+
+    python tools/bench_save_stall.py                 # 20k users, 10 saves
+    python tools/bench_save_stall.py --users 50000 --saves 5 --layout sharded
+
+Storage runs against tools/fake_github.py (in a child process, so the fake's
+own JSON parsing doesn't compete for our GIL) with users carrying
+realistic chat history and notes. Each save dirties a handful of users.
+bot/loopmon.py samples loop lag every 5 ms; "before" renders + base64-encodes
+the snapshot on the event loop (backend.offload = False), "after" is the
+default worker-thread path.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GITHUB_TOKEN", "bench")
+os.environ.setdefault("GITHUB_REPO", "bench/data")
+
+from bot.http_clients import http_clients  # noqa: E402
+from bot.loopmon import LoopMonitor  # noqa: E402
+from bot.storage import GitHubFileBackend, GitHubShardedBackend, Storage  # noqa: E402
+
+
+def _spawn_fake(port: int) -> subprocess.Popen:
+    fake = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_github.py")
+    proc = subprocess.Popen([sys.executable, fake, "--port", str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit(f"fake_github.py did not start on port {port}")
+
+
+def _populate(storage: Storage, users: int):
+    rng = random.Random(3)
+    for uid in range(users):
+        u = storage.get_user(uid)
+        u["first_name"] = f"Имя{uid % 997}"
+        u["notes"] = [f"заметка {uid}-{i}" for i in range(rng.randrange(4))]
+        u["memory"] = {"city": "Milano", "likes": "синтезаторы"} if uid % 3 == 0 else {}
+        u["chat_history"] = [{"role": "user" if i % 2 == 0 else "assistant",
+                              "content": "привет, как дела? " * rng.randrange(1, 8)}
+                             for i in range(rng.randrange(0, 12))]
+
+
+async def _run(layout: str, users: int, saves: int, port: int):
+    api = f"http://127.0.0.1:{port}"
+    backend = GitHubShardedBackend(api) if layout == "sharded" else GitHubFileBackend(api)
+    storage = Storage(backend)
+    storage.write_behind = False
+    await storage.load()
+    _populate(storage, users)
+    await storage.flush()
+    print(f"layout={layout} users={users:,} saves={saves}")
+
+    monitor = LoopMonitor(interval_ms=5, warn_ms=10 ** 6)
+    monitor.start()
+    rng = random.Random(9)
+    for label, offload in (("before (render on loop)", False), ("after  (worker thread)", True)):
+        backend.offload = offload
+        await asyncio.sleep(0.1)
+        monitor.reset()
+        for _ in range(saves):
+            for uid in rng.sample(range(users), 20):
+                storage.get_user(uid)["notes"].append("ещё одна")
+            await storage.flush()
+            await asyncio.sleep(0.02)
+        st = monitor.stats()
+        print(f"{label}: loop lag p99 {st['p99_ms']:7.1f} ms   max {st['max_ms']:7.1f} ms")
+    await monitor.stop()
+    await http_clients.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=20_000)
+    ap.add_argument("--saves", type=int, default=10)
+    ap.add_argument("--layout", choices=("file", "sharded"), default="file")
+    ap.add_argument("--port", type=int, default=8767)
+    args = ap.parse_args()
+    fake = _spawn_fake(args.port)
+    try:
+        asyncio.run(_run(args.layout, args.users, args.saves, args.port))
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+if __name__ == "__main__":
+    main()
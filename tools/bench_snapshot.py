@@ -0,0 +1,107 @@
+"""Snapshot format benchmark: size and peak memory of legacy JSON vs v1.
+
+    python tools/bench_snapshot.py                  # 50k users
+    python tools/bench_snapshot.py --users 200000
+
+"legacy" is the pre-v1 path: one json.dumps of the whole state → utf-8 →
+base64 to save; base64 → decode → json.loads to load. "v1" is what the GitHub
+backends do now: entry lines streamed through zlib and base64 on save, and
+SnapshotReader fed in network-sized chunks on load (it wraps records in
+compact records as it goes, like Storage does right after load). Peak memory is measured
+with tracemalloc in a second run and excludes the state itself (built before measuring).
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.storage import (SnapshotReader, _B64_SLICE, _b64_stream, _dumps, _new_user,  # noqa: E402
+                         _record_line, _snapshot_stream, _top_line)
+
+
+def _state(users: int) -> dict:
+    rng = random.Random(5)
+    data = {"users": {}, "groups": {}, "reminders": [], "stats": {}}
+    for i in range(users):
+        u = _new_user(i)
+        u["first_name"] = f"Имя{i % 997}"
+        u["notes"] = [f"заметка {i}-{n}" for n in range(rng.randrange(4))]
+        u["chat_history"] = [{"role": "user", "content": "привет, как дела? " * rng.randrange(1, 6)}
+                             for _ in range(rng.randrange(0, 8))]
+        data["users"][str(i)] = u
+    return data
+
+
+def _measure(fn):
+    # Timed untraced: tracemalloc slows allocation-heavy code several-fold
+    t0 = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    out = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def _legacy_encode(data: dict) -> bytes:
+    return base64.b64encode(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+def _v1_encode(data: dict) -> bytes:
+    def lines():
+        for key, value in data.items():
+            if key == "users":
+                for rid, record in value.items():
+                    yield _record_line(key, rid, _dumps(record))
+            else:
+                yield _top_line(key, _dumps(value))
+    return _b64_stream(_snapshot_stream(lines()))
+
+
+def _legacy_decode(b64: bytes) -> dict:
+    return json.loads(base64.b64decode(b64).decode("utf-8"))
+
+
+def _v1_decode(raw: bytes, keep_digests: bool) -> dict:
+    reader = SnapshotReader(keep_digests)
+    for i in range(0, len(raw), _B64_SLICE):
+        reader.feed(raw[i:i + _B64_SLICE])
+    return reader.finish()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=50_000)
+    args = ap.parse_args()
+    data = _state(args.users)
+
+    legacy_b64, legacy_enc_s, legacy_enc_peak = _measure(lambda: _legacy_encode(data))
+    v1_b64, v1_enc_s, v1_enc_peak = _measure(lambda: _v1_encode(data))
+    legacy_raw = base64.b64decode(legacy_b64)
+    v1_raw = base64.b64decode(v1_b64)
+    del data
+    _, legacy_dec_s, legacy_dec_peak = _measure(lambda: _legacy_decode(legacy_b64))
+    _, v1_dec_s, v1_dec_peak = _measure(lambda: _v1_decode(v1_raw, False))
+    _, v1d_dec_s, v1d_dec_peak = _measure(lambda: _v1_decode(v1_raw, True))
+
+    mb = 1024 * 1024
+    print(f"users={args.users:,}")
+    print(f"{'':8} {'stored':>10} {'save peak':>10} {'save':>8} {'load peak':>10} {'load':>8}")
+    print(f"{'legacy':8} {len(legacy_raw) / mb:9.1f}M {legacy_enc_peak / mb:9.1f}M {legacy_enc_s:7.2f}s "
+          f"{legacy_dec_peak / mb:9.1f}M {legacy_dec_s:7.2f}s")
+    print(f"{'v1':8} {len(v1_raw) / mb:9.1f}M {v1_enc_peak / mb:9.1f}M {v1_enc_s:7.2f}s "
+          f"{v1_dec_peak / mb:9.1f}M {v1_dec_s:7.2f}s")
+    print(f"{'v1+hash':8} {'':10} {'':10} {'':8} {v1d_dec_peak / mb:9.1f}M {v1d_dec_s:7.2f}s")
+    print("(load peak includes the decoded state; v1+hash also keeps a digest of every record's\n"
+          " JSON, which Storage uses as its cache instead of re-serializing on load)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Replay benchmark: streaming-response parsing, line-at-a-time vs bot/sse.py.
+
+    python tools/bench_sse.py                      # synthetic streams, 2000 deltas each
+    python tools/bench_sse.py --deltas 500 --rounds 50
+    python tools/bench_sse.py --replay openai=capture.sse --replay gemini=g.sse
+
+Streams are replayed into a real aiohttp StreamReader as a sequence of
+network reads (random 1-1400 byte pieces, fixed seed, one loop turn apart), so
+both sides pay what they pay in production. "before" is the old loop: `async
+for line in resp.content` (one readline() per line), decode + strip every
+line, json-parse each `data:` line on its own. "after" is ai._sse_deltas():
+one SSEParser.feed() per read plus the provider's delta extractor.
+
+A capture for --replay is the raw response body, e.g.
+    curl -N https://api.openai.com/v1/chat/completions ... > capture.sse
+
+The "edge" stream has multi-line `data:` events and comment lines; the old loop
+silently drops the multi-line ones, which the delta counts show.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp  # noqa: E402
+from aiohttp.base_protocol import BaseProtocol  # noqa: E402
+
+from bot.ai import _anthropic_delta, _gemini_delta, _openai_delta, _sse_deltas  # noqa: E402
+
+EXTRACTORS = {"openai": _openai_delta, "anthropic": _anthropic_delta,
+              "gemini": _gemini_delta, "edge": _openai_delta}
+WORDS = ("the", " quick", " brown", " fox", " перепрыгнул", " через", " ленивую", " собаку", ",", " 🙂", "\n")
+
+
+def _synthetic(provider: str, deltas: int) -> bytes:
+    rng = random.Random(provider)
+    out = []
+    if provider == "anthropic":
+        out.append(b'event: message_start\ndata: {"type":"message_start","message":{"id":"msg_1"}}\n\n')
+    for i in range(deltas):
+        text = rng.choice(WORDS)
+        if provider == "openai":
+            obj = {"id": "chatcmpl-1", "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": text}}]}
+            out.append(b"data: " + json.dumps(obj).encode() + b"\n\n")
+            if i % 200 == 0:
+                out.append(b": keep-alive\n\n")
+        elif provider == "anthropic":
+            obj = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}}
+            out.append(b"event: content_block_delta\ndata: " + json.dumps(obj).encode() + b"\n\n")
+        elif provider == "gemini":
+            obj = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}]}
+            out.append(b"data: " + json.dumps(obj).encode() + b"\r\n\r\n")
+        else:  # edge: every third event pretty-printed over several data: lines
+            obj = {"choices": [{"delta": {"content": text}}]}
+            if i % 3 == 0:
+                lines = json.dumps(obj, indent=1).encode().split(b"\n")
+                out.append(b"".join(b"data: " + line + b"\n" for line in lines) + b"\n")
+            else:
+                out.append(b": ping\nid: " + str(i).encode() + b"\ndata:" + json.dumps(obj).encode() + b"\n\n")
+    if provider == "anthropic":
+        out.append(b'event: message_stop\ndata: {"type":"message_stop"}\n\n')
+    elif provider in ("openai", "edge"):
+        out.append(b"data: [DONE]\n\n")
+    return b"".join(out)
+
+
+def _reads(body: bytes, seed: int = 7):
+    rng = random.Random(seed)
+    reads, pos = [], 0
+    while pos < len(body):
+        n = rng.randint(1, 1400)
+        reads.append(body[pos:pos + n])
+        pos += n
+    return reads
+
+
+async def _before(provider: str, content: aiohttp.StreamReader) -> list:
+    """The pre-sse.py stream loops of bot/ai.py, merged into one."""
+    deltas = []
+    async for raw in content:
+        line = raw.decode("utf-8", errors="ignore").strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if not data:
+            continue
+        if data == "[DONE]":
+            break
+        try:
+            obj = json.loads(data)
+        except json.JSONDecodeError:
+            continue
+        if provider == "anthropic":
+            if obj.get("type") == "message_stop":
+                break
+            text = obj.get("delta", {}).get("text") if obj.get("type") == "content_block_delta" else None
+            if text:
+                deltas.append(text)
+        elif provider == "gemini":
+            for p in obj.get("candidates", [{}])[0].get("content", {}).get("parts", []):
+                if p.get("text"):
+                    deltas.append(p["text"])
+        else:
+            text = obj.get("choices", [{}])[0].get("delta", {}).get("content")
+            if text:
+                deltas.append(text)
+    return deltas
+
+
+class _Response:
+    """What _sse_deltas() needs from an aiohttp response."""
+
+    def __init__(self, content: aiohttp.StreamReader):
+        self.content = content
+
+
+async def _after(provider: str, content: aiohttp.StreamReader) -> list:
+    return [delta async for delta in _sse_deltas(_Response(content), EXTRACTORS[provider])]
+
+
+class _Transport:
+    def is_closing(self) -> bool:
+        return False
+
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+
+async def _replay(fn, provider: str, reads) -> list:
+    loop = asyncio.get_running_loop()
+    protocol = BaseProtocol(loop)
+    protocol.transport = _Transport()  # "connected"
+    content = aiohttp.StreamReader(protocol, 2 ** 16, loop=loop)
+
+    async def network():
+        for chunk in reads:
+            content.feed_data(chunk)
+            await asyncio.sleep(0)
+        content.feed_eof()
+
+    feeder = asyncio.ensure_future(network())
+    deltas = await fn(provider, content)
+    await feeder
+    return deltas
+
+
+async def _measure(fn, provider, reads, rounds):
+    await _replay(fn, provider, reads)  # warm-up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        deltas = await _replay(fn, provider, reads)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    await _replay(fn, provider, reads)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return deltas, elapsed / rounds, peak
+
+
+async def _main(streams, rounds):
+    print(f"{'stream':<22}{'KB':>7}{'reads':>7} | {'deltas':>13} | {'deltas/s before':>16}{'after':>12}"
+          f"{'speed-up':>10} | {'peak KB before':>15}{'after':>7}")
+    for label, provider, body in streams:
+        reads = _reads(body)
+        old, t_old, m_old = await _measure(_before, provider, reads, rounds)
+        new, t_new, m_new = await _measure(_after, provider, reads, rounds)
+        print(f"{label:<22}{len(body) / 1024:7.0f}{len(reads):7} | {len(old):>6}/{len(new):<6} | "
+              f"{len(old) / t_old:16,.0f}{len(new) / t_new:12,.0f}{t_old / t_new:9.2f}x | "
+              f"{m_old / 1024:15.0f}{m_new / 1024:7.0f}")
+    print("deltas = recovered before/after; peak KB = tracemalloc peak while replaying one stream")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--deltas", type=int, default=2000, help="deltas per synthetic stream")
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--replay", action="append", default=[], metavar="PROVIDER=FILE",
+                    help="replay a captured response body (openai, anthropic or gemini format)")
+    args = ap.parse_args()
+
+    streams = []
+    for spec in args.replay:
+        provider, _, path = spec.partition("=")
+        if provider not in EXTRACTORS:
+            ap.error(f"unknown provider {provider!r} in --replay")
+        with open(path, "rb") as f:
+            streams.append((f"{provider} ({os.path.basename(path)})", provider, f.read()))
+    if not streams:
+        streams = [(p, p, _synthetic(p, args.deltas)) for p in ("openai", "anthropic", "gemini", "edge")]
+
+    asyncio.run(_main(streams, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
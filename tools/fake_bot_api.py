@@ -0,0 +1,159 @@
+"""Local stand-in for the slice of the Telegram Bot API that bulk sends use.
+
+Serves /bot<token>/<method> for getMe, sendMessage, editMessageText and
+sendChatAction, and enforces Telegram's flood limits the way the real API
+does: past ~RATE calls a second bot-wide, or a second call within a private
+chat's 1 s (3 s in a group), it answers 429 with parameters.retry_after.
+Chats listed as blocked get 403 "Forbidden: bot was blocked by the user".
+Every delivered message is counted per chat, so duplicates show up.
+
+    python tools/fake_bot_api.py --port 8081 --latency-ms 50 --blocked 5,17
+    Bot(token, base_url="http://127.0.0.1:8081/bot")     # python-telegram-bot
+
+tools/bench_broadcast.py runs it in-process.
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+from aiohttp import web
+
+# Per-chat spacing the fake enforces, seconds (a little under bot/flood.py's,
+# so network jitter alone doesn't trip it)
+PRIVATE_SPACING = 0.9
+GROUP_SPACING = 2.7
+RETRY_AFTER_S = 1
+
+
+class FakeBotAPI:
+    def __init__(self, rate: float = 30, latency_ms: float = 0, blocked: Iterable[int] = ()):
+        self.rate = rate
+        self.latency = latency_ms / 1000
+        self.blocked = set(blocked)
+        self._tokens = float(rate)    # bot-wide bucket, one second deep
+        self._at = time.monotonic()
+        self._last = {}               # chat_id -> monotonic time of the last accepted call
+        self._message_id = 0
+        self.calls = Counter()        # method -> calls
+        self.delivered = Counter()    # chat_id -> sendMessage calls that succeeded
+        self.edits = Counter()        # chat_id -> successful edits
+        self.too_many = 0             # 429s
+        self.forbidden = 0            # 403s
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+
+    def reset(self):
+        self.calls.clear()
+        self.delivered.clear()
+        self.edits.clear()
+        self.too_many = self.forbidden = 0
+        self.first_at = self.last_at = None
+
+    # ---- limits ----
+
+    def _global_ok(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._at) * self.rate)
+        self._at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _chat_ok(self, chat_id: int) -> bool:
+        now = time.monotonic()
+        spacing = GROUP_SPACING if chat_id < 0 else PRIVATE_SPACING
+        if now - self._last.get(chat_id, -spacing) < spacing:
+            return False
+        self._last[chat_id] = now
+        return True
+
+    # ---- responses ----
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(code: int, description: str, **parameters) -> web.Response:
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    def _message(self, chat_id: int, text: str, message_id: Optional[int] = None) -> dict:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        return {"message_id": message_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"}}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            return self._ok({"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"})
+        if method not in ("sendMessage", "editMessageText", "sendChatAction"):
+            return self._error(404, "Not Found: method not found")
+
+        chat_id = int(params.get("chat_id", 0))
+        if chat_id in self.blocked:
+            self.forbidden += 1
+            return self._error(403, "Forbidden: bot was blocked by the user")
+        if method == "sendChatAction":
+            return self._ok(True)
+        if not self._global_ok() or not self._chat_ok(chat_id):
+            self.too_many += 1
+            return self._error(429, f"Too Many Requests: retry after {RETRY_AFTER_S}", retry_after=RETRY_AFTER_S)
+
+        now = time.monotonic()
+        self.first_at = self.first_at or now
+        self.last_at = now
+        if method == "sendMessage":
+            self.delivered[chat_id] += 1
+            return self._ok(self._message(chat_id, params.get("text", "")))
+        self.edits[chat_id] += 1
+        return self._ok(self._message(chat_id, params.get("text", ""), int(params.get("message_id", 0))))
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        return app
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "delivered": sum(self.delivered.values()),
+                "duplicates": sum(n - 1 for n in self.delivered.values() if n > 1),
+                "429": self.too_many, "403": self.forbidden}
+
+
+async def start(api: FakeBotAPI, port: int) -> web.AppRunner:
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--rate", type=float, default=30, help="bot-wide calls per second before 429")
+    ap.add_argument("--latency-ms", type=float, default=0, help="added to every call")
+    ap.add_argument("--blocked", default="", help="comma-separated chat ids that get 403")
+    args = ap.parse_args()
+    blocked = [int(c) for c in args.blocked.split(",") if c.strip()]
+    api = FakeBotAPI(rate=args.rate, latency_ms=args.latency_ms, blocked=blocked)
+    web.run_app(api.app(), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""In-memory stand-in for the slice of the GitHub REST API that bot/storage.py uses.
+
+Covers the Contents API (single-file layout) and the Git Data API
+(refs/commits/trees/blobs — sharded layout). State lives in memory and is
+shared between both APIs, so switching STORAGE_LAYOUT can be exercised too.
+
+    python tools/fake_github.py --port 8765
+    GITHUB_API_URL=http://127.0.0.1:8765 GITHUB_TOKEN=x GITHUB_REPO=me/data python main.py
+
+    python tools/fake_github.py --selftest   # round-trips Storage against it
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import sys
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeRepo:
+    def __init__(self, branch: str = "main"):
+        self.branch = branch
+        self.blobs = {}    # sha -> bytes
+        self.trees = {}    # sha -> {path: blob_sha}  (flat, full paths)
+        self.commits = {}  # sha -> {"tree": sha, "parents": [...]}
+        self.refs = {}     # branch -> commit sha
+        self.calls = Counter()
+        root = self._put_tree({})
+        self.refs[branch] = self._put_commit(root, [])
+
+    @staticmethod
+    def _sha(kind: str, payload: bytes) -> str:
+        return hashlib.sha1(kind.encode() + b"\0" + payload).hexdigest()
+
+    def _put_blob(self, content: bytes) -> str:
+        sha = self._sha("blob", content)
+        self.blobs[sha] = content
+        return sha
+
+    def _put_tree(self, entries: dict) -> str:
+        sha = self._sha("tree", json.dumps(entries, sort_keys=True).encode())
+        self.trees[sha] = dict(entries)
+        return sha
+
+    def _put_commit(self, tree: str, parents: list) -> str:
+        sha = self._sha("commit", json.dumps([tree, parents, len(self.commits)]).encode())
+        self.commits[sha] = {"tree": tree, "parents": parents}
+        return sha
+
+    def head_files(self) -> dict:
+        return self.trees[self.commits[self.refs[self.branch]]["tree"]]
+
+    # ---- Contents API ----
+
+    async def get_contents(self, request):
+        self.calls["GET contents"] += 1
+        path = request.match_info["path"]
+        sha = self.head_files().get(path)
+        if sha is None:
+            return web.json_response({"message": "Not Found"}, status=404)
+        content = self.blobs[sha]
+        # Mirror GitHub: no inline content above 1 MB
+        inline = base64.encodebytes(content).decode() if len(content) <= 1_000_000 else ""
+        return web.json_response({"path": path, "sha": sha, "content": inline,
+                                  "encoding": "base64" if inline else "none"})
+
+    async def put_contents(self, request):
+        self.calls["PUT contents"] += 1
+        path = request.match_info["path"]
+        body = await request.json()
+        files = dict(self.head_files())
+        if files.get(path) != body.get("sha"):
+            return web.json_response({"message": "sha mismatch"}, status=409)
+        files[path] = self._put_blob(base64.b64decode(body["content"]))
+        tree = self._put_tree(files)
+        self.refs[self.branch] = self._put_commit(tree, [self.refs[self.branch]])
+        return web.json_response({"content": {"path": path, "sha": files[path]}}, status=200)
+
+    # ---- Git Data API ----
+
+    async def get_repo(self, request):
+        self.calls["GET repo"] += 1
+        return web.json_response({"default_branch": self.branch})
+
+    async def get_ref(self, request):
+        self.calls["GET ref"] += 1
+        sha = self.refs.get(request.match_info["branch"])
+        if sha is None:
+            return web.json_response({"message": "Not Found"}, status=404)
+        return web.json_response({"object": {"sha": sha, "type": "commit"}})
+
+    async def patch_ref(self, request):
+        self.calls["PATCH ref"] += 1
+        branch = request.match_info["branch"]
+        body = await request.json()
+        new = self.commits.get(body["sha"])
+        if new is None:
+            return web.json_response({"message": "Object does not exist"}, status=422)
+        if not body.get("force") and self.refs.get(branch) not in new["parents"]:
+            return web.json_response({"message": "Update is not a fast forward"}, status=422)
+        self.refs[branch] = body["sha"]
+        return web.json_response({"object": {"sha": body["sha"], "type": "commit"}})
+
+    async def get_commit(self, request):
+        self.calls["GET commit"] += 1
+        sha = request.match_info["sha"]
+        commit = self.commits.get(sha)
+        if commit is None:
+            return web.json_response({"message": "Not Found"}, status=404)
+        return web.json_response({"sha": sha, "tree": {"sha": commit["tree"]},
+                                  "parents": [{"sha": p} for p in commit["parents"]]})
+
+    async def post_commit(self, request):
+        self.calls["POST commit"] += 1
+        body = await request.json()
+        if body["tree"] not in self.trees:
+            return web.json_response({"message": "Tree not found"}, status=422)
+        sha = self._put_commit(body["tree"], body.get("parents", []))
+        return web.json_response({"sha": sha, "tree": {"sha": body["tree"]}}, status=201)
+
+    async def get_tree(self, request):
+        self.calls["GET tree"] += 1
+        entries = self.trees.get(request.match_info["sha"])
+        if entries is None:
+            return web.json_response({"message": "Not Found"}, status=404)
+        return web.json_response({
+            "sha": request.match_info["sha"],
+            "tree": [{"path": p, "type": "blob", "mode": "100644", "sha": s} for p, s in entries.items()],
+            "truncated": False,
+        })
+
+    async def post_tree(self, request):
+        self.calls["POST tree"] += 1
+        body = await request.json()
+        files = dict(self.trees.get(body.get("base_tree"), {}))
+        for entry in body["tree"]:
+            if entry.get("sha") is None:
+                files.pop(entry["path"], None)
+            else:
+                files[entry["path"]] = entry["sha"]
+        return web.json_response({"sha": self._put_tree(files)}, status=201)
+
+    async def post_blob(self, request):
+        self.calls["POST blob"] += 1
+        body = await request.json()
+        raw = body["content"]
+        content = base64.b64decode(raw) if body.get("encoding") == "base64" else raw.encode("utf-8")
+        return web.json_response({"sha": self._put_blob(content)}, status=201)
+
+    async def get_blob(self, request):
+        self.calls["GET blob"] += 1
+        content = self.blobs.get(request.match_info["sha"])
+        if content is None:
+            return web.json_response({"message": "Not Found"}, status=404)
+        if "raw" in request.headers.get("Accept", ""):
+            return web.Response(body=content, content_type="application/octet-stream")
+        return web.json_response({"sha": request.match_info["sha"], "size": len(content),
+                                  "content": base64.encodebytes(content).decode(), "encoding": "base64"})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        repo = "/repos/{owner}/{name}"
+        app.router.add_get(repo, self.get_repo)
+        app.router.add_get(repo + "/contents/{path:.+}", self.get_contents)
+        app.router.add_put(repo + "/contents/{path:.+}", self.put_contents)
+        app.router.add_get(repo + "/git/ref/heads/{branch:.+}", self.get_ref)
+        app.router.add_patch(repo + "/git/refs/heads/{branch:.+}", self.patch_ref)
+        app.router.add_get(repo + "/git/commits/{sha}", self.get_commit)
+        app.router.add_post(repo + "/git/commits", self.post_commit)
+        app.router.add_get(repo + "/git/trees/{sha}", self.get_tree)
+        app.router.add_post(repo + "/git/trees", self.post_tree)
+        app.router.add_get(repo + "/git/blobs/{sha}", self.get_blob)
+        app.router.add_post(repo + "/git/blobs", self.post_blob)
+        return app
+
+
+async def _start(repo: FakeRepo, port: int) -> web.AppRunner:
+    runner = web.AppRunner(repo.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def _selftest(port: int) -> int:
+    os.environ.setdefault("GITHUB_TOKEN", "selftest")
+    os.environ.setdefault("GITHUB_REPO", "selftest/data")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from bot.http_clients import http_clients
+    from bot.storage import GitHubFileBackend, GitHubShardedBackend, Storage
+
+    repo = FakeRepo()
+    runner = await _start(repo, port)
+    api = f"http://127.0.0.1:{port}"
+    try:
+        # 1. Legacy single file → sharded import
+        legacy = Storage(GitHubFileBackend(api))
+        legacy.write_behind = False
+        await legacy.load()
+        for uid in range(200):
+            legacy.get_user(uid)["notes"].append(f"note {uid}")
+        legacy.get_group(-100)["rules"] = "be nice"
+        await legacy.save()
+
+        sharded = Storage(GitHubShardedBackend(api))
+        sharded.write_behind = False
+        await sharded.load()
+        assert len(sharded.data["users"]) == 200, "legacy import lost users"
+        await sharded.save()
+        first = repo.calls["POST blob"]
+        assert first == sharded.backend.shards + 2, f"first sharded save wrote {first} blobs"
+
+        # 2. One user changes → exactly one shard blob
+        sharded.get_user(7)["notes"].append("changed")
+        await sharded.save()
+        assert repo.calls["POST blob"] - first == 1, "expected a single shard upload"
+
+        # 3. Nothing changed → no commit at all
+        commits = repo.calls["POST commit"]
+        sharded.get_user(7)
+        await sharded.save()
+        assert repo.calls["POST commit"] == commits, "no-op save produced a commit"
+
+        # 4. A flush (the write-behind flusher, another task) lands between a
+        #    handler's get_user() and its change → its save() still writes it
+        user = sharded.get_user(9)
+        await asyncio.create_task(sharded.flush())
+        user["notes"].append("after flush")
+        commits = repo.calls["POST commit"]
+        await sharded.save()
+        assert repo.calls["POST commit"] == commits + 1, "change after a flush was not saved"
+
+        # 5. Fresh process reads the shards back
+        again = Storage(GitHubShardedBackend(api))
+        await again.load()
+        assert again.data["users"]["7"]["notes"] == ["note 7", "changed"]
+        assert again.data["users"]["9"]["notes"] == ["note 9", "after flush"]
+        assert again.data["groups"]["-100"]["rules"] == "be nice"
+    finally:
+        await http_clients.close()
+        await runner.cleanup()
+    print("selftest OK:", dict(repo.calls))
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--selftest", action="store_true", help="run Storage against the fake and exit")
+    args = ap.parse_args()
+    if args.selftest:
+        sys.exit(asyncio.run(_selftest(args.port)))
+    web.run_app(FakeRepo().app(), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
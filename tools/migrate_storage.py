@@ -0,0 +1,66 @@
+"""Import existing bot state into the local SQLite backend.
+
+    python tools/migrate_storage.py bot_data.json      # from a downloaded file (either format)
+    python tools/migrate_storage.py --from-github      # straight from GITHUB_REPO
+
+The target database is STORAGE_SQLITE_PATH (or --db). Existing rows in it are
+replaced. Afterwards set STORAGE_BACKEND=sqlite and restart the bot.
+"""
+import argparse
+import asyncio
+import os
+import zlib
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.config import STORAGE_LAYOUT, STORAGE_SQLITE_PATH  # noqa: E402
+from bot.http_clients import http_clients  # noqa: E402
+from bot.storage import SQLiteBackend, Storage, make_backend, read_snapshot  # noqa: E402
+
+
+async def _read_source(args) -> dict:
+    if args.from_github:
+        backend = make_backend("github", STORAGE_LAYOUT)
+        if backend is None:
+            raise SystemExit("GITHUB_TOKEN / GITHUB_REPO are not set.")
+        source = Storage(backend)
+        await source.load()
+        await http_clients.close()
+        if not source.loaded:
+            raise SystemExit("Could not read data from GitHub (see log above).")
+        return source.data
+    try:
+        return read_snapshot(args.path)
+    except (ValueError, zlib.error) as e:
+        raise SystemExit(f"{args.path}: {e}")
+
+
+async def _main(args) -> int:
+    data = await _read_source(args)
+    target = SQLiteBackend(args.db)
+    await target.import_all(data)
+    # Read it back through the normal load path as a sanity check.
+    check = Storage(SQLiteBackend(args.db))
+    await check.load()
+    await check.backend.close()
+    await target.close()
+    users, groups = len(check.data["users"]), len(check.data["groups"])
+    if users != len(data.get("users", {})) or groups != len(data.get("groups", {})):
+        print(f"Mismatch after import: {users} users, {groups} groups in {args.db}")
+        return 1
+    print(f"Imported {users} users, {groups} groups into {args.db}")
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("path", nargs="?", help="bot_data.json to import")
+    src.add_argument("--from-github", action="store_true", help="read the current GitHub data")
+    ap.add_argument("--db", default=STORAGE_SQLITE_PATH, help=f"SQLite file (default {STORAGE_SQLITE_PATH})")
+    sys.exit(asyncio.run(_main(ap.parse_args())))
+
+
+if __name__ == "__main__":
+    main()